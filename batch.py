@@ -0,0 +1,403 @@
+# Python version 3.7
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util as multiprocessing_util
+
+import cv2
+from core import detection_cache
+from core import detector
+from core import image_processor as processor
+from core import tiled
+from utils import kernel_utils
+from utils import processing_utils as utils
+
+
+# Image files picked up when a directory is given as input
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Processing ranges, matching the sliders and rotation dial of the main window
+BRIGHTNESS_RANGE = (-50, 50)
+CONTRAST_RANGE = (-50, 50)
+ROTATION_RANGE = (0, 270)
+
+# Per process worker state, created once by the pool initializer
+_worker = None
+
+
+class BatchWorker:
+    """Headless detection and processing of single image files, one instance per worker process"""
+
+    def __init__(self, settings, output_dir, detect=True, detect_eyes=True, tile_size=None, cache_path=None,
+                 profile=None, max_face_size=None):
+        """
+        Constructor
+        :param settings: Mapping of processing settings (brightness, contrast, filter, rotation)
+        :param output_dir: Directory which receives the processed images and their JSON results
+        :param detect: Run face detection on every image
+        :param detect_eyes: Also detect eyes in every face
+        :param tile_size: Process the chain in tiles of this size (bounding scratch memory), None for whole images
+        :param cache_path: Detection cache database, unchanged images skip detection (None to always detect)
+        :param profile: DetectionProfile, the default profile when not given
+        :param max_face_size: Largest expected face (pixels), large images are then searched in tiles
+        """
+        self._settings = settings
+        self._output_dir = output_dir
+        self._tile_size = tile_size
+        self._max_face_size = max_face_size
+        # The detector is only created once per worker, its cascades are parsed on the first detection
+        # Worker processes already use every core, so eyes (and tiles) are detected sequentially
+        self._cache = detection_cache.open_cache(cache_path) if detect and cache_path else None
+        self._detector = detector.Detector(detect_eyes, eye_workers=1, tile_workers=1, cache=self._cache,
+                                           profile=profile) if detect else None
+        (self._rotation_processor, self._processors) = build_processors(settings)
+
+    def flush(self):
+        """
+        Write back what the worker holds in memory (the uses of detection cache hits)
+        :return:
+        """
+        if self._cache is not None:
+            self._cache.flush()
+
+    def close(self):
+        """
+        Release the detector and close the detection cache
+        :return:
+        """
+        if self._detector is not None:
+            self._detector.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    def process_file(self, image_path, output_name=None):
+        """
+        Detect faces in an image, apply the processor chain and write out the results
+        :param image_path: Path to the image
+        :param output_name: Path of the processed image relative to the output directory (see output_names),
+                            defaults to the image's file name
+        :return: The result dictionary that was written next to the processed image
+        """
+        output_path = os.path.join(self._output_dir, output_name or os.path.basename(image_path))
+        result = {"input": image_path, "settings": self._settings}
+
+        color_img = cv2.imread(image_path)
+        if color_img is None:
+            result["error"] = "Image could not be read"
+            return result
+
+        (h, w) = color_img.shape[:2]
+        result["width"] = w
+        result["height"] = h
+        timings = {}
+
+        if self._detector is not None:
+            start = time.perf_counter()
+            grayscale_img = cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY)
+            hits = self._cache.hits if self._cache is not None else 0
+            detections = self._detector.detect(grayscale_img, max_face_size=self._max_face_size)
+            timings["detect"] = time.perf_counter() - start
+            if self._cache is not None:
+                result["cache_hit"] = self._cache.hits > hits
+            result["faces"] = self._detector.faces()
+            result["face_boxes"] = detections.faces.tolist()
+            result["eye_boxes"] = [e.tolist() for e in detections.eyes]
+            result["scores"] = detections.scores.tolist()
+
+        start = time.perf_counter()
+        rotated_img = self._rotation_processor.run(color_img, color_img)
+        if self._tile_size:
+            # Only the output is allocated at full size, intermediate images are tile sized
+            processed_img = tiled.process_tiled(self._processors, rotated_img, tile_size=self._tile_size, workers=1)
+        else:
+            processed_img = processor.process_chain(self._processors, rotated_img, rotated_img)
+        timings["process"] = time.perf_counter() - start
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, processed_img)
+        result["output"] = output_path
+        result["timings"] = timings
+
+        with open(os.path.splitext(output_path)[0] + ".json", 'w') as f:
+            json.dump(result, f, indent=2)
+
+        return result
+
+
+def build_processors(settings):
+    """
+    Create the processor chain in the same order the main window applies it
+    :param settings: Mapping of processing settings (brightness, contrast, filter, rotation), with an optional
+                     kernel file which replaces the filter
+    :return: A 2-tuple of (rotation processor, list of processors applied after rotation)
+    """
+    kernels = utils.Kernels().kernels_list
+
+    rotation_processor = processor.RotationProcessor(utils.ProcessingBehavior(ROTATION_RANGE, "Rotation", 0),
+                                                     processor.FINAL_INTERPOLATION)
+    rotation_processor.set_unique_value(settings["rotation"])
+
+    processors = [
+        processor.BrightnessProcessor(utils.ProcessingBehavior(BRIGHTNESS_RANGE, "Brightness", 0)),
+        processor.ContrastProcessor(utils.ProcessingBehavior(CONTRAST_RANGE, "Contrast", 0)),
+        processor.FilterProcessor(utils.ProcessingBehavior((0, len(kernels) - 1), "Filter:", 0))
+    ]
+    for (p, key) in zip(processors, ("brightness", "contrast", "filter")):
+        p.set_unique_value(settings[key])
+
+    if settings.get("kernel"):
+        kernel_filter = processors[-1]
+        kernel_filter.set_unique_value(kernel_filter.add_kernel(
+            os.path.basename(settings["kernel"]), kernel_utils.load_kernel(settings["kernel"])))
+
+    return rotation_processor, processors
+
+
+def collect_images(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of image paths
+    :param inputs: Directories, glob patterns or image paths
+    :return: List of image paths
+    """
+    paths = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for f in os.listdir(entry):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.add(os.path.join(entry, f))
+        else:
+            paths.update(p for p in glob.glob(entry, recursive=True) if os.path.isfile(p))
+
+    return sorted(paths)
+
+
+def output_names(image_paths):
+    """
+    Output paths of the images, relative to the output directory. Images keep their path relative to the deepest
+    directory holding all of them, so images of the same name from different directories never overwrite each other
+    :param image_paths: List of image paths
+    :return: List of relative output paths, in the same order as image_paths
+    """
+    if not image_paths:
+        return []
+
+    absolute_paths = [os.path.abspath(p) for p in image_paths]
+    root = os.path.commonpath([os.path.dirname(p) for p in absolute_paths])
+    return [os.path.relpath(p, root) for p in absolute_paths]
+
+
+def _init_worker(settings, output_dir, detect, detect_eyes, tile_size, cache_path, profile, max_face_size):
+    """
+    Process pool initializer, creates the worker state once per process
+    :return:
+    """
+    global _worker
+    _worker = BatchWorker(settings, output_dir, detect, detect_eyes, tile_size, cache_path, profile, max_face_size)
+    # Pool processes exit without running atexit handlers, multiprocessing finalizers do run
+    multiprocessing_util.Finalize(None, _worker.close, exitpriority=10)
+
+
+def _process_file(task):
+    """
+    Process an image on the worker created by _init_worker
+    :param task: 2-tuple of (image path, output path relative to the output directory)
+    :return: The result dictionary
+    """
+    (image_path, output_name) = task
+    try:
+        return _worker.process_file(image_path, output_name)
+    except Exception as e:
+        return {"input": image_path, "error": str(e)}
+
+
+def _process_files(tasks):
+    """
+    Process pool task, processes a chunk of images and flushes the worker once done (pool processes exit without
+    running atexit handlers, so nothing is left pending between chunks)
+    :param tasks: List of (image path, output path relative to the output directory)
+    :return: List of result dictionaries
+    """
+    results = [_process_file(task) for task in tasks]
+    _worker.flush()
+    return results
+
+
+def run_batch(image_paths, settings, output_dir, detect=True, workers=None, chunksize=8, detect_eyes=True,
+              tile_size=None, cache_path=None, profile=None, max_face_size=None):
+    """
+    Run detection and processing over a list of images across a process pool
+    :param image_paths: List of image paths
+    :param settings: Mapping of processing settings (brightness, contrast, filter, rotation)
+    :param output_dir: Directory which receives the processed images and their JSON results, in the subdirectories
+                       of the images (see output_names)
+    :param detect: Run face detection on every image
+    :param workers: Number of worker processes (defaults to the number of cores)
+    :param chunksize: Number of images handed to a worker at once
+    :param detect_eyes: Also detect eyes in every face
+    :param tile_size: Process the chain in tiles of this size (bounding scratch memory), None for whole images
+    :param cache_path: Detection cache database shared by the workers (None to always detect)
+    :param profile: DetectionProfile, the default profile when not given
+    :param max_face_size: Largest expected face (pixels), large images are then searched in tiles
+    :return: A generator of result dictionaries, in the same order as image_paths
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # Forked workers inherit the cascade files instead of each reading them from disk
+    if detect:
+        utils.CASCADE_REGISTRY.preload()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(settings, output_dir, detect, detect_eyes, tile_size, cache_path,
+                                       profile, max_face_size)) as executor:
+        tasks = list(zip(image_paths, output_names(image_paths)))
+        chunks = [tasks[i: i + chunksize] for i in range(0, len(tasks), chunksize)]
+        for results in executor.map(_process_files, chunks):
+            yield from results
+
+
+def positive_int(value):
+    """
+    Argument type of positive integers
+    :param value: Argument text
+    :return: The integer
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def add_processing_arguments(parser):
+    """
+    Add the processing and detection arguments shared by the headless tools
+    :param parser: ArgumentParser
+    :return:
+    """
+    num_kernels = len(utils.Kernels().kernels_list)
+
+    parser.add_argument("--brightness", type=int, default=0, help=f"Brightness {BRIGHTNESS_RANGE}")
+    parser.add_argument("--contrast", type=int, default=0, help=f"Contrast {CONTRAST_RANGE}")
+    parser.add_argument("--filter", type=int, default=0, help=f"Filter kernel index (0, {num_kernels - 1})")
+    parser.add_argument("--rotation", type=int, default=0, help=f"Rotation angle {ROTATION_RANGE}")
+    parser.add_argument("--kernel", default=None,
+                        help="Custom kernel file (one row per line, up to "
+                             f"{kernel_utils.MAX_KERNEL_SIZE}x{kernel_utils.MAX_KERNEL_SIZE}), replaces --filter")
+    parser.add_argument("--no-detect", action="store_true", help="Skip face detection")
+    parser.add_argument("--no-eyes", action="store_true", help="Only detect faces, skip eye detection")
+    parser.add_argument("--profile", default=detector.DEFAULT_PROFILE,
+                        help="Detection profile written by tune_detector.py (ie: fast, balanced, accurate)")
+    parser.add_argument("--profiles", default=detector.PROFILES_PATH, help="Detection profiles file")
+    parser.add_argument("--max-face-size", type=positive_int, default=None,
+                        help="Largest expected face (pixels), images larger than a few faces are then searched in "
+                             "overlapping tiles")
+
+
+def processing_settings(parser, args):
+    """
+    Validate the processing arguments (see add_processing_arguments), exits through the parser on errors
+    :param parser: ArgumentParser
+    :param args: Parsed arguments
+    :return: Mapping of processing settings (brightness, contrast, filter, rotation, kernel)
+    """
+    num_kernels = len(utils.Kernels().kernels_list)
+
+    for (name, (min_v, max_v)) in (("brightness", BRIGHTNESS_RANGE), ("contrast", CONTRAST_RANGE),
+                                   ("filter", (0, num_kernels - 1)), ("rotation", ROTATION_RANGE)):
+        if not min_v <= getattr(args, name) <= max_v:
+            parser.error(f"--{name} must be between {min_v} and {max_v}")
+
+    if args.kernel:
+        try:
+            kernel_utils.load_kernel(args.kernel)
+        except (IOError, ValueError) as e:
+            parser.error(f"--kernel: {e}")
+
+    return {
+        "brightness": args.brightness,
+        "contrast": args.contrast,
+        "filter": args.filter,
+        "rotation": args.rotation,
+        "kernel": args.kernel
+    }
+
+
+def detection_profile(parser, args):
+    """
+    Load the detection profile of the arguments (see add_processing_arguments), exits through the parser on errors
+    :param parser: ArgumentParser
+    :param args: Parsed arguments
+    :return: The DetectionProfile
+    """
+    try:
+        return detector.load_profile(args.profile, args.profiles)
+    except (KeyError, OSError, ValueError) as e:
+        parser.error(f"--profile: {e}")
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments
+    :param argv: Argument list (without the program name)
+    :return: Parsed arguments, with the validated processing settings as args.settings and the detection profile
+             as args.detection_profile
+    """
+    parser = argparse.ArgumentParser(description="Headless batch face detection and image processing")
+    parser.add_argument("inputs", nargs="+", help="Image directories, glob patterns or image files")
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    add_processing_arguments(parser)
+    parser.add_argument("-j", "--workers", type=positive_int, default=None, help="Number of worker processes")
+    parser.add_argument("--chunksize", type=positive_int, default=8, help="Images handed to a worker at once")
+    parser.add_argument("--tile-size", type=positive_int, default=None,
+                        help="Process images in tiles of this size, bounding memory for very large images")
+    parser.add_argument("--cache", nargs="?", const=detection_cache.DEFAULT_CACHE_PATH, default=None,
+                        help="Cache detections in this database, so unchanged images skip detection "
+                             f"(defaults to {detection_cache.DEFAULT_CACHE_PATH})")
+    args = parser.parse_args(argv)
+    args.settings = processing_settings(parser, args)
+    args.detection_profile = detection_profile(parser, args)
+
+    return args
+
+
+def main(argv=None):
+    """
+    Batch entry:
+     * Collects the images to process
+     * Runs detection and processing across all cores
+     * Prints a summary
+    :return: Process exit code
+    """
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        print("No images found")
+        return 1
+
+    start = time.perf_counter()
+    failed = 0
+    cache_hits = {True: 0, False: 0}
+    for result in run_batch(image_paths, args.settings, args.output, not args.no_detect, args.workers, args.chunksize,
+                            not args.no_eyes, args.tile_size, args.cache, args.detection_profile,
+                            args.max_face_size):
+        if "error" in result:
+            failed += 1
+            print(f"{result['input']}: {result['error']}")
+        if "cache_hit" in result:
+            cache_hits[result["cache_hit"]] += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(image_paths) - failed}/{len(image_paths)} images in {elapsed:.2f}s "
+          f"({len(image_paths) / elapsed:.1f} images/s)")
+    if args.cache:
+        print(f"Detection cache: {cache_hits[True]} hits, {cache_hits[False]} misses")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
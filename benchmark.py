@@ -0,0 +1,324 @@
+# Python version 3.7
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+import batch
+from core import detector
+from core import image_processor as processor
+from utils import processing_utils as utils
+
+
+# Images benchmarked besides the synthetic ones
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "images")
+
+# Synthetic image sizes (width, height)
+SYNTHETIC_SIZES = {
+    "VGA": (640, 480),
+    "HD": (1280, 720),
+    "FHD": (1920, 1080),
+    "4K": (3840, 2160),
+    "8K": (7680, 4320)
+}
+
+# Benchmark suites, in the order they run
+SUITES = ("processors", "detector", "display", "chain")
+
+# Processing settings of the full chain runs
+CHAIN_SETTINGS = {"brightness": 10, "contrast": 20, "filter": 1, "rotation": 30}
+
+# Relative slowdown of the median time, from which a result counts as a regression
+REGRESSION_THRESHOLD = 0.1
+
+# Qt objects of the display suite, kept alive for the whole run
+_qt_app = None
+_qt_label = None
+
+
+def time_call(f, warmup=1, repeat=5):
+    """
+    Time a callable: a few untimed warm-up runs (caches, lazy initialization), then repeated timed runs
+    :param f: Callable to time
+    :param warmup: Number of untimed runs
+    :param repeat: Number of timed runs
+    :return: Timing statistics (seconds): min, median, mean, stdev and the number of runs
+    """
+    for _ in range(warmup):
+        f()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "runs": len(timings)
+    }
+
+
+def synthetic_image(size, seed=0):
+    """
+    Create a reproducible synthetic color image: smooth gradients with noise, so filters and detection see texture
+    :param size: (width, height) of the image
+    :param seed: Random seed
+    :return: The BGR image
+    """
+    (w, h) = size
+    rng = np.random.RandomState(seed)
+    gradient = (np.add.outer(np.arange(h) * 255 // max(1, h - 1), np.arange(w) * 255 // max(1, w - 1)) // 2)
+    image = cv2.cvtColor(gradient.astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    noise = rng.randint(0, 32, (h, w, 3), dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+def load_images(images_dir=IMAGES_DIR, sizes=tuple(SYNTHETIC_SIZES)):
+    """
+    Load the benchmark images
+    :param images_dir: Directory of real images (None to skip them)
+    :param sizes: Names of the synthetic sizes to create
+    :return: List of (image name, BGR image) 2-tuples
+    """
+    images = []
+    if images_dir:
+        for path in batch.collect_images([images_dir]):
+            image = cv2.imread(path)
+            if image is not None:
+                images.append((os.path.basename(path), image))
+
+    for name in sizes:
+        images.append((f"synthetic_{name}", synthetic_image(SYNTHETIC_SIZES[name])))
+
+    return images
+
+
+def processor_cases():
+    """
+    Processors to benchmark, one case per ImageProcessor subclass (and per rotation interpolation)
+    :return: List of (case name, ImageProcessor) 2-tuples
+    """
+    def create(cls, value, *args):
+        p = cls(utils.ProcessingBehavior((-360, 360), cls.__name__, 0), *args)
+        p.set_unique_value(value)
+        return p
+
+    return [
+        ("BrightnessProcessor", create(processor.BrightnessProcessor, 20)),
+        ("ContrastProcessor", create(processor.ContrastProcessor, 20)),
+        # A dense 3x3 kernel and a separable (blurring) kernel
+        ("FilterProcessor[sharpening]", create(processor.FilterProcessor, 1)),
+        ("FilterProcessor[blurring]", create(processor.FilterProcessor, 2)),
+        ("RotationProcessor[preview]", create(processor.RotationProcessor, 30, processor.PREVIEW_INTERPOLATION)),
+        ("RotationProcessor[final]", create(processor.RotationProcessor, 30, processor.FINAL_INTERPOLATION))
+    ]
+
+
+def benchmark_cases(suites=SUITES, closing=None):
+    """
+    Create the benchmark cases of the given suites
+    :param suites: Names of the suites to run
+    :param closing: Optional list which receives the resources (ie: detectors) to close once the cases ran
+    :return: List of (suite, case name, setup) 3-tuples, setup is a callable image -> callable to time
+    """
+    cases = []
+
+    if "processors" in suites:
+        for (name, p) in processor_cases():
+            cases.append(("processors", name, lambda image, p=p: lambda: p.process_image(image, image)))
+
+    if "detector" in suites:
+        for (name, detect_eyes) in (("detect", False), ("detect+eyes", True)):
+            d = detector.Detector(detect_eyes)
+            if closing is not None:
+                closing.append(d)
+            cases.append(("detector", name, lambda image, d=d: _detect_case(d, image)))
+
+    if "display" in suites:
+        cases.append(("display", "display_img", _display_case))
+
+    if "chain" in suites:
+        (rotation, processors) = batch.build_processors(CHAIN_SETTINGS)
+        cases.append(("chain", "rotation+chain", lambda image: lambda: _run_chain(rotation, processors, image)))
+
+    return cases
+
+
+def _run_chain(rotation, processors, image):
+    """
+    Full processing of an image, like a batch run or a full resolution render
+    :param rotation: RotationProcessor
+    :param processors: Processors applied after rotation
+    :param image: BGR image
+    :return: The processed image
+    """
+    rotated = rotation.process_image(image, image)
+    return processor.process_chain(processors, rotated, rotated)
+
+
+def _detect_case(d, image):
+    """
+    Detection case setup, the grayscale conversion is not timed
+    :param d: Detector
+    :param image: BGR image
+    :return: Callable to time
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return lambda: d.detect(gray)
+
+
+def _display_case(image):
+    """
+    Display case setup, displays on an offscreen QLabel (Qt is only loaded by this suite)
+    :param image: BGR image
+    :return: Callable to time
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication, QLabel
+
+    global _qt_app, _qt_label
+    if QApplication.instance() is None:
+        _qt_app = QApplication([])
+    _qt_label = QLabel()
+    return lambda: utils.display_img(image, _qt_label)
+
+
+def run_benchmarks(images, suites=SUITES, warmup=1, repeat=5, progress=None):
+    """
+    Run every benchmark case on every image
+    :param images: List of (image name, BGR image) 2-tuples
+    :param suites: Names of the suites to run
+    :param warmup: Number of untimed runs per case
+    :param repeat: Number of timed runs per case
+    :param progress: Optional callable (key, stats) called after every case
+    :return: Benchmark report: metadata and a mapping of "suite/case/image" keys to timing statistics
+    """
+    results = {}
+    closing = []
+    try:
+        for (suite, case, setup) in benchmark_cases(suites, closing):
+            for (image_name, image) in images:
+                key = f"{suite}/{case}/{image_name}"
+                stats = time_call(setup(image), warmup, repeat)
+                stats["pixels"] = int(image.shape[0] * image.shape[1])
+                results[key] = stats
+                if progress is not None:
+                    progress(key, stats)
+    finally:
+        for resource in closing:
+            resource.close()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "warmup": warmup,
+            "repeat": repeat
+        },
+        "results": results
+    }
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare a benchmark report to a baseline report, by median time
+    :param report: Current benchmark report
+    :param baseline: Baseline benchmark report
+    :param threshold: Relative change from which a result is a regression (slower) or an improvement (faster)
+    :return: List of (key, baseline median, current median, ratio, status) 5-tuples, status is one of
+             "regression", "improvement", "ok", "new" or "missing"
+    """
+    (current, previous) = (report["results"], baseline["results"])
+    comparison = []
+
+    for key in sorted(set(current) | set(previous)):
+        if key not in previous:
+            comparison.append((key, None, current[key]["median"], None, "new"))
+        elif key not in current:
+            comparison.append((key, previous[key]["median"], None, None, "missing"))
+        else:
+            (before, after) = (previous[key]["median"], current[key]["median"])
+            ratio = after / before if before else float("inf")
+            status = "ok"
+            if ratio > 1 + threshold:
+                status = "regression"
+            elif ratio < 1 - threshold:
+                status = "improvement"
+            comparison.append((key, before, after, ratio, status))
+
+    return comparison
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments
+    :param argv: Argument list (without the program name)
+    :return: Parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the processors, detector, display and processing chain")
+    parser.add_argument("-o", "--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative slowdown counted as a regression")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES), help="Suites to run")
+    parser.add_argument("--sizes", nargs="*", choices=list(SYNTHETIC_SIZES), default=list(SYNTHETIC_SIZES),
+                        help="Synthetic image sizes")
+    parser.add_argument("--images", default=IMAGES_DIR, help="Directory of real images ('' to skip them)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per case")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Benchmark entry:
+     * Runs the benchmarks and prints every median time
+     * Writes the JSON report
+     * Compares to a baseline, failing on regressions
+    :return: Process exit code
+    """
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    images = load_images(args.images, args.sizes)
+    report = run_benchmarks(images, args.suites, args.warmup, max(1, args.repeat),
+                            progress=lambda key, stats: print(f"{key:<70} {stats['median'] * 1000:10.2f} ms"))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        comparison = compare(report, json.load(f), args.threshold)
+
+    # Baseline results missing from this run (ie: other suites or sizes) are only counted
+    for (key, before, after, ratio, status) in comparison:
+        if status not in ("ok", "missing"):
+            change = f"{(ratio - 1) * 100:+.1f}%" if ratio is not None else ""
+            print(f"{status.upper():<12} {key:<70} {change}")
+
+    counts = {status: sum(c[4] == status for c in comparison) for status in ("regression", "improvement", "missing")}
+    regressions = counts["regression"]
+    print(f"{regressions} regression(s), {counts['improvement']} improvement(s) against {args.compare} "
+          f"({counts['missing']} baseline result(s) not run)")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,26 @@
-from .image_processor import *
-from .detector import *
+import importlib
 
-__all__ = ['ImageProcessor', 'FilterProcessor', 'ContrastProcessor', 'BrightnessProcessor',
-           'Detector']
+# Modules are only imported when first used, so the UI does not import the detector before an image is imported
+_modules = {
+    'ImageProcessor': 'image_processor',
+    'PointProcessor': 'image_processor',
+    'FilterProcessor': 'image_processor',
+    'ContrastProcessor': 'image_processor',
+    'BrightnessProcessor': 'image_processor',
+    'Detector': 'detector',
+    'DetectionResult': 'detector',
+    'DetectionProfile': 'detector',
+    'ProcessingGraph': 'processing_graph',
+    'StageCache': 'processing_graph',
+    'CoalescingWorker': 'coalescing_worker'
+}
+
+__all__ = ['ImageProcessor', 'PointProcessor', 'FilterProcessor', 'ContrastProcessor', 'BrightnessProcessor',
+           'Detector', 'DetectionResult', 'DetectionProfile', 'ProcessingGraph', 'StageCache',
+           'CoalescingWorker']
+
+
+def __getattr__(name):
+    if name in _modules:
+        return getattr(importlib.import_module(f".{_modules[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
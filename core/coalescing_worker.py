@@ -0,0 +1,101 @@
+import threading
+import traceback
+from collections import OrderedDict
+
+
+class CoalescingWorker:
+    """
+    Worker thread which processes requests in the background, latest wins: a request which is still pending
+    when a newer request of the same kind is submitted is dropped (coalesced) without ever being processed
+    """
+
+    def __init__(self, handler, on_result=None, on_error=None, name="CoalescingWorker"):
+        """
+        Constructor, starts the worker thread
+        :param handler: Callable (kind, request) -> result, called on the worker thread
+        :param on_result: Callable (kind, request, result), called on the worker thread after every request
+        :param on_error: Callable (kind, request, exception), called on the worker thread when the handler fails
+                         (the traceback is printed when not given)
+        :param name: Worker thread name
+        """
+        self._handler = handler
+        self._on_result = on_result
+        self._on_error = on_error
+        self._pending = OrderedDict()   # Mapping of request kinds to their newest pending request
+        self._busy = False              # Is a request being processed?
+        self._running = True
+        self._condition = threading.Condition()
+
+        # Metrics
+        self.submitted = 0              # Requests submitted
+        self.processed = 0              # Requests processed
+        self.coalesced = 0              # Requests dropped in favor of a newer request
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, request):
+        """
+        Submit a request, replacing any pending request of the same kind
+        :param kind: Request kind, requests of different kinds never replace each other
+        :param request: Request passed to the handler
+        :return:
+        """
+        with self._condition:
+            if kind in self._pending:
+                self.coalesced += 1
+            self._pending[kind] = request
+            self.submitted += 1
+            self._condition.notify()
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until every submitted request has been processed
+        :param timeout: Maximum time to wait (seconds)
+        :return: True if the worker is idle
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker thread, dropping pending requests
+        :param timeout: Maximum time to wait for the request in progress (seconds)
+        :return:
+        """
+        with self._condition:
+            self._running = False
+            self._pending.clear()
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        """
+        Worker thread loop
+        :return:
+        """
+        while True:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+
+                (kind, request) = self._pending.popitem(last=False)
+                self._busy = True
+
+            try:
+                result = self._handler(kind, request)
+            except Exception as e:
+                if self._on_error is None:
+                    traceback.print_exc()
+                else:
+                    self._on_error(kind, request, e)
+                continue
+            finally:
+                with self._condition:
+                    self.processed += 1
+
+            if self._on_result is not None:
+                self._on_result(kind, request, result)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from core.detector import DetectionResult
+
+
+# Default location of the cache database
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".dejavu", "detections.sqlite")
+
+# Default maximum number of cached results, least recently used results are evicted beyond it
+DEFAULT_MAX_ENTRIES = 10000
+
+# Time to wait for another process's write to the database (seconds)
+BUSY_TIMEOUT = 30
+
+# Cache hits are only written back (marking the results as recently used) every this many hits, on put, flush and
+# close, so lookups do not each cost a write
+USED_FLUSH_HITS = 64
+
+
+def image_hash(image):
+    """
+    Fast content hash of decoded pixels (and their layout), independent of the file they were read from
+    :param image: Image
+    :return: Hex digest
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}{image.dtype}".encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class DetectionCache:
+    """
+    Persistent (SQLite) cache of detection results, keyed by the image content, the cascades and the detection
+    parameters. The cache is bounded to a number of entries, evicting the least recently used results
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Constructor, creates the database (and its directory) when needed
+        :param path: Database file path (":memory:" for a cache which only lives as long as the process)
+        :param max_entries: Maximum number of cached results
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._used = {}     # Last use of the results hit since the last write, by key
+        # Processes may share the database, waiting on each other's writes (the timeout is SQLite's busy timeout).
+        # With write ahead logging, lookups are not blocked by another process's write
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS detections (key TEXT PRIMARY KEY, result TEXT NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS detections_used ON detections (used)")
+        self._db.commit()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+
+    @staticmethod
+    def key(image, parameters):
+        """
+        Cache key of a detection
+        :param image: Image detection runs on
+        :param parameters: JSON serializable detection parameters (including the cascade hashes)
+        :return: The key
+        """
+        parameters = hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+        return f"{image_hash(image)}:{parameters}"
+
+    def get(self, key):
+        """
+        Get a cached result, marking it as recently used (written back with the next put or flush, or every
+        USED_FLUSH_HITS hits)
+        :param key: Cache key
+        :return: The DetectionResult, or None when it is not cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT result FROM detections WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._used[key] = time.time()
+            if len(self._used) >= USED_FLUSH_HITS:
+                self._write_used()
+                self._db.commit()
+
+        result = json.loads(row[0])
+        return DetectionResult(result["faces"], result["eyes"], result["scores"])
+
+    def put(self, key, result):
+        """
+        Cache a result, evicting the least recently used results beyond the maximum number of entries
+        :param key: Cache key
+        :param result: DetectionResult
+        :return:
+        """
+        value = json.dumps({
+            "faces": result.faces.tolist(),
+            "eyes": [e.tolist() for e in result.eyes],
+            "scores": result.scores.tolist()
+        })
+
+        with self._lock:
+            self._write_used()
+            self._db.execute("INSERT OR REPLACE INTO detections VALUES (?, ?, ?)", (key, value, time.time()))
+            self._db.execute(
+                "DELETE FROM detections WHERE key IN "
+                "(SELECT key FROM detections ORDER BY used DESC LIMIT -1 OFFSET ?)", (self._max_entries,))
+            self._db.commit()
+
+    def clear(self):
+        """
+        Drop every cached result
+        :return:
+        """
+        with self._lock:
+            self._used.clear()
+            self._db.execute("DELETE FROM detections")
+            self._db.commit()
+
+    def flush(self):
+        """
+        Write back the pending uses of cache hits
+        :return:
+        """
+        with self._lock:
+            if self._used:
+                self._write_used()
+                self._db.commit()
+
+    def close(self):
+        """
+        Close the database, writing back the pending uses
+        :return:
+        """
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def _write_used(self):
+        """
+        Write the pending uses of cache hits, without committing (called with the lock held)
+        :return:
+        """
+        if self._used:
+            self._db.executemany("UPDATE detections SET used = ? WHERE key = ?",
+                                 [(used, key) for (key, used) in self._used.items()])
+            self._used.clear()
+
+
+def open_cache(path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Open a detection cache, without failing when the database can not be used (ie: a read only home directory)
+    :param path: Database file path
+    :param max_entries: Maximum number of cached results
+    :return: The DetectionCache, or None when it could not be opened
+    """
+    try:
+        return DetectionCache(path, max_entries)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Detection cache disabled: {e}")
+        return None
@@ -1,11 +1,236 @@
+import json
+import os
 import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils import instrumentation
 from utils import processing_utils as utils
 
 
+# Overlay colors (BGR)
+FACE_COLOR = (255, 0, 0)
+EYE_COLOR = (0, 255, 0)
+
+# Cascade parameters (scale factor, minimum neighbours) of the face and eye passes of the default profile
+FACE_SCALE_FACTOR = 1.3
+FACE_MIN_NEIGHBORS = 5
+EYE_SCALE_FACTOR = 1.1
+EYE_MIN_NEIGHBORS = 22
+
+# Detection profiles written by the tuner (tune_detector.py), by name
+PROFILES_PATH = os.path.join(os.path.expanduser("~"), ".dejavu", "detector_profiles.json")
+DEFAULT_PROFILE = "default"
+
+# Eyes are only searched in the upper part of a face, with sizes bounded relative to the face width
+EYE_REGION = 0.65       # Searched fraction of the face height
+EYE_MIN_SIZE = 0.1      # Minimum eye size
+EYE_MAX_SIZE = 0.5      # Maximum eye size
+
+# Default number of threads detecting eyes
+EYE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Tiled detection: tiles are this many times the largest expected face (but at least TILE_MIN_SIZE), and overlap
+# by the largest face plus a margin, so every face lies entirely within some tile
+TILE_FACE_RATIO = 4
+TILE_MIN_SIZE = 512
+TILE_MARGIN = 0.5       # Overlap margin, relative to the largest face
+TILE_WORKERS = os.cpu_count() or 1
+
+# Boxes covering more than this fraction of a smaller box are duplicates (non-maximum suppression)
+NMS_OVERLAP = 0.5
+
+
+class DetectionResult:
+    """Result of a detection pass: face boxes, eye boxes per face and face confidence scores"""
+
+    def __init__(self, faces=None, eyes=None, scores=None):
+        """
+        Constructor
+        :param faces: (N, 4) array of face boxes (x, y, w, h)
+        :param eyes: List of N (M, 4) arrays of eye boxes (x, y, w, h) in image coordinates, one per face
+        :param scores: (N,) array of face confidence scores (cascade level weights)
+        """
+        self.faces = _as_boxes(faces)
+        self.eyes = [_as_boxes(e) for e in eyes] if eyes is not None else [_as_boxes(None)] * len(self.faces)
+        self.scores = np.zeros(len(self.faces)) if scores is None else np.asarray(scores, dtype=np.float64).ravel()
+
+    def __len__(self):
+        return len(self.faces)
+
+    def all_eyes(self):
+        """
+        All eye boxes, independent of the face they belong to
+        :return: (M, 4) array of eye boxes
+        """
+        return np.concatenate([self.faces[:0]] + self.eyes)
+
+    def scaled(self, fx, fy=None):
+        """
+        Scale the result to another resolution of the same image
+        :param fx: Horizontal scale factor
+        :param fy: Vertical scale factor (defaults to fx)
+        :return: A new, scaled detection result
+        """
+        factors = np.array([fx, fx if fy is None else fy] * 2)
+        return DetectionResult(np.rint(self.faces * factors), [np.rint(e * factors) for e in self.eyes], self.scores)
+
+    def draw(self, image, thickness=2):
+        """
+        Draw the face and eye boxes onto an image (at the resolution of this result)
+        :param image: The image to draw on
+        :param thickness: Rectangle line thickness
+        :return: The image, with rectangles drawn around faces and eyes
+        """
+        # All boxes of a kind are drawn in one polylines call
+        for (boxes, color) in ((self.faces, FACE_COLOR), (self.all_eyes(), EYE_COLOR)):
+            if len(boxes):
+                cv2.polylines(image, list(_box_outlines(boxes)), True, color, thickness)
+
+        return image
+
+
+class DetectionProfile:
+    """Detection parameters, trading detection speed for accuracy (see tune_detector.py)"""
+
+    def __init__(self, face_scale_factor=FACE_SCALE_FACTOR, face_min_neighbors=FACE_MIN_NEIGHBORS, face_min_size=0,
+                 eye_scale_factor=EYE_SCALE_FACTOR, eye_min_neighbors=EYE_MIN_NEIGHBORS, downscale=1.0):
+        """
+        Constructor, the defaults are the default profile
+        :param face_scale_factor: Scale step between the face cascade's search scales
+        :param face_min_neighbors: Neighbouring detections needed to keep a face
+        :param face_min_size: Smallest face searched for (pixels, 0 for no limit)
+        :param eye_scale_factor: Scale step between the eye cascade's search scales
+        :param eye_min_neighbors: Neighbouring detections needed to keep an eye
+        :param downscale: Scale the image is resized by before searching faces (eyes are searched at full size)
+        """
+        self.face_scale_factor = float(face_scale_factor)
+        self.face_min_neighbors = int(face_min_neighbors)
+        self.face_min_size = int(face_min_size)
+        self.eye_scale_factor = float(eye_scale_factor)
+        self.eye_min_neighbors = int(eye_min_neighbors)
+        self.downscale = float(downscale)
+        if not 0 < self.downscale <= 1:
+            raise ValueError("downscale must be in (0, 1]")
+
+    def __eq__(self, other):
+        return isinstance(other, DetectionProfile) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"DetectionProfile({', '.join(f'{k}={v}' for (k, v) in self.to_dict().items())})"
+
+    def to_dict(self):
+        """
+        :return: JSON serializable dictionary of the parameters
+        """
+        return {
+            "face_scale_factor": self.face_scale_factor,
+            "face_min_neighbors": self.face_min_neighbors,
+            "face_min_size": self.face_min_size,
+            "eye_scale_factor": self.eye_scale_factor,
+            "eye_min_neighbors": self.eye_min_neighbors,
+            "downscale": self.downscale
+        }
+
+    @classmethod
+    def from_dict(cls, parameters):
+        """
+        Create a profile from a dictionary of parameters, other entries (ie: measurements) are ignored
+        :param parameters: Dictionary of parameters, missing parameters keep their default
+        :return: A DetectionProfile
+        """
+        names = cls().to_dict()
+        return cls(**{k: v for (k, v) in parameters.items() if k in names})
+
+
+def load_profiles(path=PROFILES_PATH):
+    """
+    Load the detection profiles written by the tuner
+    :param path: Profiles file
+    :return: Mapping of profile names to their DetectionProfiles (empty when there is no profiles file)
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {name: DetectionProfile.from_dict(p) for (name, p) in json.load(f).get("profiles", {}).items()}
+
+
+def load_profile(name=DEFAULT_PROFILE, path=PROFILES_PATH):
+    """
+    Load a detection profile by name
+    :param name: Profile name, the default profile is built in (unless the profiles file overrides it)
+    :param path: Profiles file
+    :return: The DetectionProfile
+    """
+    profiles = load_profiles(path)
+    if name in profiles:
+        return profiles[name]
+    if name == DEFAULT_PROFILE:
+        return DetectionProfile()
+    raise KeyError(f"No detection profile named {name!r} in {path}")
+
+
+def save_profiles(profiles, path=PROFILES_PATH):
+    """
+    Write detection profiles, keeping the other profiles already in the file
+    :param profiles: Mapping of profile names to dictionaries of parameters (extra entries, like the measured time
+                     and error, are kept in the file for reference)
+    :param path: Profiles file
+    :return:
+    """
+    config = {"profiles": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            config = json.load(f)
+    config.setdefault("profiles", {}).update(profiles)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+
+
 class Detector:
-    def __init__(self):
+    def __init__(self, detect_eyes=True, eye_workers=EYE_WORKERS, tile_workers=TILE_WORKERS, cache=None,
+                 profile=None):
+        """
+        Constructor
+        :param detect_eyes: Detect eyes by default, disable when only faces are needed
+        :param eye_workers: Number of threads detecting eyes across face regions (1 to detect sequentially)
+        :param tile_workers: Number of threads detecting faces across tiles (tiled detection only)
+        :param cache: Optional DetectionCache, detection is skipped for images with a cached result
+        :param profile: DetectionProfile (see load_profile), the default profile when not given
+        """
         self._num_faces = 0                 # Number of faces detected
-        self._cascades = utils.Cascades()   # Mapping of cascades to their cascade classifiers
+        self._cascades = utils.Cascades()   # Access to the shared (lazily loaded) cascade classifiers
+        self._detect_eyes = detect_eyes
+        self._eye_workers = eye_workers
+        self._eye_pool = None               # Eye detection thread pool, created on first use
+        self._tile_workers = tile_workers
+        self._tile_pool = None              # Tiled detection thread pool, created on first use
+        self._cache = cache
+        self._profile = profile if profile is not None else DetectionProfile()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shut the eye and tile detection thread pools down. The detector can still be used, the pools are then created
+        again. The cache is left open, it belongs to whoever passed it in
+        :return:
+        """
+        for pool in (self._eye_pool, self._tile_pool):
+            if pool is not None:
+                pool.shutdown()
+        (self._eye_pool, self._tile_pool) = (None, None)
+
+    def profile(self):
+        """
+        :return: The DetectionProfile
+        """
+        return self._profile
 
     def faces(self):
         """
@@ -14,29 +239,227 @@ class Detector:
         """
         return self._num_faces
 
-    def detect(self, image_g, image_d):
+    def detect(self, image_g, detect_eyes=None, max_face_size=None):
         """
         Detect face and eyes in an image
         :param image_g: Grayscale image
-        :param image_d: Detected image
-        :return: A detected image with rectangles drawn around faces and eyes
+        :param detect_eyes: Detect eyes (defaults to the detector setting), without eyes every face has no eye boxes
+        :param max_face_size: Largest expected face (pixels). When given, images larger than a tile are searched
+                              in overlapping tiles across threads (see detect_faces_tiled)
+        :return: A DetectionResult with the face boxes, eye boxes and face scores
+        """
+        detect_eyes = self._detect_eyes if detect_eyes is None else detect_eyes
+        if self._cache is None:
+            return self._detect(image_g, detect_eyes, max_face_size)
+
+        key = self._cache.key(image_g, self.parameters(detect_eyes, max_face_size))
+        result = self._cache.get(key)
+        if result is None:
+            result = self._detect(image_g, detect_eyes, max_face_size)
+            self._cache.put(key, result)
+
+        self._num_faces = len(result)
+        return result
+
+    def parameters(self, detect_eyes=None, max_face_size=None):
+        """
+        Everything a detection result depends on besides the image: the cascades and the detection parameters
+        :param detect_eyes: Detect eyes (defaults to the detector setting)
+        :param max_face_size: Largest expected face of tiled detection (None for whole image detection)
+        :return: JSON serializable dictionary of parameters
+        """
+        cascades = utils.Cascades.CascadeList
+        return {
+            "face_cascade": self._cascades.digest(cascades.FACE_CASCADE),
+            "eye_cascade": self._cascades.digest(cascades.EYE_CASCADE),
+            "profile": self._profile.to_dict(),
+            "eye": [EYE_REGION, EYE_MIN_SIZE, EYE_MAX_SIZE],
+            "detect_eyes": bool(self._detect_eyes if detect_eyes is None else detect_eyes),
+            "max_face_size": max_face_size
+        }
+
+    def _detect(self, image_g, detect_eyes, max_face_size):
+        """
+        Uncached detection, see detect
+        :return: A DetectionResult
         """
-        # Detect faces
-        faces = self._cascades.cascades_list[utils.Cascades.CascadeList.FACE_CASCADE].detectMultiScale(image_g, 1.3, 5)
+        # Detect faces, keeping the level weights as confidence scores
+        with instrumentation.span("detector/faces"):
+            (faces, scores) = self._detect_faces_scaled(image_g, max_face_size)
         self._num_faces = len(faces)
 
-        for (x, y, w, h) in faces:
-            cv2.rectangle(image_d, (x, y), (x + w, y + h), (255, 0, 0), 2)
+        if not detect_eyes:
+            return DetectionResult(faces, None, scores)
+
+        # Face regions are independent, so they are spread across the eye threads
+        with instrumentation.span("detector/eyes"):
+            if self._eye_workers > 1 and len(faces) > 1:
+                if self._eye_pool is None:
+                    self._eye_pool = ThreadPoolExecutor(self._eye_workers, thread_name_prefix="EyeDetection")
+                eyes = list(self._eye_pool.map(lambda face: self.detect_eyes(image_g, face), faces))
+            else:
+                eyes = [self.detect_eyes(image_g, face) for face in faces]
+
+        return DetectionResult(faces, eyes, scores)
+
+    def _detect_faces_scaled(self, image_g, max_face_size):
+        """
+        Detect faces on the image downscaled by the profile, with the boxes scaled back to the image
+        :param image_g: Grayscale image
+        :param max_face_size: Largest expected face of tiled detection (None for whole image detection)
+        :return: A 2-tuple of ((N, 4) face boxes, (N,) face scores)
+        """
+        scale = self._profile.downscale
+        if scale < 1:
+            image_g = cv2.resize(image_g, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            max_face_size = None if max_face_size is None else max(1, int(max_face_size * scale))
+
+        if max_face_size is None:
+            (faces, scores) = self.detect_faces(image_g, scale)
+        else:
+            (faces, scores) = self.detect_faces_tiled(image_g, max_face_size, scale)
+
+        if scale < 1:
+            faces = np.round(faces / scale).astype(np.int32)
+        return faces, scores
+
+    def detect_faces(self, image_g, scale=1.0):
+        """
+        Detect faces in a whole image
+        :param image_g: Grayscale image
+        :param scale: Scale the image was already downscaled by (the profile's smallest face is scaled along)
+        :return: A 2-tuple of ((N, 4) face boxes, (N,) face scores)
+        """
+        min_size = int(self._profile.face_min_size * scale)
+        (faces, _, scores) = self._cascades.classifier(utils.Cascades.CascadeList.FACE_CASCADE).detectMultiScale3(
+            image_g, self._profile.face_scale_factor, self._profile.face_min_neighbors, minSize=(min_size, min_size),
+            outputRejectLevels=True)
+        return _as_boxes(faces), np.asarray(scores, dtype=np.float64).ravel()
+
+    def detect_faces_tiled(self, image_g, max_face_size, scale=1.0):
+        """
+        Detect faces in overlapping tiles sized to the largest expected face, spread across threads. Tiles overlap
+        by more than the largest face, so every face is whole in some tile, and duplicates found by neighbouring
+        tiles are merged by non-maximum suppression
+        :param image_g: Grayscale image
+        :param max_face_size: Largest expected face (pixels), larger faces may be missed or split
+        :param scale: Scale the image was already downscaled by (the profile's smallest face is scaled along)
+        :return: A 2-tuple of ((N, 4) face boxes, (N,) face scores)
+        """
+        overlap = int(max_face_size * (1 + TILE_MARGIN))
+        tile_size = max(TILE_MIN_SIZE, TILE_FACE_RATIO * max_face_size)
+        (h, w) = image_g.shape[:2]
+        if h <= tile_size and w <= tile_size:
+            return self.detect_faces(image_g, scale)
+
+        # Tiles are searched at every scale, a face's neighbouring detections at larger scales are grouped with it
+        # just like on the whole image (which is also why the overlap has a margin)
+        def detect_tile(origin):
+            (x, y) = origin
+            (faces, scores) = self.detect_faces(image_g[y: y + tile_size, x: x + tile_size], scale)
+            return faces + np.array([x, y, 0, 0], dtype=np.int32), scores
+
+        origins = [(x, y) for y in _tile_starts(h, tile_size, overlap) for x in _tile_starts(w, tile_size, overlap)]
+        if self._tile_workers > 1:
+            if self._tile_pool is None:
+                self._tile_pool = ThreadPoolExecutor(self._tile_workers, thread_name_prefix="TileDetection")
+            results = list(self._tile_pool.map(detect_tile, origins))
+        else:
+            results = [detect_tile(origin) for origin in origins]
+
+        faces = np.concatenate([faces for (faces, _) in results])
+        scores = np.concatenate([scores for (_, scores) in results])
+        keep = non_max_suppression(faces, scores)
+        return faces[keep], scores[keep]
+
+    def detect_eyes(self, image_g, face):
+        """
+        Detect the eyes of a face, searching the upper part of the face for eyes sized relative to the face
+        :param image_g: Grayscale image
+        :param face: Face box (x, y, w, h)
+        :return: (M, 4) array of eye boxes in image coordinates
+        """
+        (x, y, w, h) = face
+
+        # Region of interest (grayscale)
+        roi_grayscale = image_g[y: y + int(h * EYE_REGION), x: x + w]
+        (min_size, max_size) = (int(w * EYE_MIN_SIZE), int(w * EYE_MAX_SIZE))
+
+        # Detect eyes, and move them from ROI to image coordinates
+        roi_eyes = self._cascades.classifier(utils.Cascades.CascadeList.EYE_CASCADE).detectMultiScale(
+            roi_grayscale, self._profile.eye_scale_factor, self._profile.eye_min_neighbors,
+            minSize=(min_size, min_size), maxSize=(max_size, max_size))
+        return _as_boxes(roi_eyes) + np.array([x, y, 0, 0], dtype=np.int32)
+
+
+def non_max_suppression(boxes, scores, overlap=NMS_OVERLAP):
+    """
+    Greedy non-maximum suppression: boxes are kept by decreasing score, dropping every box which overlaps an
+    already kept box by more than the given fraction of the smaller box. The pairwise overlaps are computed at once
+    :param boxes: (N, 4) array of boxes (x, y, w, h)
+    :param scores: (N,) array of box scores
+    :param overlap: Overlap (intersection over the smaller area) above which boxes are duplicates
+    :return: Indices of the kept boxes, by decreasing score
+    """
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    boxes = np.asarray(boxes, dtype=np.float64)[order]
+    if not len(boxes):
+        return order
+
+    (x0, y0) = (boxes[:, 0], boxes[:, 1])
+    (x1, y1) = (x0 + boxes[:, 2], y0 + boxes[:, 3])
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    # Pairwise intersection over the smaller area
+    iw = np.clip(np.minimum(x1[:, None], x1[None, :]) - np.maximum(x0[:, None], x0[None, :]), 0, None)
+    ih = np.clip(np.minimum(y1[:, None], y1[None, :]) - np.maximum(y0[:, None], y0[None, :]), 0, None)
+    overlaps = iw * ih / np.maximum(np.minimum(areas[:, None], areas[None, :]), 1)
+
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if keep[i]:
+            keep[i + 1:] &= overlaps[i, i + 1:] <= overlap
+
+    return order[keep]
+
+
+def _tile_starts(length, tile_size, overlap):
+    """
+    Start offsets of overlapping tiles along one axis, the last tile ends at the image edge
+    :param length: Image length along the axis
+    :param tile_size: Tile length
+    :param overlap: Overlap of neighbouring tiles
+    :return: List of tile start offsets
+    """
+    if length <= tile_size:
+        return [0]
+
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    return starts + [length - tile_size]
 
-            # Regions of interest (grayscale and color)
-            roi_grayscale = image_g[y: y + h, x: x + w]
-            roi_color = image_d[y: y + h, x: x + w]
 
-            # Detect eyes
-            eyes = self._cascades.cascades_list[utils.Cascades.CascadeList.EYE_CASCADE].detectMultiScale(
-                roi_grayscale, 1.1, 22)
+def _as_boxes(boxes):
+    """
+    Convert cascade output (an array or an empty tuple) to an (N, 4) int32 array
+    :param boxes: Boxes (x, y, w, h)
+    :return: (N, 4) array of boxes
+    """
+    if boxes is None:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
 
-            for (ex, ey, ew, eh) in eyes:
-                cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2)
 
-        return image_d
+def _box_outlines(boxes):
+    """
+    Corner points of every box, in drawing order
+    :param boxes: (N, 4) array of boxes (x, y, w, h)
+    :return: (N, 4, 2) array of corner points
+    """
+    (x0, y0) = (boxes[:, 0], boxes[:, 1])
+    (x1, y1) = (x0 + boxes[:, 2], y0 + boxes[:, 3])
+    return np.stack([
+        np.stack([x0, y0], axis=1),
+        np.stack([x1, y0], axis=1),
+        np.stack([x1, y1], axis=1),
+        np.stack([x0, y1], axis=1)
+    ], axis=1).astype(np.int32)
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+from utils import instrumentation
+
+
+class DropQueue:
+    """Bounded queue which drops its oldest item when full, so consumers only ever see the freshest items"""
+
+    def __init__(self, maxsize=1):
+        """
+        Constructor
+        :param maxsize: Maximum number of queued items
+        """
+        self._items = deque()
+        self._maxsize = maxsize
+        self._closed = False
+        self._condition = threading.Condition()
+        self.dropped = 0    # Number of items dropped for being stale
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        Queue an item, dropping the oldest item when the queue is full
+        :param item: Item to queue
+        :return:
+        """
+        with self._condition:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Take the oldest item, waiting for one if the queue is empty
+        :param timeout: Maximum time to wait (seconds), 0 to not wait at all
+        :return: The item, or None on timeout or when the queue is closed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed, timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        """
+        Close the queue, waking up every waiting consumer
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class SyntheticFrameSource:
+    """Frame source with the cv2.VideoCapture read interface, producing synthetic frames (for tests and demos)"""
+
+    def __init__(self, frames=None, size=(640, 480), count=None, fps=None):
+        """
+        Constructor
+        :param frames: List of images to cycle through, moving gradient frames are generated when not given
+        :param size: (width, height) of generated frames
+        :param count: Number of frames before the source ends (None for an endless source)
+        :param fps: Frame rate to simulate (None to produce frames as fast as possible)
+        """
+        self._frames = frames
+        self._size = size
+        self._count = count
+        self._interval = 1.0 / fps if fps else 0
+        self._index = 0
+        self._last_read = 0
+
+    def isOpened(self):
+        return self._count is None or self._index < self._count
+
+    def read(self):
+        """
+        Produce the next frame
+        :return: A 2-tuple of (success, frame), just like cv2.VideoCapture.read
+        """
+        if not self.isOpened():
+            return False, None
+
+        if self._interval:
+            delay = self._last_read + self._interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_read = time.perf_counter()
+
+        if self._frames:
+            frame = self._frames[self._index % len(self._frames)].copy()
+        else:
+            (w, h) = self._size
+            row = ((np.arange(w) + self._index * 4) % 256).astype(np.uint8)
+            frame = cv2.cvtColor(np.tile(row, (h, 1)), cv2.COLOR_GRAY2BGR)
+
+        self._index += 1
+        return True, frame
+
+    def release(self):
+        self._count = self._index
+
+
+class FramePipeline:
+    """
+    Producer/consumer video pipeline: a capture thread reads frames from a source, a processing thread processes
+    them, connected by bounded queues which drop stale frames. The consumer (display) takes the newest result
+    whenever it is ready, so the capture rate never depends on the processing cost
+    """
+
+    def __init__(self, source, process, on_result=None, queue_size=1, release_source=True):
+        """
+        Constructor
+        :param source: Frame source with a cv2.VideoCapture like read() and release() (a capture, a video file or a
+                       SyntheticFrameSource)
+        :param process: Callable frame -> result, called on the processing thread
+        :param on_result: Callable (), called on the processing thread whenever a new result is available
+        :param queue_size: Size of the capture and result queues
+        :param release_source: Release the source when the pipeline stops, False to leave it to its owner
+        """
+        self._source = source
+        self._release_source = release_source
+        self._process = process
+        self._on_result = on_result
+        self._frames = DropQueue(queue_size)
+        self._results = DropQueue(queue_size)
+        self._running = False
+        self._threads = []
+
+        # Metrics
+        self.frames_captured = 0
+        self.frames_processed = 0
+
+    def frames_dropped(self):
+        """
+        Number of stale frames and results that were never processed or consumed
+        :return: Number of dropped frames
+        """
+        return self._frames.dropped + self._results.dropped
+
+    def running(self):
+        """
+        Is the pipeline running? It stops by itself once the source runs out of frames
+        :return: True while frames are captured or processed
+        """
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        """
+        Start the capture and processing threads
+        :return:
+        """
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._capture, name="FrameCapture", daemon=True),
+            threading.Thread(target=self._process_frames, name="FrameProcessing", daemon=True)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the pipeline and release the source (unless it is left to its owner)
+        :param timeout: Maximum time to wait for each thread (seconds)
+        :return:
+        """
+        self._running = False
+        self._frames.close()
+        self._results.close()
+        for t in self._threads:
+            t.join(timeout)
+        if self._release_source:
+            self._source.release()
+
+    def get(self, timeout=0):
+        """
+        Take the newest processed result
+        :param timeout: Maximum time to wait (seconds), 0 to not wait at all
+        :return: The result, or None when no new result is available
+        """
+        return self._results.get(timeout)
+
+    def _capture(self):
+        """
+        Capture thread loop
+        :return:
+        """
+        while self._running:
+            with instrumentation.span("capture/read"):
+                (ok, frame) = self._source.read()
+            if not ok:
+                break
+            self.frames_captured += 1
+            self._frames.put(frame)
+
+        self._frames.close()
+
+    def _process_frames(self):
+        """
+        Processing thread loop
+        :return:
+        """
+        while self._running:
+            frame = self._frames.get()
+            if frame is None:
+                break
+
+            with instrumentation.span("capture/process"):
+                result = self._process(frame)
+            self._results.put(result)
+            self.frames_processed += 1
+            if self._on_result is not None:
+                self._on_result()
@@ -1,13 +1,28 @@
 import cv2
 import numpy as np
+from functools import lru_cache
+from utils import instrumentation
+from utils import kernel_utils
 from utils import processing_utils as utils
 from abc import ABCMeta, abstractmethod
 
 
+# Rotation interpolation of interactive previews, and of final (full resolution) renders
+PREVIEW_INTERPOLATION = cv2.INTER_LINEAR
+FINAL_INTERPOLATION = cv2.INTER_CUBIC
+
+
 class ImageProcessor:
     """Abstract class for behavior based image processing"""
     __metaclass__ = ABCMeta
 
+    # Per-pixel point operation (see PointProcessor), which can be fused with its neighbours in a chain
+    point_operation = False
+    # Processing starts over from the unchanged image, discarding any processing done before it
+    uses_original = False
+    # Output pixels only depend on nearby input pixels (see halo), so images can be processed in tiles
+    tileable = True
+
     @abstractmethod
     def __init__(self, behavior):
         """
@@ -28,6 +43,23 @@ class ImageProcessor:
         """
         pass
 
+    def halo(self):
+        """
+        Reach of the processor: output pixels depend on input pixels up to this distance away
+        :return: Distance in pixels (0 for point operations)
+        """
+        return 0
+
+    def run(self, image_u, image_p):
+        """
+        Instrumented process_image, the entry used by processing chains and graphs
+        :param image_u: Unchanged image (the original image)
+        :param image_p: Processed image (image that has already had processing applied to it)
+        :return: An image with additional processing done to it
+        """
+        with instrumentation.span("processor/" + type(self).__name__):
+            return self.process_image(image_u, image_p)
+
     def behavior(self):
         """
         Get the behavior of the processor
@@ -35,6 +67,13 @@ class ImageProcessor:
         """
         return self._behavior
 
+    def unique_value(self):
+        """
+        Get the processors unique value
+        :return: The processors unique value
+        """
+        return self._unique_value
+
     def set_unique_value(self, value):
         """
         Sets the processors unique value (which will be used for it's calculations ie: brightness/rotation angle
@@ -50,62 +89,213 @@ class FilterProcessor(ImageProcessor):
         super(FilterProcessor, self).__init__(behavior)
         self._kernels = utils.Kernels().kernels_list
 
+    def add_kernel(self, name, kernel):
+        """
+        Add a custom kernel (of any size) to the processor's kernels
+        :param name: Kernel name
+        :param kernel: 2D filtering kernel
+        :return: The index (unique value) of the new kernel
+        """
+        self._kernels = self._kernels + [(name, kernel)]
+        return len(self._kernels) - 1
+
+    def halo(self):
+        (_, k) = self._kernels[self._unique_value]
+        return max(np.asarray(k).shape[:2]) // 2
+
     def process_image(self, image_u, image_p):
         (_, k) = self._kernels[self._unique_value]
-        return cv2.filter2D(image_p, -1, k)
+        # Separable kernels (ie: the blurs) are applied as two 1D passes, large kernels through the FFT
+        return kernel_utils.apply_kernel(image_p, k)
+
+
+class PointProcessor(ImageProcessor):
+    """
+    Abstract processor for per-pixel point operations: out = saturate(in * gain + bias)
+    8-bit images are processed through a cached 256 entry lookup table
+    """
+    point_operation = True
+
+    @abstractmethod
+    def gain_bias(self):
+        """
+        Linear transfer of the point operation for the current unique value
+        :return: A 2-tuple of (gain, bias)
+        """
+        pass
+
+    def lookup_table(self):
+        """
+        Lookup table of the point operation for the current unique value
+        :return: A read-only (256,) uint8 lookup table
+        """
+        return _lookup_table((self.gain_bias(),))
+
+    def process_image(self, image_u, image_p):
+        return apply_point_operations(image_u if self.uses_original else image_p, [self])
 
 
-class BrightnessProcessor(ImageProcessor):
+class BrightnessProcessor(PointProcessor):
     """Brightness processor which will adjust brightness based on a given value"""
+    uses_original = True
+
     def __init__(self, behavior):
         super(BrightnessProcessor, self).__init__(behavior)
 
-    def process_image(self, image_u, image_p):
-        return cv2.addWeighted(image_u, 1.0, np.zeros(
-                image_u.shape, dtype=image_u.dtype), 0, self._unique_value / 1.4)
+    def gain_bias(self):
+        return 1.0, self._unique_value / 1.4
 
 
-class ContrastProcessor(ImageProcessor):
+class ContrastProcessor(PointProcessor):
     """Contrast processor which will adjust contrast based on a given value"""
     def __init__(self, behavior):
         super(ContrastProcessor, self).__init__(behavior)
 
-    def process_image(self, image_u, image_p):
-        return cv2.addWeighted(image_p, 1.0 + self._unique_value / 127, np.zeros(
-                image_u.shape, dtype=image_u.dtype), 0, 1.0)
+    def gain_bias(self):
+        return 1.0 + self._unique_value / 127, 1.0
 
 
 class RotationProcessor(ImageProcessor):
-    """Rotation processor which apply matrix transformations to an original image based on a given angle"""
-    def __init__(self, behavior):
+    """
+    Rotation processor which apply matrix transformations to an original image based on a given angle
+    Rotation matrices are cached per angle and image size. The interpolation is set per processor, so interactive
+    previews can use a fast interpolation and final renders a high quality one
+    """
+    uses_original = True
+    # Every output pixel can come from anywhere in the image, and the output size differs
+    tileable = False
+
+    def __init__(self, behavior, interpolation=PREVIEW_INTERPOLATION):
         super(RotationProcessor, self).__init__(behavior)
+        self._interpolation = interpolation     # cv2 interpolation flag of the warp
+
+    def interpolation(self):
+        """
+        Get the interpolation used for rotating
+        :return: A cv2 interpolation flag
+        """
+        return self._interpolation
+
+    def set_interpolation(self, interpolation):
+        """
+        Set the interpolation used for rotating (ie: cv2.INTER_LINEAR while interacting, cv2.INTER_CUBIC or
+        cv2.INTER_LANCZOS4 for final renders)
+        :param interpolation: A cv2 interpolation flag
+        :return:
+        """
+        self._interpolation = interpolation
 
     def process_image(self, image_u, image_p):
         angle = self._unique_value
-        scale = 1.0
 
-        w = image_u.shape[1]
-        h = image_u.shape[0]
-        r_angle = np.deg2rad(int(angle))  # Get the angle in radians
+        # Without rotation the warp is an identity, the (never modified) original can be used as is
+        if angle % 360 == 0:
+            return image_u
 
-        # Calculate new image width and height
-        nw = (abs(np.sin(r_angle) * h) + abs(np.cos(r_angle) * w)) * scale
-        nh = (abs(np.cos(r_angle) * h) + abs(np.sin(r_angle) * w)) * scale
+        # The rotated image will never include processing, it will only be used for the dimensions
+        # We will always use the color image (original) for the base transformation calculations
+        (rotation_mat, size) = rotation_matrix(angle, image_u.shape[1], image_u.shape[0])
+        return cv2.warpAffine(image_u, rotation_mat, size, flags=self._interpolation)
 
-        # Get rotation matrix from openCV
-        rotation_mat = cv2.getRotationMatrix2D((nw * 0.5, nh * 0.5), angle, scale)
 
-        # Calculate the move from the old center to the new center combined w/ the rotation
-        # (dot prod of the rotation matrix and the new matrix)
-        rotation_move = np.dot(
-            rotation_mat,
-            np.array([(nw - w) * 0.5, (nh - h) * 0.5, 0])
-        )
+@lru_cache(maxsize=1024)
+def rotation_matrix(angle, w, h, scale=1.0):
+    """
+    Rotation of an image around its center, onto a canvas expanded to fit the whole rotated image
+    Matrices are cached per angle and image size
+    :param angle: Angle of rotation (degrees)
+    :param w: Image width
+    :param h: Image height
+    :param scale: Scale of the rotated image
+    :return: A 2-tuple of (read-only 2x3 affine matrix, (width, height) of the rotated canvas)
+    """
+    r_angle = np.deg2rad(int(angle))  # Get the angle in radians
 
-        # The move only affects the translation, so update the translation part of the transform
-        rotation_mat[0, 2] += rotation_move[0]
-        rotation_mat[1, 2] += rotation_move[1]
+    # Calculate new image width and height
+    nw = (abs(np.sin(r_angle) * h) + abs(np.cos(r_angle) * w)) * scale
+    nh = (abs(np.cos(r_angle) * h) + abs(np.sin(r_angle) * w)) * scale
 
-        # The rotated image will never include processing, it will only be used for the dimensions
-        # We will always use the color image (original) for the base transformation calculations
-        return cv2.warpAffine(image_u, rotation_mat, (int(np.ceil(nw)), int(np.ceil(nh))))
+    # Get rotation matrix from openCV
+    rotation_mat = cv2.getRotationMatrix2D((nw * 0.5, nh * 0.5), angle, scale)
+
+    # Calculate the move from the old center to the new center combined w/ the rotation
+    # (dot prod of the rotation matrix and the new matrix)
+    rotation_move = np.dot(
+        rotation_mat,
+        np.array([(nw - w) * 0.5, (nh - h) * 0.5, 0])
+    )
+
+    # The move only affects the translation, so update the translation part of the transform
+    rotation_mat[0, 2] += rotation_move[0]
+    rotation_mat[1, 2] += rotation_move[1]
+
+    rotation_mat.flags.writeable = False
+    return rotation_mat, (int(np.ceil(nw)), int(np.ceil(nh)))
+
+
+def process_chain(processors, image_u, image_p):
+    """
+    Apply a chain of processors in order, fusing every run of point operations into a single lookup table pass
+    :param processors: Iterable of ImageProcessors
+    :param image_u: Unchanged image (the original image)
+    :param image_p: Processed image (image that has already had processing applied to it)
+    :return: The image with the whole chain applied to it
+    """
+    run = []    # Pending point operations
+    for p in processors:
+        if p.point_operation:
+            if p.uses_original:
+                # Anything pending is discarded, since this processor starts over from the unchanged image
+                (run, image_p) = ([], image_u)
+            run.append(p)
+            continue
+
+        if run:
+            (run, image_p) = ([], _run_point_operations(image_p, run))
+        image_p = p.run(image_u, image_p)
+
+    return _run_point_operations(image_p, run) if run else image_p
+
+
+def _run_point_operations(image, processors):
+    """
+    Instrumented apply_point_operations of a fused run
+    :param image: Image to process
+    :param processors: List of PointProcessors, in order
+    :return: A new processed image
+    """
+    with instrumentation.span("processor/PointOperations"):
+        return apply_point_operations(image, processors)
+
+
+def apply_point_operations(image, processors):
+    """
+    Apply a run of point operations in one pass
+    :param image: Image to process
+    :param processors: List of PointProcessors, in order
+    :return: A new processed image
+    """
+    gain_biases = tuple(p.gain_bias() for p in processors)
+
+    if image.dtype == np.uint8:
+        return cv2.LUT(image, _lookup_table(gain_biases))
+
+    for (gain, bias) in gain_biases:
+        image = cv2.addWeighted(image, gain, image, 0, bias)
+    return image
+
+
+@lru_cache(maxsize=512)
+def _lookup_table(gain_biases):
+    """
+    Compose point operations into a single lookup table, cached by their parameters
+    Every operation rounds and saturates, just like cv2.addWeighted does for 8-bit images
+    :param gain_biases: Tuple of (gain, bias) 2-tuples, in order
+    :return: A read-only (256,) uint8 lookup table
+    """
+    lut = np.arange(256, dtype=np.uint8)
+    for (gain, bias) in gain_biases:
+        lut = np.clip(np.rint(lut * gain + bias), 0, 255).astype(np.uint8)
+
+    lut.flags.writeable = False
+    return lut
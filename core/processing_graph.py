@@ -0,0 +1,207 @@
+from collections import OrderedDict
+
+
+# Default memory budget of the stage cache (bytes)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+class StageCache:
+    """Least recently used cache of stage output images, bounded by a memory budget"""
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Constructor
+        :param memory_budget: Maximum number of bytes of cached images
+        """
+        self._memory_budget = memory_budget
+        self._images = OrderedDict()    # Mapping of stage keys to their output images, least recently used first
+        self._nbytes = 0                # Bytes of all cached images
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    def nbytes(self):
+        """
+        Memory used by the cached images
+        :return: Number of bytes
+        """
+        return self._nbytes
+
+    def set_memory_budget(self, memory_budget):
+        """
+        Change the memory budget, evicting images that no longer fit
+        :param memory_budget: Maximum number of bytes of cached images
+        :return:
+        """
+        self._memory_budget = memory_budget
+        self._evict(0)
+
+    def get(self, key):
+        """
+        Get a cached image, marking it as recently used
+        :param key: Stage key
+        :return: The cached image, or None when it is not cached
+        """
+        image = self._images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        """
+        Cache an image, evicting the least recently used images to stay within the budget
+        :param key: Stage key
+        :param image: Stage output image
+        :return:
+        """
+        if key in self._images:
+            self._nbytes -= self._images.pop(key).nbytes
+
+        # Images larger than the whole budget are never cached
+        if image.nbytes > self._memory_budget:
+            return
+
+        self._evict(image.nbytes)
+        self._images[key] = image
+        self._nbytes += image.nbytes
+
+    def clear(self):
+        """
+        Drop every cached image
+        :return:
+        """
+        self._images.clear()
+        self._nbytes = 0
+
+    def _evict(self, nbytes):
+        """
+        Evict least recently used images until nbytes more fit within the budget
+        :param nbytes: Number of bytes to make room for
+        :return:
+        """
+        while self._images and self._nbytes + nbytes > self._memory_budget:
+            (_, image) = self._images.popitem(last=False)
+            self._nbytes -= image.nbytes
+
+
+class ProcessingGraph:
+    """
+    Directed acyclic graph of ImageProcessor stages
+    Every stage output is memoized by the parameters of the stage and everything upstream of it, so changing a
+    stage's value only recomputes that stage and the stages downstream of it
+    """
+
+    # Name of the source node every graph starts from
+    SOURCE = "source"
+
+    class _Stage:
+        """Graph node"""
+
+        def __init__(self, processor, upstream, origin):
+            self.processor = processor  # ImageProcessor of the stage
+            self.upstream = upstream    # Stage providing the processed image (image_p)
+            self.origin = origin        # Stage providing the unchanged image (image_u)
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Constructor
+        :param memory_budget: Maximum number of bytes of cached intermediate images
+        """
+        self._stages = OrderedDict()    # Mapping of stage names to their nodes
+        self._source = None             # Source image
+        self._source_version = 0        # Incremented whenever the source image changes
+        self._cache = StageCache(memory_budget)
+
+    def cache(self):
+        """
+        Get the stage cache
+        :return: The StageCache of the graph
+        """
+        return self._cache
+
+    def add_stage(self, name, processor, upstream=SOURCE, origin=SOURCE):
+        """
+        Add a processing stage. Stages can only depend on existing stages, which keeps the graph acyclic
+        :param name: Unique stage name
+        :param processor: ImageProcessor of the stage
+        :param upstream: Stage whose output is processed by this stage (image_p)
+        :param origin: Stage whose output is used as the unchanged image of this stage (image_u)
+        :return:
+        """
+        if name == self.SOURCE or name in self._stages:
+            raise ValueError(f"Stage {name} already exists")
+        for dependency in (upstream, origin):
+            if dependency != self.SOURCE and dependency not in self._stages:
+                raise ValueError(f"Unknown stage {dependency}")
+
+        self._stages[name] = self._Stage(processor, upstream, origin)
+
+    def processor(self, name):
+        """
+        Get the processor of a stage
+        :param name: Stage name
+        :return: The stage's ImageProcessor
+        """
+        return self._stages[name].processor
+
+    def source(self):
+        """
+        Get the source image
+        :return: The source image
+        """
+        return self._source
+
+    def set_source(self, image):
+        """
+        Set the source image, invalidating every cached stage output
+        :param image: Source image
+        :return:
+        """
+        self._source = image
+        self._source_version += 1
+        self._cache.clear()
+
+    def set_value(self, name, value):
+        """
+        Set the unique value of a stage's processor
+        :param name: Stage name
+        :param value: The processors unique value
+        :return:
+        """
+        self._stages[name].processor.set_unique_value(value)
+
+    def key(self, name):
+        """
+        Cache key of a stage: its value and the keys of its dependencies
+        :param name: Stage name
+        :return: A hashable key
+        """
+        if name == self.SOURCE:
+            return self.SOURCE, self._source_version
+
+        stage = self._stages[name]
+        return name, stage.processor.unique_value(), self.key(stage.upstream), self.key(stage.origin)
+
+    def render(self, name):
+        """
+        Get the output of a stage, only computing the stages whose parameters changed
+        :param name: Stage name
+        :return: The stage's output image (must not be modified, it may be cached)
+        """
+        if name == self.SOURCE:
+            return self._source
+
+        key = self.key(name)
+        image = self._cache.get(key)
+        if image is None:
+            stage = self._stages[name]
+            image = stage.processor.run(self.render(stage.origin), self.render(stage.upstream))
+            self._cache.put(key, image)
+
+        return image
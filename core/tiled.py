@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from core import image_processor as processor
+
+
+# Default (width, height) of the tiles an image is processed in, without their halo
+TILE_SIZE = 1024
+
+# Default number of threads processing tiles
+TILE_WORKERS = os.cpu_count() or 1
+
+
+def chain_halo(processors):
+    """
+    Halo needed to process a chain in tiles: every processor can spread its reach through the processors after it
+    :param processors: Iterable of ImageProcessors
+    :return: Halo in pixels
+    """
+    return sum(p.halo() for p in processors)
+
+
+def tiles(shape, tile_size=TILE_SIZE):
+    """
+    Split an image into a grid of tiles
+    :param shape: Image shape (rows, cols, ...)
+    :param tile_size: (width, height) of the tiles, or a single size for square tiles
+    :return: List of (y0, y1, x0, x1) tile bounds
+    """
+    (tw, th) = (tile_size, tile_size) if np.isscalar(tile_size) else tile_size
+    (h, w) = shape[:2]
+    return [(y, min(y + th, h), x, min(x + tw, w)) for y in range(0, h, th) for x in range(0, w, tw)]
+
+
+def create_memmap(path, shape, dtype=np.uint8):
+    """
+    Create an image backed by a file (.npy format, so the file also records its shape and dtype)
+    :param path: File path
+    :param shape: Image shape
+    :param dtype: Pixel type
+    :return: A writable np.memmap
+    """
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+
+
+def open_memmap(path, mode="r"):
+    """
+    Open an image backed by a .npy file, pixels are only read from disk when they are accessed
+    :param path: File path
+    :param mode: "r" for read only, "r+" for read/write access
+    :return: A np.memmap
+    """
+    return np.lib.format.open_memmap(path, mode=mode)
+
+
+def import_image(image_path, path):
+    """
+    Convert an image file into a file backed image
+    Decoding itself still needs the whole image in memory once, after that it only lives on disk
+    :param image_path: Path of the image file
+    :param path: Path of the .npy file to create
+    :return: A read only np.memmap of the image
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise IOError(f"Could not read {image_path}")
+
+    memmap = create_memmap(path, image.shape, image.dtype)
+    memmap[:] = image
+    del image
+    memmap.flush()
+    return open_memmap(path)
+
+
+def process_tiled(processors, image, output=None, tile_size=TILE_SIZE, workers=TILE_WORKERS):
+    """
+    Apply a chain of processors to an image one tile at a time, spread across a thread pool
+    Every tile is processed with a halo of surrounding pixels (the summed reach of the processors), which is
+    cropped off again, so the result matches processing the whole image at once (up to a rounding step, where
+    OpenCV's vectorized and scalar filter paths round differently at tile edges). Memory use is bounded by
+    the tile size: with file backed images (np.memmap) only the tiles in flight are ever held in memory
+    :param processors: List of tileable ImageProcessors, in order
+    :param image: Image to process (an array or a np.memmap)
+    :param output: Array (or np.memmap) receiving the result, with the same shape and dtype as the image,
+                   a new array is allocated when not given
+    :param tile_size: (width, height) of the tiles without their halo, or a single size for square tiles
+    :param workers: Number of threads processing tiles
+    :return: The output
+    """
+    for p in processors:
+        if not p.tileable:
+            raise ValueError(f"{type(p).__name__} cannot be processed in tiles")
+
+    if output is None:
+        output = np.empty(image.shape, image.dtype)
+    elif output.shape != image.shape or output.dtype != image.dtype:
+        raise ValueError("The output needs the same shape and dtype as the image")
+
+    halo = chain_halo(processors)
+    (h, w) = image.shape[:2]
+
+    def process_tile(bounds):
+        (y0, y1, x0, x1) = bounds
+        # Tile with its halo, clamped to the image so image borders are extended exactly like on the whole image
+        (hy0, hy1, hx0, hx1) = (max(0, y0 - halo), min(h, y1 + halo), max(0, x0 - halo), min(w, x1 + halo))
+        tile = np.ascontiguousarray(image[hy0:hy1, hx0:hx1])
+        result = processor.process_chain(processors, tile, tile)
+        output[y0:y1, x0:x1] = result[y0 - hy0: y1 - hy0, x0 - hx0: x1 - hx0]
+
+    # Filters release the GIL, so threads process tiles in parallel
+    with ThreadPoolExecutor(max(1, workers), thread_name_prefix="TileProcessing") as pool:
+        for _ in pool.map(process_tile, tiles(image.shape, tile_size)):
+            pass
+
+    if isinstance(output, np.memmap):
+        output.flush()
+
+    return output
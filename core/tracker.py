@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+from core.detector import DetectionResult
+
+
+# Templates are matched at a reduced size, faces are scaled so that they are at most this wide (pixels)
+TRACKING_SIZE = 32
+
+
+class DetectionTracker:
+    """
+    Detect-then-track for live video: full detection only runs every detect_interval frames, or whenever a face is
+    lost. In between, faces are followed by matching their previous appearance (template matching) in a small
+    search window around their previous box
+    """
+
+    def __init__(self, detector, detect_interval=10, search_margin=0.5, min_score=0.6):
+        """
+        Constructor
+        :param detector: Detector used for full detection
+        :param detect_interval: Number of frames between full detections
+        :param search_margin: Search window margin around the previous box, relative to the box size
+        :param min_score: Minimum normalized correlation of a match, below it the face is considered lost
+        """
+        self._detector = detector
+        self._detect_interval = detect_interval
+        self._search_margin = search_margin
+        self._min_score = min_score
+
+        self._result = None         # Result of the previous frame
+        self._templates = []        # Appearance of each face in the previous frame (at tracking size)
+        self._frames_since = 0      # Frames since the last full detection
+
+        # Metrics
+        self.frames = 0             # Frames seen
+        self.full_detections = 0    # Frames on which full detection ran
+
+    def detection_rate(self):
+        """
+        Fraction of frames on which full detection ran
+        :return: Rate between 0 and 1
+        """
+        return self.full_detections / self.frames if self.frames else 0.0
+
+    def reset(self):
+        """
+        Forget the tracked faces, the next frame runs full detection
+        :return:
+        """
+        self._result = None
+        self._templates = []
+
+    def update(self, image_g):
+        """
+        Detect or track the faces of the next frame
+        :param image_g: Grayscale frame
+        :return: A DetectionResult for the frame
+        """
+        self.frames += 1
+        self._frames_since += 1
+
+        result = None
+        if self._result is not None and self._frames_since < self._detect_interval:
+            result = self._track(image_g)
+
+        # Tracking loss (or the interval running out) falls back to a full detection
+        if result is None:
+            result = self._detector.detect(image_g)
+            self.full_detections += 1
+            self._frames_since = 0
+
+        self._result = result
+        self._templates = [_template(image_g, box) for box in result.faces]
+        return result
+
+    def _track(self, image_g):
+        """
+        Follow the previous faces into a new frame
+        :param image_g: Grayscale frame
+        :return: A DetectionResult, or None when any face was lost
+        """
+        (h, w) = image_g.shape[:2]
+        faces = self._result.faces.copy()
+
+        for (i, (box, template)) in enumerate(zip(self._result.faces, self._templates)):
+            (x, y, bw, bh) = box
+            (mx, my) = (int(bw * self._search_margin), int(bh * self._search_margin))
+            (x0, y0) = (max(0, x - mx), max(0, y - my))
+            (x1, y1) = (min(w, x + bw + mx), min(h, y + bh + my))
+
+            # Search window, at the same scale as the template
+            scale = template.shape[1] / bw
+            window = cv2.resize(image_g[y0:y1, x0:x1], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                return None
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            (_, score, _, (lx, ly)) = cv2.minMaxLoc(scores)
+            if score < self._min_score:
+                return None
+
+            # Sub-pixel match location, so the reduced tracking size does not quantize the movement
+            (lx, ly) = _subpixel_peak(scores, lx, ly)
+            faces[i, :2] = (x0 + int(round(lx / scale)), y0 + int(round(ly / scale)))
+
+        # Eyes move along with their face
+        shifts = faces[:, :2] - self._result.faces[:, :2]
+        eyes = [e + np.array([dx, dy, 0, 0], dtype=np.int32) for (e, (dx, dy)) in zip(self._result.eyes, shifts)]
+        return DetectionResult(faces, eyes, self._result.scores)
+
+
+def _template(image_g, box):
+    """
+    Appearance of a face, scaled down to the tracking size
+    :param image_g: Grayscale image
+    :param box: Face box (x, y, w, h)
+    :return: The face template
+    """
+    (x, y, w, h) = box
+    scale = min(1.0, TRACKING_SIZE / w)
+    return cv2.resize(image_g[y:y + h, x:x + w], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _subpixel_peak(scores, x, y):
+    """
+    Refine the location of a peak by fitting a parabola through it and its neighbours, along each axis
+    :param scores: Score map
+    :param x: Column of the peak
+    :param y: Row of the peak
+    :return: The (x, y) sub-pixel peak location
+    """
+    peak = [float(x), float(y)]
+    (h, w) = scores.shape
+
+    for (axis, (c, n)) in enumerate(((x, w), (y, h))):
+        if 0 < c < n - 1:
+            (s0, s1, s2) = scores[y, x - 1: x + 2] if axis == 0 else scores[y - 1: y + 2, x]
+            curvature = s0 - 2 * s1 + s2
+            if curvature < 0:
+                peak[axis] += float(np.clip((s0 - s2) / (2 * curvature), -0.5, 0.5))
+
+    return peak
@@ -0,0 +1,245 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+
+# Default number of processing threads
+VIDEO_WORKERS = os.cpu_count() or 1
+
+# Default size of the decode and result queues
+VIDEO_QUEUE_SIZE = 8
+
+
+class VideoPipeline:
+    """
+    Offline video pipeline: a decode thread reads frames, worker threads process them and an encode thread writes
+    them in their original order. The stages are connected by bounded queues, and the number of frames in flight
+    (queued, processed or waiting to be written in order) is bounded as well, so memory use does not depend on the
+    video length. Unlike the live FramePipeline, no frame is ever dropped
+    """
+
+    # Queue item which tells a stage to stop
+    _END = None
+
+    def __init__(self, source, create_processor, sink, workers=VIDEO_WORKERS, queue_size=VIDEO_QUEUE_SIZE):
+        """
+        Constructor
+        :param source: Frame source with a cv2.VideoCapture like read() (a cv2.VideoCapture or SyntheticFrameSource)
+        :param create_processor: Callable () -> (callable frame -> frame), called once on every worker thread so
+                                 every worker has its own processor state (ie: its own Detector)
+        :param sink: Frame sink with a cv2.VideoWriter like write(frame)
+        :param workers: Number of processing threads
+        :param queue_size: Size of the decode and result queues
+        """
+        self._source = source
+        self._create_processor = create_processor
+        self._sink = sink
+        self._workers = max(1, workers)
+
+        self._frames = queue.Queue(queue_size)      # Decoded (index, frame)
+        self._results = queue.Queue(queue_size)     # Processed (index, frame), in completion order
+        # Frames in flight: every queue slot, one frame per worker and the same again for out of order results
+        self._in_flight = threading.BoundedSemaphore(2 * (queue_size + self._workers))
+        self._error = None
+        self._stopped = False
+
+        # Metrics
+        self.frames_decoded = 0
+        self.frames_written = 0
+        self.elapsed = 0.0
+
+    def fps(self):
+        """
+        Throughput of the last run
+        :return: Written frames per second
+        """
+        return self.frames_written / self.elapsed if self.elapsed else 0.0
+
+    def run(self):
+        """
+        Process the whole source, blocking until every frame is written
+        :return: Number of frames written
+        """
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._decode, name="VideoDecode", daemon=True)]
+        threads += [threading.Thread(target=self._process, name=f"VideoProcessing-{i}", daemon=True)
+                    for i in range(self._workers)]
+        for t in threads:
+            t.start()
+
+        try:
+            self._encode()
+        finally:
+            self._stop()
+            for t in threads:
+                t.join()
+            self.elapsed = time.perf_counter() - start
+
+        if self._error is not None:
+            raise self._error
+        return self.frames_written
+
+    def _fail(self, error):
+        """
+        Stop every stage after an error, which is raised again by run
+        :param error: The exception
+        :return:
+        """
+        if self._error is None:
+            self._error = error
+        self._stop()
+
+    def _stop(self):
+        """
+        Stop every stage, waking up stages blocked on a full queue or the in flight limit
+        :return:
+        """
+        self._stopped = True
+        self._in_flight_release()
+        for q in (self._frames, self._results):
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _in_flight_release(self):
+        """
+        Release an in flight frame slot (never beyond the limit)
+        :return:
+        """
+        try:
+            self._in_flight.release()
+        except ValueError:
+            pass
+
+    def _decode(self):
+        """
+        Decode thread loop
+        :return:
+        """
+        try:
+            while not self._stopped:
+                self._in_flight.acquire()
+                (ok, frame) = self._source.read()
+                if not ok or self._stopped:
+                    break
+                self._put(self._frames, (self.frames_decoded, frame))
+                self.frames_decoded += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            # Every worker gets its end marker
+            for _ in range(self._workers):
+                self._put(self._frames, self._END)
+
+    def _process(self):
+        """
+        Processing thread loop
+        :return:
+        """
+        try:
+            process = self._create_processor()
+            while not self._stopped:
+                item = self._get(self._frames)
+                if item is self._END:
+                    break
+                (index, frame) = item
+                self._put(self._results, (index, process(frame)))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(self._results, self._END)
+
+    def _encode(self):
+        """
+        Encode loop (runs on the calling thread), writes results in frame order
+        :return:
+        """
+        pending = {}    # Results which finished before an earlier frame, by frame index
+        ended = 0       # Number of workers that finished
+        while ended < self._workers and not self._stopped:
+            item = self._get(self._results)
+            if item is self._END:
+                ended += 1
+                continue
+
+            (index, frame) = item
+            pending[index] = frame
+            while self.frames_written in pending:
+                self._sink.write(pending.pop(self.frames_written))
+                self.frames_written += 1
+                self._in_flight_release()
+
+    def _get(self, q):
+        """
+        Take an item, the end marker is returned once the pipeline is stopped (queued markers may have been drained)
+        :param q: Queue
+        :return: The item
+        """
+        while not self._stopped:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return self._END
+
+    def _put(self, q, item):
+        """
+        Put an item, once the pipeline is stopped nothing consumes the queues anymore, so room is made instead of
+        blocking forever
+        :param q: Queue
+        :param item: Item
+        :return:
+        """
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stopped:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+class VideoFileSink:
+    """Frame sink writing a video file, the cv2.VideoWriter is opened on the first frame (which sets the size)"""
+
+    def __init__(self, path, fps, fourcc="mp4v"):
+        """
+        Constructor
+        :param path: Output video path
+        :param fps: Frame rate of the output
+        :param fourcc: Four character code of the output codec
+        """
+        self._path = path
+        self._fps = fps
+        self._fourcc = fourcc
+        self._writer = None
+
+    def write(self, frame):
+        """
+        Write a frame
+        :param frame: BGR frame, every frame must have the size of the first
+        :return:
+        """
+        if self._writer is None:
+            (h, w) = frame.shape[:2]
+            self._writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*self._fourcc), self._fps, (w, h))
+            if not self._writer.isOpened():
+                raise IOError(f"Could not open {self._path} for writing")
+
+        self._writer.write(frame)
+
+    def release(self):
+        """
+        Finish the output file
+        :return:
+        """
+        if self._writer is not None:
+            self._writer.release()
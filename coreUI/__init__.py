@@ -1,6 +1,20 @@
-from .main_window import *
-from .slider_widget import *
-from .image_description_dialog import *
-from .webcam_dialog import *
+import importlib
 
-__all__ = ['MainWindow', 'SliderWidget', 'ImageDescriptionDialog', 'WebcamDialog']
+# Windows and dialogs are only imported when first used, so opening the main window does not import every dialog
+# (and everything they depend on)
+_modules = {
+    'MainWindow': 'main_window',
+    'SliderWidget': 'slider_widget',
+    'ImageDescriptionDialog': 'image_description_dialog',
+    'WebcamDialog': 'webcam_dialog',
+    'StatsDialog': 'stats_dialog',
+    'HistogramDialog': 'histogram_dialog'
+}
+
+__all__ = ['MainWindow', 'SliderWidget', 'ImageDescriptionDialog', 'WebcamDialog', 'StatsDialog', 'HistogramDialog']
+
+
+def __getattr__(name):
+    if name in _modules:
+        return getattr(importlib.import_module(f".{_modules[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,36 @@
+from PyQt5.QtWidgets import QDialog
+from coreUI.ui_loader import load_ui
+from utils import image_statistics
+from utils import processing_utils as utils
+
+
+HISTOGRAM_DIALOG_UI = 'coreUI/histogram_dialog.ui'
+
+
+class HistogramDialog(QDialog):
+    """
+    Histogram Dialog Window, shows the per channel histograms and statistics of the original and processed preview.
+    The main window pushes new statistics to it after every preview render
+    """
+
+    def __init__(self):
+        super(HistogramDialog, self).__init__()
+        load_ui(HISTOGRAM_DIALOG_UI, self)
+
+        # Histograms are drawn at their display size, so they are shown without scaling
+        for label in (self.originalHistogramLabel, self.processedHistogramLabel):
+            label.display_surface = utils.DisplaySurface(label, image_statistics.HISTOGRAM_SIZE)
+
+    def show_statistics(self, original, processed):
+        """
+        Show the statistics of the original and processed image
+        :param original: ImageStatistics of the original image, None to leave them unchanged
+        :param processed: ImageStatistics of the processed image, None to leave them unchanged
+        :return:
+        """
+        for (statistics, histogram_label, stats_label) in (
+                (original, self.originalHistogramLabel, self.originalStatsLabel),
+                (processed, self.processedHistogramLabel, self.processedStatsLabel)):
+            if statistics is not None:
+                utils.display_img(statistics.draw(), histogram_label)
+                stats_label.setText(statistics.summary())
@@ -1,8 +1,9 @@
 import cv2
 import numpy as np
 from PyQt5.QtGui import QIntValidator
-from PyQt5.QtWidgets import QDialog
-from PyQt5.uic import loadUi
+from PyQt5.QtWidgets import QDialog, QFileDialog, QInputDialog, QMessageBox
+from coreUI.ui_loader import load_ui
+from utils import kernel_utils
 from utils import processing_utils as utils
 
 IMAGE_DESCRIPT_DIALOG_UI = 'coreUI/image_description_dialog.ui'
@@ -13,7 +14,7 @@ class ImageDescriptionDialog(QDialog):
 
     def __init__(self, image):
         super(ImageDescriptionDialog, self).__init__()
-        loadUi(IMAGE_DESCRIPT_DIALOG_UI, self)
+        load_ui(IMAGE_DESCRIPT_DIALOG_UI, self)
 
         self.kernel = None
         self.kernel_matrix_edits = [
@@ -64,6 +65,8 @@ class ImageDescriptionDialog(QDialog):
         self.applyButton.clicked.connect(self.on_apply_clicked)
         self.resetButton.clicked.connect(self.on_reset_clicked)
         self.normalizeButton.clicked.connect(self.on_normalize_clicked)
+        self.editKernelButton.clicked.connect(self.on_edit_kernel_clicked)
+        self.loadKernelButton.clicked.connect(self.on_load_kernel_clicked)
 
     def on_apply_clicked(self):
         """
@@ -103,19 +106,54 @@ class ImageDescriptionDialog(QDialog):
             return
 
         # Get the sum of the matrix and create the new normalized matrix
-        sum = np.sum(self.kernel, dtype=np.int32)
+        sum = np.sum(self.kernel)
+        if sum == 0:
+            return
         normalized_kernel = self.kernel / sum
 
         self._processed_image = self._image.copy()
-        image = cv2.filter2D(self._processed_image, -1, normalized_kernel)
+        image = kernel_utils.apply_kernel(self._processed_image, normalized_kernel)
         utils.display_img(image, self.imageViewLabel)
 
+    def on_edit_kernel_clicked(self):
+        """
+        Enter a kernel of any size (up to kernel_utils.MAX_KERNEL_SIZE), one row per line, and apply it
+        :return: None if the dialog is cancelled
+        """
+        current = "" if self.kernel is None else "\n".join(" ".join(f"{v:g}" for v in row) for row in self.kernel)
+        (text, ok) = QInputDialog.getMultiLineText(self, "Edit Kernel", "Kernel rows (one row per line):", current)
+        if ok:
+            self.apply_custom_kernel(kernel_utils.parse_kernel, text)
+
+    def on_load_kernel_clicked(self):
+        """
+        Load a kernel of any size (up to kernel_utils.MAX_KERNEL_SIZE) from a text file, and apply it
+        :return: None if no file is chosen
+        """
+        (filename, _) = QFileDialog.getOpenFileName(self, 'Load Kernel', "", "Kernel Files (*.txt *.csv)")
+        if filename:
+            self.apply_custom_kernel(kernel_utils.load_kernel, filename)
+
+    def apply_custom_kernel(self, load, source):
+        """
+        Load a custom kernel, apply it and display the result. Invalid kernels are reported to the user
+        :param load: Kernel loading function (kernel_utils.parse_kernel or kernel_utils.load_kernel)
+        :param source: Kernel text or file name passed to the loading function
+        :return: None if the kernel is invalid
+        """
+        try:
+            kernel = load(source)
+            utils.display_img(kernel_utils.apply_kernel(self._processed_image, kernel), self.imageViewLabel)
+            self.kernel = kernel
+        except (IOError, ValueError, cv2.error) as e:
+            QMessageBox.warning(self, "Invalid Kernel", str(e))
+
     def set_validation(self):
         """
         Set validators on all matrix text edits (ensure integer input)
         :return:
         """
-        validator = QIntValidator(-9999999999, 9999999999)
+        validator = QIntValidator(-999999999, 999999999)
         for text_exit in self.kernel_matrix_edits:
             text_exit.setValidator(validator)
 
@@ -129,4 +167,4 @@ class ImageDescriptionDialog(QDialog):
             [val(self.m_r3c1), val(self.m_r3c2), val(self.m_r3c3)]
         ])
 
-        return cv2.filter2D(self._processed_image, -1, self.kernel)
+        return kernel_utils.apply_kernel(self._processed_image, self.kernel)
@@ -1,13 +1,14 @@
+import copy
 import cv2
-from core import detector
+from core.coalescing_worker import CoalescingWorker
 from core import image_processor as processor
+from core import processing_graph
 from coreUI import slider_widget as slider
-from coreUI.image_description_dialog import ImageDescriptionDialog
-from coreUI.webcam_dialog import WebcamDialog
+from utils import image_statistics
 from utils import processing_utils as utils
-from PyQt5.QtCore import pyqtSlot, QDir
-from PyQt5.QtWidgets import QFileDialog, QMainWindow, QDesktopWidget
-from PyQt5.uic import loadUi
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, QDir, QTimer
+from PyQt5.QtWidgets import QFileDialog, QMainWindow, QDesktopWidget, QProgressBar
+from coreUI.ui_loader import load_ui
 
 
 # UI form
@@ -19,6 +20,21 @@ BEHAVIOR_BRIGHTNESS = "Brightness"
 BEHAVIOR_CONTRAST = "Contrast"
 BEHAVIOR_ROTATION = "Rotation"
 
+# Memory budget of cached intermediate processing results (bytes)
+PROCESSING_CACHE_BUDGET = 256 * 1024 * 1024
+PREVIEW_CACHE_BUDGET = 32 * 1024 * 1024
+
+# Time without interaction before the full resolution image is rendered (ms)
+FULL_RENDER_DELAY = 400
+
+# Processing request kinds
+PREVIEW_RENDER = "preview"
+FULL_RENDER = "full"
+IMPORT_REQUEST = "import"
+
+# Import progress (percent) once the full image is decoded
+DECODED_PROGRESS = 40
+
 # ComboBox options
 HIDE_FACIAL_RECOG = 0
 SHOW_FACIAL_RECOG = 1
@@ -27,9 +43,19 @@ SHOW_FACIAL_RECOG = 1
 class MainWindow(QMainWindow):
     """Main UI window"""
 
+    # Background render relay to the GUI thread
+    # Emits (request kind, request, processed image)
+    render_finished = pyqtSignal(str, object, object)
+
+    # Background import relays to the GUI thread
+    # Emits (import generation, progress percent, message)
+    import_progress = pyqtSignal(int, int, str)
+    # Emits (request kind, request, 3-tuple of (image, detections, error message))
+    import_finished = pyqtSignal(str, object, object)
+
     def __init__(self):
         super(MainWindow, self).__init__()
-        loadUi(MAIN_WINDOW_UI, self)
+        load_ui(MAIN_WINDOW_UI, self)
 
         # Center the window on launch
         self.center()
@@ -43,24 +69,40 @@ class MainWindow(QMainWindow):
         image_options = self.menuBar().addMenu("&Image Options")
         self.image_descript_action = image_options.addAction("&Description")
         self.image_descript_action.triggered.connect(self.open_image_description_dialog)
+        self.histogram_action = image_options.addAction("&Histogram")
+        self.histogram_action.triggered.connect(self.open_histogram_dialog)
+
+        stats_options = self.menuBar().addMenu("&Statistics")
+        self.stats_action = stats_options.addAction("&Show Statistics")
+        self.stats_action.triggered.connect(self.open_stats_dialog)
 
-        # Facial recognition: Face/eyes detector
-        self._detector = detector.Detector()
+        # Facial recognition: Face/eyes detector and its result cache, created on the first image import (see detector)
+        self._detector = None
+        self._detection_cache = None
 
         # Filtering Kernels
         self._kernels = utils.Kernels()
 
         # Cached images
         self._color_img = None              # Colored image
-        self._grayscale_img = None          # Grayscale image
-        self._processed_img = None          # Processed image
-        self._rotated_img = None            # Rotated image
-        self._detected_img = None           # Detected image
+        self._processed_img = None          # Processed image (full resolution)
+        self._proxy_img = None              # Colored image downscaled to the display resolution
+        self._import_generation = 0         # Import the full resolution image and detections belong to
+        self._preview_img = None            # Processed preview (display resolution)
+        self._preview_request = None        # 2-tuple of (source image, processing values) of the preview
+        self._detections = None             # Detected faces/eyes of the colored image
 
         # Image description dialog window
         self._image_description_dialog = None
         # Webcam dialog window
         self._webcam_dialog = None
+        # Statistics dialog window
+        self._stats_dialog = None
+        # Histogram dialog window, and the histograms/statistics of the shown previews. While the dialog is open the
+        # worker thread computes them right after rendering (see process_request)
+        self._histogram_dialog = None
+        self._image_statistics = image_statistics.StatisticsCache()
+        self._collect_statistics = False
 
         # Initially create a filter processing behavior, passing it the list of kernel names
         fp_behavior = utils.ProcessingBehavior((
@@ -81,6 +123,41 @@ class MainWindow(QMainWindow):
             (self.rotateImgDial.minimum(), self.rotateImgDial.maximum()), BEHAVIOR_ROTATION, 0)
         self._rotation_processor = processor.RotationProcessor(rotation_behavior)
 
+        # Current processing values, mapped by behavior name
+        self._values = {name: p.unique_value() for (name, p) in self._processors.items()}
+        self._values[BEHAVIOR_ROTATION] = self._rotation_processor.unique_value()
+        # File name the next full resolution render is saved to
+        self._pending_save = None
+
+        # Interaction is processed on a display sized proxy of the image, the full resolution image is only
+        # processed once the user stops interacting (or saves). The graphs are only used by the worker thread
+        self._graphs = {
+            PREVIEW_RENDER: self.create_graph(PREVIEW_CACHE_BUDGET, processor.PREVIEW_INTERPOLATION),
+            FULL_RENDER: self.create_graph(PROCESSING_CACHE_BUDGET, processor.FINAL_INTERPOLATION)
+        }
+        self._output_stage = list(self._processors)[-1]
+
+        # Processing runs on a worker thread, which only processes the newest request of each kind
+        self.render_finished.connect(self.on_render_finished)
+        self._worker = CoalescingWorker(self.process_request, on_result=self.render_finished.emit,
+                                        name="ProcessingWorker")
+
+        # Full resolution images are decoded and searched for faces on their own worker, showing a reduced size
+        # preview meanwhile. Importing another image while one is still loading drops the pending import
+        self.import_progress.connect(self.on_import_progress)
+        self.import_finished.connect(self.on_import_finished)
+        self._loader = CoalescingWorker(self.import_request, on_result=self.import_finished.emit,
+                                        on_error=self.on_import_error, name="ImportWorker")
+        self._import_progress_bar = QProgressBar()
+        self._import_progress_bar.setMaximumWidth(150)
+        self._import_progress_bar.hide()
+        self.statusBar().addPermanentWidget(self._import_progress_bar)
+
+        self._full_render_timer = QTimer(self)
+        self._full_render_timer.setSingleShot(True)
+        self._full_render_timer.setInterval(FULL_RENDER_DELAY)
+        self._full_render_timer.timeout.connect(self.render_full_resolution)
+
         self.create_sliders()
 
         self.importButton.clicked.connect(self.on_import_clicked)
@@ -88,21 +165,73 @@ class MainWindow(QMainWindow):
         self.facialRecogComboBox.currentIndexChanged.connect(self.on_facial_recog_cb_changed)
 
         # Image rotation connection loops
-        # SpinBox and the dial are connected to each other's setters, along with each being able to
-        # call rotate_image simultaneously
+        # SpinBox and the dial are connected to each other's setters, only the dial calls rotate_image so a
+        # change from either widget rotates once
         self.rotateImgDial.valueChanged.connect(self.rotate_image)
-        self.rotateImgSpinBox.valueChanged.connect(self.rotate_image)
         self.rotateImgDial.valueChanged.connect(self.rotateImgSpinBox.setValue)
         self.rotateImgSpinBox.valueChanged.connect(self.rotateImgDial.setValue)
+        # Releasing the dial renders the full resolution image right away
+        self.rotateImgDial.sliderReleased.connect(self.on_rotate_released)
 
     def open_webcam_dialog(self):
         """
         Open the webcam dialog window
         :return:
         """
+        # Dialogs (and what they depend on) are only imported once opened, keeping them out of the start up
+        from coreUI.webcam_dialog import WebcamDialog
         self._webcam_dialog = WebcamDialog()
         self._webcam_dialog.show()
 
+    def open_stats_dialog(self):
+        """
+        Open the statistics dialog window
+        :return:
+        """
+        from coreUI.stats_dialog import StatsDialog
+        self._stats_dialog = StatsDialog()
+        self._stats_dialog.show()
+
+    def open_histogram_dialog(self):
+        """
+        Open the histogram dialog window
+        :return:
+        """
+        # Kept once created, so it is raised rather than opened twice
+        if self._histogram_dialog is None:
+            from coreUI.histogram_dialog import HistogramDialog
+            self._histogram_dialog = HistogramDialog()
+            self._histogram_dialog.finished.connect(self.on_histogram_dialog_finished)
+
+        self._collect_statistics = True
+        self._histogram_dialog.show()
+        self._histogram_dialog.raise_()
+        self.show_statistics()
+
+    def on_histogram_dialog_finished(self):
+        """
+        Stop computing statistics once the histogram dialog is closed
+        :return:
+        """
+        self._collect_statistics = False
+        self._image_statistics.clear()
+
+    def show_statistics(self):
+        """
+        Show the statistics of the proxy and the processed preview on the histogram dialog, when it is open. They are
+        usually already cached by the worker thread
+        :return:
+        """
+        if not self._collect_statistics or self._proxy_img is None:
+            return
+
+        original = self._image_statistics.get(self._proxy_img)
+        processed = None
+        # The preview of a previous image is still shown until the new proxy is rendered
+        if self._preview_request is not None and self._preview_request[0] is self._proxy_img:
+            processed = self._image_statistics.get(self._preview_img, *self._preview_request)
+        self._histogram_dialog.show_statistics(original, processed)
+
     def open_image_description_dialog(self):
         """
         Open the image description dialog menu. Ensure that an image is already imported
@@ -112,9 +241,23 @@ class MainWindow(QMainWindow):
         if self._color_img is None:
             return
 
+        from coreUI.image_description_dialog import ImageDescriptionDialog
         self._image_description_dialog = ImageDescriptionDialog(self._color_img)
         self._image_description_dialog.show()
 
+    def detector(self):
+        """
+        Get the face/eyes detector, it is created (and its result cache opened) on first use rather than before the
+        window first shows. Re-imported photos reuse their cached detections
+        :return: The Detector
+        """
+        if self._detector is None:
+            from core import detection_cache
+            from core import detector
+            self._detection_cache = detection_cache.open_cache()
+            self._detector = detector.Detector(cache=self._detection_cache)
+        return self._detector
+
     def create_sliders(self):
         """
         Creates a slider for each processing behavior, and connects each of the sliders to a widget
@@ -126,6 +269,124 @@ class MainWindow(QMainWindow):
             widget.slider_moved.connect(self.on_slider_move)
             self.sliderLayout.addWidget(widget)
 
+    def create_graph(self, memory_budget, interpolation):
+        """
+        Create a processing graph with its own copy of every processor: rotation first, then every processor
+        in order, each using the rotated image as its unchanged image. Stage outputs are cached, so a change
+        only recomputes the stages downstream of it
+        :param memory_budget: Memory budget of the graph's cached images (bytes)
+        :param interpolation: cv2 interpolation flag of the rotation
+        :return: A ProcessingGraph
+        """
+        rotation_processor = copy.copy(self._rotation_processor)
+        rotation_processor.set_interpolation(interpolation)
+
+        graph = processing_graph.ProcessingGraph(memory_budget)
+        graph.add_stage(BEHAVIOR_ROTATION, rotation_processor)
+
+        upstream = BEHAVIOR_ROTATION
+        for (name, p) in self._processors.items():
+            graph.add_stage(name, copy.copy(p), upstream=upstream, origin=BEHAVIOR_ROTATION)
+            upstream = name
+
+        return graph
+
+    def set_processing_value(self, behavior_name, value):
+        """
+        Set a processing value, used by every following render request
+        :param behavior_name: Processor behavior.name
+        :param value: The processors unique value
+        :return:
+        """
+        self._values[behavior_name] = value
+
+    def render_preview(self):
+        """
+        Request a render of the preview, and schedule the full resolution render
+        :return:
+        """
+        self._worker.submit(PREVIEW_RENDER, (self._proxy_img, dict(self._values)))
+        self._full_render_timer.start()
+
+    @pyqtSlot()
+    def render_full_resolution(self):
+        """
+        Request a render of the full resolution image (cached when nothing changed since the last render)
+        :return:
+        """
+        self._full_render_timer.stop()
+        # Rendered once the import finished decoding the full resolution image
+        if self._color_img is None:
+            return
+        self._worker.submit(FULL_RENDER, (self._color_img, dict(self._values)))
+
+    def process_request(self, kind, request):
+        """
+        Render a request on its graph (runs on the worker thread)
+        :param kind: Request kind (PREVIEW_RENDER or FULL_RENDER)
+        :param request: 2-tuple of (source image, processing values)
+        :return: The processed image
+        """
+        (source, values) = request
+        graph = self._graphs[kind]
+
+        if graph.source() is not source:
+            graph.set_source(source)
+        for (name, value) in values.items():
+            graph.set_value(name, value)
+
+        image = graph.render(self._output_stage)
+        # Cached for show_statistics, so the GUI thread does not compute them
+        if kind == PREVIEW_RENDER and self._collect_statistics:
+            self._image_statistics.get(source)
+            self._image_statistics.get(image, source, values)
+        return image
+
+    def on_render_finished(self, kind, request, image):
+        """
+        Slot which displays the results of the worker thread
+        :param kind: Request kind (PREVIEW_RENDER or FULL_RENDER)
+        :param request: 2-tuple of (source image, processing values)
+        :param image: The processed image
+        :return:
+        """
+        (source, values) = request
+
+        if kind == PREVIEW_RENDER and source is self._proxy_img:
+            self._preview_img = image
+            self._preview_request = request
+            utils.display_img(self._preview_img, self.rightImgLabel)
+            self.show_statistics()
+
+        # Full resolution renders are only used while their values are still current
+        elif kind == FULL_RENDER and source is self._color_img and values == self._values:
+            self._processed_img = image
+            utils.display_img(self._processed_img, self.rightImgLabel)
+
+            if self._pending_save:
+                cv2.imwrite(self._pending_save, self._processed_img)
+                self._pending_save = None
+
+        self.statusBar().showMessage(
+            f"Coalesced {self._worker.coalesced} of {self._worker.submitted} processing requests")
+
+    def closeEvent(self, event):
+        """
+        Stop the import and processing workers when the window is closed, then release the detector and close the
+        detection cache
+        :param event: Close event
+        :return:
+        """
+        self._loader.stop()
+        self._worker.stop()
+        if self._detector is not None:
+            self._detector.close()
+            self._detector = None
+        if self._detection_cache is not None:
+            self._detection_cache.close()
+            self._detection_cache = None
+        super(MainWindow, self).closeEvent(event)
+
     def center(self):
         """
         Move the UI location to the center of the screen
@@ -142,18 +403,14 @@ class MainWindow(QMainWindow):
         :param behavior_name: Processor behavior.name
         :param slider_value: QSlider value from the UI
         """
-        if self._color_img is None:
-            return
-
         # Cache the processors unique value from it's respective slider position
-        self._processors[behavior_name].set_unique_value(slider_value)
+        self.set_processing_value(behavior_name, slider_value)
 
-        # We need to loop through every processor and reprocess each time any slider is moved
-        for (_, p) in self._processors.items():
-            # Use the rotated image for any changed dimensions
-            self._processed_img = p.process_image(self._rotated_img, self._processed_img)
+        if self._proxy_img is None:
+            return
 
-        utils.display_img(self._processed_img, self.rightImgLabel)
+        # Only the stages from the moved slider downstream are reprocessed
+        self.render_preview()
 
     def rotate_image(self, rotation_angle):
         """
@@ -161,28 +418,37 @@ class MainWindow(QMainWindow):
         :param rotation_angle: Angle of rotation from the QDial
         :return:
         """
-        if self._color_img is None:
+        if rotation_angle == self._values[BEHAVIOR_ROTATION]:
+            return
+        self.set_processing_value(BEHAVIOR_ROTATION, rotation_angle)
+
+        if self._proxy_img is None:
             return
 
-        self._rotation_processor.set_unique_value(rotation_angle)
-        self._rotated_img = self._rotation_processor.process_image(self._color_img, self._processed_img)
+        # Every stage depends on the rotated image, so the whole chain is reprocessed (on the proxy while dragging)
+        self.render_preview()
 
-        # Do processing every time the image is rotated, this time used the processed image in place of the
-        # un-modified image. We want to use the size/shape of the transformed image this time
-        for (_, p) in self._processors.items():
-            self._processed_img = p.process_image(self._rotated_img, self._processed_img)
+    @pyqtSlot()
+    def on_rotate_released(self):
+        """
+        Handle when the rotation dial is released: render the full resolution image without waiting
+        :return:
+        """
+        if self._color_img is None:
+            return
 
-        utils.display_img(self._processed_img, self.rightImgLabel)
+        self.render_full_resolution()
 
     def on_facial_recog_cb_changed(self, cb_index):
         """
         Handle when the detect button is clicked on the UI
         """
+        # Detections are drawn once the import finished
         if self._color_img is None:
             return
 
         if cb_index == SHOW_FACIAL_RECOG:
-            utils.display_img(self._detected_img, self.leftImgLabel)
+            utils.display_img(self._color_img, self.leftImgLabel, detections=self._detections)
         if cb_index == HIDE_FACIAL_RECOG:
             utils.display_img(self._color_img, self.leftImgLabel)
 
@@ -191,7 +457,7 @@ class MainWindow(QMainWindow):
         Display results after detection
         :return:
         """
-        num_faces = self._detector.faces()
+        num_faces = len(self._detections)
         if num_faces == 1:
             self.imgDescriptLabel.setText("There is one face detected in the imported photo.")
         elif num_faces > 1:
@@ -215,9 +481,15 @@ class MainWindow(QMainWindow):
         Handle when the save button is clicked on the UI
         :return:
         """
+        if self._proxy_img is None:
+            return
+
         (filename, _) = QFileDialog.getSaveFileName(self, 'Save File', QDir.home().path(), "Image Files (*.jpg)")
         if filename:
-            cv2.imwrite(filename, self._processed_img)
+            # Saved once the full resolution render (usually already cached) comes back from the worker, an image
+            # which is still importing is rendered (and saved) when the import finishes
+            self._pending_save = filename
+            self.render_full_resolution()
 
     @pyqtSlot()
     def on_exit_button_clicked(self):
@@ -229,27 +501,97 @@ class MainWindow(QMainWindow):
 
     def load_image(self, img_path):
         """
-        Loads an image
+        Loads an image: a reduced size preview is decoded and shown right away, while the full resolution image is
+        decoded and searched for faces in the background (see import_request)
         :param img_path: The path to (including) the image
         :return: Return nothing if the image is not found
         """
-        self._color_img = cv2.imread(img_path)
-        if self._color_img is None:
+        (preview, _) = utils.read_preview(img_path)
+        if preview is None:
+            return
+
+        self._import_generation += 1
+        self._color_img = None
+        self._detections = None
+        self._proxy_img = utils.resize_to_fit(preview)
+        self._processed_img = None
+        self._pending_save = None
+
+        utils.display_img(self._proxy_img, self.leftImgLabel)
+        self.imgDescriptLabel.setText("Detecting faces...")
+        self.on_import_progress(self._import_generation, 0, "Decoding")
+        self._loader.submit(IMPORT_REQUEST, (self._import_generation, img_path))
+
+        # Display the image, processed with the current settings, on the right label on import
+        self.render_preview()
+
+    def import_request(self, kind, request):
+        """
+        Decode the full resolution image and detect faces (runs on the import worker thread)
+        :param kind: Request kind (IMPORT_REQUEST)
+        :param request: 2-tuple of (import generation, image path)
+        :return: A 3-tuple of (image, detections, error message), the image is None when it could not be read
+        """
+        (generation, img_path) = request
+        color_img = cv2.imread(img_path)
+        if color_img is None:
+            return None, None, f"Could not read {img_path}"
+
+        self.import_progress.emit(generation, DECODED_PROGRESS, "Detecting faces")
+        # Try to detect faces on import, the boxes are only drawn when displaying
+        detections = self.detector().detect(cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY))
+        return color_img, detections, None
+
+    def on_import_error(self, kind, request, error):
+        """
+        Import worker error handler (runs on the import worker thread)
+        :param kind: Request kind (IMPORT_REQUEST)
+        :param request: 2-tuple of (import generation, image path)
+        :param error: The exception
+        :return:
+        """
+        self.import_finished.emit(kind, request, (None, None, str(error)))
+
+    def on_import_progress(self, generation, percent, message):
+        """
+        Slot which shows the progress of an import
+        :param generation: Import generation
+        :param percent: Progress (percent)
+        :param message: Current step
+        :return:
+        """
+        if generation != self._import_generation:
             return
 
-        self._grayscale_img = cv2.cvtColor(self._color_img, cv2.COLOR_BGR2GRAY)
-        self._processed_img = self._color_img.copy()
-        self._rotated_img = self._color_img.copy()
-        self._detected_img = self._color_img.copy()
+        self._import_progress_bar.setValue(percent)
+        self._import_progress_bar.setFormat(f"{message} %p%")
+        self._import_progress_bar.show()
+
+    def on_import_finished(self, kind, request, result):
+        """
+        Slot which swaps the full resolution image in once the import worker is done with it
+        :param kind: Request kind (IMPORT_REQUEST)
+        :param request: 2-tuple of (import generation, image path)
+        :param result: 3-tuple of (image, detections, error message)
+        :return:
+        """
+        (generation, _) = request
+        if generation != self._import_generation:
+            return
+
+        (color_img, detections, error) = result
+        self._import_progress_bar.hide()
+        if color_img is None:
+            self.imgDescriptLabel.setText(error)
+            return
 
-        # Try to detect faces on import
-        self._detected_img = self._detector.detect(self._grayscale_img, self._detected_img)
+        self._color_img = color_img
+        self._detections = detections
         self.display_detection()
 
         if self.facialRecogComboBox.currentIndex() == SHOW_FACIAL_RECOG:
-            utils.display_img(self._detected_img, self.leftImgLabel)
+            utils.display_img(self._color_img, self.leftImgLabel, detections=self._detections)
         else:
             utils.display_img(self._color_img, self.leftImgLabel)
 
-        # Display the original image on the right label on import
-        utils.display_img(self._color_img, self.rightImgLabel)
+        self.render_full_resolution()
@@ -1,6 +1,6 @@
 from PyQt5.QtCore import pyqtSlot
 from PyQt5.QtWidgets import QWidget
-from PyQt5.uic import loadUi
+from coreUI.ui_loader import load_ui
 from PyQt5.QtCore import pyqtSignal
 
 
@@ -17,7 +17,7 @@ class SliderWidget(QWidget):
 
     def __init__(self, behavior):
         super(QWidget, self).__init__()
-        loadUi(SLIDER_WIDGET_UI, self)
+        load_ui(SLIDER_WIDGET_UI, self)
 
         # Slider behavior model parameters
         self._behavior = behavior
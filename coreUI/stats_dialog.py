@@ -0,0 +1,85 @@
+from PyQt5.QtCore import QDir, QTimer
+from PyQt5.QtWidgets import QDialog, QFileDialog
+from coreUI.ui_loader import load_ui
+from utils import instrumentation
+
+
+STATS_DIALOG_UI = 'coreUI/stats_dialog.ui'
+
+# Time between refreshes of the shown statistics (ms)
+REFRESH_INTERVAL = 500
+
+
+class StatsDialog(QDialog):
+    """Statistics Dialog Window, shows the latencies recorded by the shared instrumentation"""
+
+    def __init__(self):
+        super(StatsDialog, self).__init__()
+        load_ui(STATS_DIALOG_UI, self)
+
+        self._instrumentation = instrumentation.INSTRUMENTATION
+
+        self.recordCheckBox.setChecked(self._instrumentation.enabled)
+        self.recordCheckBox.toggled.connect(self.on_record_toggled)
+        self.resetButton.clicked.connect(self.on_reset_clicked)
+        self.saveJsonButton.clicked.connect(self.on_save_json_clicked)
+        self.saveTraceButton.clicked.connect(self.on_save_trace_clicked)
+
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setInterval(REFRESH_INTERVAL)
+        self._refresh_timer.timeout.connect(self.refresh)
+        self._refresh_timer.start()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Show the current statistics
+        :return:
+        """
+        self.statsTextEdit.setPlainText(self._instrumentation.summary())
+
+    def on_record_toggled(self, checked):
+        """
+        Handle when recording is switched on or off
+        :param checked: Record statistics
+        :return:
+        """
+        if checked:
+            self._instrumentation.enable()
+        else:
+            self._instrumentation.disable()
+
+    def on_reset_clicked(self):
+        """
+        Handle when the reset button is clicked
+        :return:
+        """
+        self._instrumentation.reset()
+        self.refresh()
+
+    def on_save_json_clicked(self):
+        """
+        Handle when the save JSON button is clicked
+        :return:
+        """
+        (filename, _) = QFileDialog.getSaveFileName(self, 'Save Statistics', QDir.home().path(), "JSON (*.json)")
+        if filename:
+            self._instrumentation.dump_json(filename)
+
+    def on_save_trace_clicked(self):
+        """
+        Handle when the save Chrome trace button is clicked
+        :return:
+        """
+        (filename, _) = QFileDialog.getSaveFileName(self, 'Save Chrome Trace', QDir.home().path(), "JSON (*.json)")
+        if filename:
+            self._instrumentation.dump_chrome_trace(filename)
+
+    def closeEvent(self, event):
+        """
+        Stop refreshing when the dialog is closed
+        :param event: Close event
+        :return:
+        """
+        self._refresh_timer.stop()
+        super(StatsDialog, self).closeEvent(event)
@@ -0,0 +1,128 @@
+import glob
+import hashlib
+import importlib.util
+import io
+import os
+
+
+# Directory the UI forms are compiled into
+UI_CACHE_DIR = os.path.join('coreUI', 'compiled')
+
+# First line of a compiled form, recording the digest of the form it was compiled from
+DIGEST_HEADER = "# Form digest: "
+
+# Form classes already loaded in this process, by form path
+_form_classes = {}
+
+
+def compiled_path(ui_path, cache_dir=UI_CACHE_DIR):
+    """
+    Path of the compiled module of a UI form
+    :param ui_path: Path of the .ui form
+    :param cache_dir: Directory of the compiled forms
+    :return: Module path
+    """
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(ui_path))[0] + "_ui.py")
+
+
+def _digest(ui_path):
+    with open(ui_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _compiled_digest(module_path):
+    try:
+        with open(module_path, "r") as f:
+            line = f.readline()
+    except OSError:
+        return None
+    return line[len(DIGEST_HEADER):].strip() if line.startswith(DIGEST_HEADER) else None
+
+
+def _compile_source(ui_path, digest):
+    # uic (and its XML parser) is only imported when a form actually needs compiling
+    from PyQt5 import uic
+
+    source = io.StringIO()
+    source.write(f"{DIGEST_HEADER}{digest}\n")
+    uic.compileUi(ui_path, source)
+    return source.getvalue()
+
+
+def compile_ui(ui_path, cache_dir=UI_CACHE_DIR):
+    """
+    Compile a UI form into a Python module, unless the module is already up to date with the form
+    :param ui_path: Path of the .ui form
+    :param cache_dir: Directory of the compiled forms
+    :return: Path of the compiled module
+    """
+    module_path = compiled_path(ui_path, cache_dir)
+    digest = _digest(ui_path)
+    if _compiled_digest(module_path) != digest:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under another name first, so a concurrent start never imports a partial module
+        tmp_path = f"{module_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(_compile_source(ui_path, digest))
+        os.replace(tmp_path, module_path)
+    return module_path
+
+
+def form_class(ui_path, cache_dir=UI_CACHE_DIR):
+    """
+    Get the generated form class (Ui_<name>) of a UI form, compiling it when needed
+    The compiled module is imported like any other module, so its bytecode is cached as well. When the cache
+    directory can not be written the form is compiled in memory instead
+    :param ui_path: Path of the .ui form
+    :param cache_dir: Directory of the compiled forms
+    :return: The form class
+    """
+    cls = _form_classes.get(ui_path)
+    if cls is not None:
+        return cls
+
+    try:
+        module_path = compile_ui(ui_path, cache_dir)
+        name = "coreUI.compiled." + os.path.splitext(os.path.basename(module_path))[0]
+        spec = importlib.util.spec_from_file_location(name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        namespace = vars(module)
+    except OSError:
+        namespace = {}
+        exec(_compile_source(ui_path, _digest(ui_path)), namespace)
+
+    cls = next(v for (k, v) in namespace.items() if k.startswith("Ui_") and isinstance(v, type))
+    _form_classes[ui_path] = cls
+    return cls
+
+
+def load_ui(ui_path, widget, cache_dir=UI_CACHE_DIR):
+    """
+    Drop-in replacement of PyQt5.uic.loadUi, building the form from its compiled module rather than parsing the
+    XML on every construction. Child widgets become attributes of the widget, like with loadUi
+    :param ui_path: Path of the .ui form
+    :param widget: Widget to set the form up on
+    :param cache_dir: Directory of the compiled forms
+    :return: The widget
+    """
+    form = form_class(ui_path, cache_dir)()
+    form.setupUi(widget)
+    for (name, value) in vars(form).items():
+        setattr(widget, name, value)
+    return widget
+
+
+def compile_all(ui_dir='coreUI', cache_dir=UI_CACHE_DIR):
+    """
+    Compile every UI form ahead of time (ie: when installing or packaging)
+    :param ui_dir: Directory of the .ui forms
+    :param cache_dir: Directory of the compiled forms
+    :return: Paths of the compiled modules
+    """
+    return [compile_ui(ui_path, cache_dir) for ui_path in sorted(glob.glob(os.path.join(ui_dir, "*.ui")))]
+
+
+if __name__ == '__main__':
+    for path in compile_all():
+        print(path)
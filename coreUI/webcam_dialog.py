@@ -1,44 +1,62 @@
 import cv2
-from PyQt5.QtCore import pyqtSignal, QTimer
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtGui import QRegion
 from PyQt5.QtWidgets import QDialog
-from PyQt5.uic import loadUi
+from coreUI.ui_loader import load_ui
+from utils import instrumentation
 from utils import processing_utils as utils
 from core import detector
+from core import frame_pipeline
+from core import tracker
 
 
 IMAGE_DESCRIPT_DIALOG_UI = 'coreUI/webcam_dialog.ui'
 
+# Frames between full face detections, faces are tracked in between
+DETECT_INTERVAL = 10
+
 
 class WebcamDialog(QDialog):
     """Webcam Dialog Window"""
 
     # Resized signal
     resized = pyqtSignal()
+    # New processed frame signal (emitted from the processing thread)
+    frame_ready = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, frame_source=None):
+        """
+        Constructor
+        :param frame_source: Optional frame source used in place of the webcam: a video file path, or an object with
+                             a cv2.VideoCapture like read() and release() (ie: a SyntheticFrameSource)
+        """
         super(WebcamDialog, self).__init__()
-        loadUi(IMAGE_DESCRIPT_DIALOG_UI, self)
+        load_ui(IMAGE_DESCRIPT_DIALOG_UI, self)
 
         self.webcamDisplayLabel.setMouseTracking(False)
         self.mask_label_region()
 
-        # Webcam capture
-        self._capture = None
+        # Frame source replacing the webcam
+        self._frame_source = frame_source
+        # Capture/processing pipeline
+        self._pipeline = None
         # Image capture
         self._image = None
-        # Detected image
-        self._image_detected = None
-        # Frame timers
-        self._frame_timer = None
         # Is facial recognition active?
         self._recog_active = False
         # Image recognition detector object
         self._detector = detector.Detector()
+        # Detect-then-track: full detection every DETECT_INTERVAL frames (or on tracking loss)
+        self._tracker = tracker.DetectionTracker(self._detector, DETECT_INTERVAL)
+        # Window title from the UI form
+        self._title = self.windowTitle()
+        # Displayed frame rate
+        self._frame_rate = instrumentation.RateMeter()
 
         self.enableDisableRecogButton.clicked.connect(self.on_enable_disable_recog_clicked)
         self.startWebcamButton.clicked.connect(self.on_start_webcam_clicked)
         self.stopPauseWebcamButton.clicked.connect(self.on_stop_pause_webcam_clicked)
+        self.frame_ready.connect(self.update_frame)
 
     def resizeEvent(self, event):
         """
@@ -62,39 +80,105 @@ class WebcamDialog(QDialog):
         Handle when the start webcam button is clicked
         :return:
         """
-        self._capture = cv2.VideoCapture(0)
-        # Get initial label dimensions
-        self._capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.webcamDisplayLabel.height())
-        self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.webcamDisplayLabel.width())
+        self.stop_pipeline()
+
+        if self._frame_source is None:
+            capture = cv2.VideoCapture(0)
+            # Get initial label dimensions
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.webcamDisplayLabel.height())
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.webcamDisplayLabel.width())
+        elif isinstance(self._frame_source, str):
+            capture = cv2.VideoCapture(self._frame_source)
+        else:
+            capture = self._frame_source
+
+        # Frames are captured and processed on their own threads, and displayed whenever a new one is ready. Captures
+        # are opened again on every start, a frame source given by the caller stays open so that it can be restarted
+        self._pipeline = frame_pipeline.FramePipeline(capture, self.process_frame, on_result=self.frame_ready.emit,
+                                                      release_source=capture is not self._frame_source)
+        self._pipeline.start()
+
+    def process_frame(self, frame):
+        """
+        Process a captured frame (runs on the processing thread)
+        :param frame: Captured frame
+        :return: A 2-tuple of (flipped frame, DetectionResult or None)
+        """
+        # Flip the image after reading
+        frame = cv2.flip(frame, 1)
+        detections = None
 
-        self._frame_timer = QTimer(self)
-        self._frame_timer.timeout.connect(self.update_frame)
-        self._frame_timer.start(5)
+        if self._recog_active:
+            grayscale_img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            detections = self._tracker.update(grayscale_img)
+        else:
+            # Start over with a full detection once recognition is enabled again
+            self._tracker.reset()
+
+        return frame, detections
 
     def update_frame(self):
         """
-        Handle when the frame timer times out
+        Handle when a new processed frame is ready
         :return:
         """
-        (_, self._image) = self._capture.read()
+        if self._pipeline is None:
+            return
 
-        # Flip the image after reading
-        self._image = cv2.flip(self._image, 1)
-        self._image_detected = self._image.copy()
+        # Stale frames were already dropped, only the newest frame is displayed
+        result = self._pipeline.get()
+        if result is None:
+            return
 
-        if self._recog_active:
-            grayscale_img = cv2.cvtColor(self._image, cv2.COLOR_BGR2GRAY)
-            self._image_detected = self._detector.detect(grayscale_img, self._image)
+        (self._image, detections) = result
+        if detections is not None:
+            self.setWindowTitle(f"{self._title} - full detection on {self._tracker.detection_rate():.0%} of frames")
 
-        utils.display_img(self._image_detected, self.webcamDisplayLabel, scale_contents=True)
-        self._image_detected = self._image.copy()
+        # Detections are drawn on the display sized frame, the captured frame is never modified
+        utils.display_img(self._image, self.webcamDisplayLabel, scale_contents=True, detections=detections,
+                          overlay=self.overlay_lines())
+
+    def overlay_lines(self):
+        """
+        Frame rate and latency overlay, latencies are only shown while instrumentation is recording
+        :return: List of overlay text lines
+        """
+        lines = [f"{self._frame_rate.tick():.1f} FPS, {self._pipeline.frames_dropped()} dropped"]
+
+        for (name, label) in (("capture/process", "process"), ("detector/faces", "faces"), ("display", "display")):
+            histogram = instrumentation.INSTRUMENTATION.histogram(name)
+            if instrumentation.INSTRUMENTATION.enabled and histogram is not None:
+                lines.append(f"{label} {histogram.percentile(50) * 1000:.1f} ms "
+                             f"(p95 {histogram.percentile(95) * 1000:.1f} ms)")
+
+        return lines
 
     def on_stop_pause_webcam_clicked(self):
         """
         Handle when the stop/pause webcam button is clicked
         :return:
         """
-        self._frame_timer.stop()
+        self.stop_pipeline()
+
+    def stop_pipeline(self):
+        """
+        Stop capturing and processing frames, and release the capture (a frame source given by the caller is left
+        open)
+        :return:
+        """
+        if self._pipeline is not None:
+            self._pipeline.stop()
+            self._pipeline = None
+
+    def closeEvent(self, event):
+        """
+        Release the capture (and the detection threads) when the dialog is closed
+        :param event: Close event
+        :return:
+        """
+        self.stop_pipeline()
+        self._detector.close()
+        super(WebcamDialog, self).closeEvent(event)
 
     def mask_label_region(self):
         """
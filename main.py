@@ -1,4 +1,9 @@
-# Python version 3.6
+# Python version 3.7
+
+import time
+
+# Reference of the start up report, taken before anything else is imported
+START_TIME = time.perf_counter()
 
 import os
 import sys
@@ -7,6 +12,13 @@ from coreUI import main_window as dejavu_window_main
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtGui import QIcon
+from utils import instrumentation
+from utils import kernel_utils
+
+IMPORTS_TIME = time.perf_counter()
+
+# Command line flag printing the start up report once the window is first painted, then exiting
+STARTUP_REPORT_FLAG = "--startup-report"
 
 
 os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
@@ -34,21 +46,100 @@ def my_exception_hook(exctype, value, traceback):
 sys.excepthook = my_exception_hook
 
 
+class StartupReport(QtCore.QObject):
+    """Times the start up phases, up to the first paint of the main window"""
+
+    def __init__(self, start=START_TIME):
+        """
+        Constructor
+        :param start: Start of the process (time.perf_counter)
+        """
+        super(StartupReport, self).__init__()
+        self._start = start
+        self._last = start
+        self._phases = []   # List of (phase, duration)
+        self._on_painted = None
+
+    def mark(self, phase, now=None):
+        """
+        End a phase, which started when the previous one ended
+        :param phase: Phase name
+        :param now: End of the phase (time.perf_counter), defaults to now
+        :return:
+        """
+        now = time.perf_counter() if now is None else now
+        self._phases.append((phase, now - self._last))
+        # Phases also show up in the statistics and traces when instrumentation is on
+        if instrumentation.INSTRUMENTATION.enabled:
+            instrumentation.INSTRUMENTATION.record(f"startup/{phase}", self._last, now - self._last)
+        self._last = now
+
+    def watch(self, window, on_painted=None):
+        """
+        Mark the first paint of a window
+        :param window: Window
+        :param on_painted: Optional callable, called once the window is painted
+        :return:
+        """
+        self._on_painted = on_painted
+        window.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            watched.removeEventFilter(self)
+            self.mark("first paint")
+            if self._on_painted is not None:
+                self._on_painted()
+        return False
+
+    def total(self):
+        """
+        :return: Time from the process start to the end of the last phase (seconds)
+        """
+        return self._last - self._start
+
+    def report(self):
+        """
+        :return: Text report of the phases
+        """
+        lines = [f"{phase:<16}{duration * 1000:8.1f} ms" for (phase, duration) in self._phases]
+        lines.append(f"{'time to paint':<16}{self.total() * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
 def main():
     """
     Application entry:
      * Sets up the QApplication
      * Creates the main window
      * Starts the event loop
+    With --startup-report, the time of every start up phase is printed once the window is painted, and the
+    application exits
     :return:
     """
-    app = QApplication(sys.argv)
+    startup = StartupReport()
+    startup.mark("imports", IMPORTS_TIME)
+    print_report = STARTUP_REPORT_FLAG in sys.argv
+
+    app = QApplication([a for a in sys.argv if a != STARTUP_REPORT_FLAG])
     app.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling)
     app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
     app.setWindowIcon(QIcon('coreUI/dejavu_ir_logo_small.png'))
+    startup.mark("application")
 
     window = dejavu_window_main.MainWindow()
     window.setWindowTitle("Dejavu Image Processing")
+    startup.mark("main window")
+
+    def on_painted():
+        if print_report:
+            print(startup.report())
+            app.quit()
+        else:
+            # Measured once the window shows, rather than by the first filtering with a large kernel
+            kernel_utils.calibrate_in_background()
+
+    startup.watch(window, on_painted)
     window.show()
 
     try:
@@ -0,0 +1,703 @@
+# Python version 3.7
+
+import argparse
+import base64
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as ResultTimeout
+from concurrent.futures.process import BrokenProcessPool
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import util as multiprocessing_util
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import cv2
+import numpy as np
+import batch
+from core import detector
+from core import image_processor as processor
+from utils import instrumentation
+from utils import processing_utils as utils
+
+
+# Default address, the service is only reachable from this machine
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Default number of worker processes
+SERVICE_WORKERS = os.cpu_count() or 1
+
+# Micro-batching: a batch is sent to a worker once it holds MAX_BATCH requests, or BATCH_WINDOW seconds after its
+# first request. Batches only form while a worker is free, so under load they fill up on their own
+MAX_BATCH = 8
+BATCH_WINDOW = 0.005
+
+# Requests waiting for a worker beyond this are rejected (503), rather than queueing without bound
+MAX_QUEUE = 256
+
+# Time a request waits for its result (seconds), and the largest accepted image upload (bytes)
+REQUEST_TIMEOUT = 60
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+# Request kinds (and their paths)
+DETECT_REQUEST = "detect"
+PROCESS_REQUEST = "process"
+
+# Encodings of processed images
+IMAGE_FORMATS = ("jpg", "png")
+
+# Per process worker state, created once by the pool initializer
+_worker = None
+
+
+class ServiceWorker:
+    """Detection and processing of service requests, one instance per worker process"""
+
+    def __init__(self, profile=None):
+        """
+        Constructor, warms the detector up so the first request does not pay for parsing the cascades
+        :param profile: DetectionProfile, the default profile when not given
+        """
+        # Worker processes already use every core, so eyes and tiles are detected sequentially
+        self._detector = detector.Detector(eye_workers=1, tile_workers=1, profile=profile)
+        self._detector.detect(np.zeros((64, 64), np.uint8))
+
+    def close(self):
+        """
+        Release the detector
+        :return:
+        """
+        self._detector.close()
+
+    def handle(self, kind, data, options):
+        """
+        Handle a request
+        :param kind: DETECT_REQUEST or PROCESS_REQUEST
+        :param data: Encoded image (file contents)
+        :param options: Request options (see parse_options)
+        :return: The result dictionary, with an "error" when the request failed
+        """
+        timings = {}
+        start = time.perf_counter()
+        color_img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if color_img is None:
+            return {"error": "Image could not be decoded", "timings": timings}
+        timings["decode"] = time.perf_counter() - start
+
+        (h, w) = color_img.shape[:2]
+        result = {"width": w, "height": h}
+
+        if kind == DETECT_REQUEST or options["detect"]:
+            start = time.perf_counter()
+            detections = self._detector.detect(cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY), options["eyes"],
+                                               options["max_face_size"])
+            timings["detect"] = time.perf_counter() - start
+            result["faces"] = len(detections)
+            result["face_boxes"] = detections.faces.tolist()
+            result["eye_boxes"] = [e.tolist() for e in detections.eyes]
+            result["scores"] = detections.scores.tolist()
+
+        if kind == PROCESS_REQUEST:
+            start = time.perf_counter()
+            (rotation_processor, processors) = batch.build_processors(options["settings"])
+            rotated_img = rotation_processor.run(color_img, color_img)
+            processed_img = processor.process_chain(processors, rotated_img, rotated_img)
+            timings["process"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            (_, encoded) = cv2.imencode("." + options["format"], processed_img)
+            result["format"] = options["format"]
+            result["image"] = base64.b64encode(encoded.tobytes()).decode("ascii")
+            timings["encode"] = time.perf_counter() - start
+
+        result["timings"] = timings
+        return result
+
+    def handle_batch(self, requests):
+        """
+        Handle a batch of requests, a failing request does not fail the others
+        :param requests: List of (kind, data, options)
+        :return: List of result dictionaries, in request order
+        """
+        results = []
+        for (kind, data, options) in requests:
+            try:
+                results.append(self.handle(kind, data, options))
+            except Exception as e:
+                results.append({"error": str(e), "timings": {}})
+        return results
+
+
+def _init_worker(profile):
+    """
+    Process pool initializer, creates the (warm) worker state once per process
+    :return:
+    """
+    global _worker
+    _worker = ServiceWorker(profile)
+    # Pool processes exit without running atexit handlers, multiprocessing finalizers do run
+    multiprocessing_util.Finalize(None, _worker.close, exitpriority=10)
+
+
+def _ready():
+    """
+    Process pool task run on start, so every worker process is started (and warm) before the first request
+    :return: Worker process id
+    """
+    return os.getpid()
+
+
+def _handle_batch(requests):
+    """
+    Process pool task, runs on the worker created by _init_worker
+    :param requests: List of (kind, data, options)
+    :return: List of result dictionaries
+    """
+    return _worker.handle_batch(requests)
+
+
+def parse_options(kind, query):
+    """
+    Validate the options of a request
+    :param kind: DETECT_REQUEST or PROCESS_REQUEST
+    :param query: Mapping of query parameters to their values
+    :return: Options dictionary: detect, eyes, max_face_size, and for processing the settings and format
+    """
+    def value(name, default, parse=int):
+        try:
+            return parse(query[name]) if name in query else default
+        except ValueError:
+            raise ValueError(f"Invalid {name}: {query[name]}")
+
+    options = {
+        "detect": kind == DETECT_REQUEST or bool(value("detect", 0)),
+        "eyes": bool(value("eyes", 1)),
+        "max_face_size": value("max_face_size", None)
+    }
+    if options["max_face_size"] is not None and options["max_face_size"] <= 0:
+        raise ValueError("max_face_size must be positive")
+
+    if kind == PROCESS_REQUEST:
+        num_kernels = len(utils.Kernels().kernels_list)
+        settings = {"kernel": None}
+        for (name, (min_v, max_v)) in (("brightness", batch.BRIGHTNESS_RANGE), ("contrast", batch.CONTRAST_RANGE),
+                                       ("filter", (0, num_kernels - 1)), ("rotation", batch.ROTATION_RANGE)):
+            settings[name] = value(name, 0)
+            if not min_v <= settings[name] <= max_v:
+                raise ValueError(f"{name} must be between {min_v} and {max_v}")
+        options["settings"] = settings
+
+        options["format"] = query.get("format", IMAGE_FORMATS[0])
+        if options["format"] not in IMAGE_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(IMAGE_FORMATS)}")
+
+    return options
+
+
+class _PendingRequest:
+    """Request waiting in the batching queue"""
+
+    __slots__ = ("kind", "data", "options", "future", "submitted")
+
+    def __init__(self, kind, data, options):
+        self.kind = kind
+        self.data = data
+        self.options = options
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class DetectionService:
+    """
+    Detection and processing service: a pool of warm worker processes (cascades loaded and parsed up front) behind
+    a micro-batching queue. Requests are grouped into batches while a worker is free, amortizing the cost of handing
+    work to a process, and the queue depth, batch sizes and latencies are kept as metrics
+    """
+
+    def __init__(self, workers=SERVICE_WORKERS, max_batch=MAX_BATCH, batch_window=BATCH_WINDOW, max_queue=MAX_QUEUE,
+                 profile=None):
+        """
+        Constructor, starts the worker processes and waits until they are warm
+        :param workers: Number of worker processes
+        :param max_batch: Largest number of requests handed to a worker at once
+        :param batch_window: Time a batch waits for more requests after its first (seconds)
+        :param max_queue: Largest number of waiting requests, more are rejected
+        :param profile: DetectionProfile, the default profile when not given
+        """
+        self._workers = max(1, workers)
+        self._max_batch = max(1, max_batch)
+        self._batch_window = batch_window
+        self._max_queue = max_queue
+        self._profile = profile
+
+        # Forked workers inherit the cascade files instead of each reading them from disk
+        utils.CASCADE_REGISTRY.preload()
+        self._worker_pids = []
+        self._healthy = True            # False once the worker pool could not be restarted
+        self._executor = self._start_workers()
+
+        self._queue = queue.Queue(max_queue)
+        self._free_workers = threading.Semaphore(self._workers)
+        self._in_flight = 0             # Batches being handled by a worker
+        self._lock = threading.Lock()
+        self._metrics = instrumentation.Instrumentation(enabled=True, trace=False)
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run, name="ServiceBatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, data, options):
+        """
+        Queue a request
+        :param kind: DETECT_REQUEST or PROCESS_REQUEST
+        :param data: Encoded image (file contents)
+        :param options: Request options (see parse_options)
+        :return: A Future of the result dictionary
+        :raises queue.Full: When the queue is full
+        """
+        request = _PendingRequest(kind, data, options)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            self._metrics.count("service/rejected")
+            raise
+        self._metrics.count(f"service/{kind}_requests")
+        return request.future
+
+    def _start_workers(self):
+        """
+        Start the worker processes and wait until they are warm
+        :return: The ProcessPoolExecutor
+        """
+        executor = ProcessPoolExecutor(self._workers, initializer=_init_worker, initargs=(self._profile,))
+        try:
+            self._worker_pids = sorted({f.result() for f in [executor.submit(_ready) for _ in range(self._workers)]})
+        except Exception:
+            executor.shutdown(wait=False)
+            raise
+        return executor
+
+    def healthy(self):
+        """
+        :return: False when the worker pool broke and could not be restarted
+        """
+        return self._healthy
+
+    def queue_depth(self):
+        """
+        :return: Number of requests waiting for a worker
+        """
+        return self._queue.qsize()
+
+    def metrics(self):
+        """
+        Snapshot of the service metrics
+        :return: Dictionary of the queue depth, batches in flight, configuration, worker process ids, latencies
+                 (seconds) and counters
+        """
+        stats = self._metrics.stats()
+        counters = stats["counters"]
+        batches = counters.get("service/batches", 0)
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "queue_depth": self.queue_depth(),
+            "max_queue": self._max_queue,
+            "in_flight_batches": in_flight,
+            "workers": self._workers,
+            "worker_pids": list(self._worker_pids),
+            "max_batch": self._max_batch,
+            "batch_window": self._batch_window,
+            "mean_batch_size": counters.get("service/batched_requests", 0) / batches if batches else 0.0,
+            "latency": {name: {k: v for (k, v) in s.items() if k != "buckets"}
+                        for (name, s) in stats["spans"].items()},
+            "counters": counters
+        }
+
+    def close(self):
+        """
+        Stop the service, requests still queued fail
+        :return:
+        """
+        self._running = False
+        self._queue.put(None)
+        self._thread.join()
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.future.set_exception(RuntimeError("Service stopped"))
+        self._executor.shutdown()
+
+    def _run(self):
+        """
+        Batching thread loop: waits for a free worker, then collects a batch and hands it over
+        :return:
+        """
+        while self._running:
+            self._free_workers.acquire()
+            requests = [self._queue.get()]
+            deadline = time.perf_counter() + self._batch_window
+            while requests[-1] is not None and len(requests) < self._max_batch:
+                try:
+                    requests.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+
+            # None stops the loop, once the requests before it are handed over
+            if requests[-1] is None:
+                requests.pop()
+                self._running = False
+            if requests:
+                self._dispatch(requests)
+            else:
+                self._free_workers.release()
+
+    def _dispatch(self, requests):
+        """
+        Hand a batch to the worker pool
+        :param requests: List of _PendingRequests
+        :return:
+        """
+        start = time.perf_counter()
+        for r in requests:
+            self._metrics.record("service/queue", r.submitted, start - r.submitted)
+        self._metrics.count("service/batches")
+        self._metrics.count("service/batched_requests", len(requests))
+        with self._lock:
+            self._in_flight += 1
+
+        try:
+            future = self._submit([(r.kind, r.data, r.options) for r in requests])
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(lambda f: self._finish(requests, start, f))
+
+    def _submit(self, batch_requests):
+        """
+        Submit a batch to the worker pool, restarting the pool when it broke
+        :param batch_requests: List of (kind, data, options)
+        :return: Future of the batch results
+        """
+        if self._healthy:
+            try:
+                return self._executor.submit(_handle_batch, batch_requests)
+            except BrokenProcessPool:
+                # A worker process died (ie: killed when out of memory), failing the batches it had. The pool can not
+                # be used anymore, so it is replaced by a new one
+                pass
+
+        self._healthy = False
+        self._metrics.count("service/pool_restarts")
+        self._executor.shutdown(wait=False)
+        self._executor = self._start_workers()
+        self._healthy = True
+        return self._executor.submit(_handle_batch, batch_requests)
+
+    def _finish(self, requests, start, future):
+        """
+        Complete the requests of a handled batch
+        :param requests: List of _PendingRequests
+        :param start: Time the batch was handed over
+        :param future: Future of the batch results
+        :return:
+        """
+        with self._lock:
+            self._in_flight -= 1
+        self._free_workers.release()
+
+        end = time.perf_counter()
+        self._metrics.record("service/batch", start, end - start)
+        try:
+            results = future.result()
+        except Exception as e:
+            # Not the request's fault, the handler answers 503
+            self._metrics.count("service/errors", len(requests))
+            for r in requests:
+                r.future.set_exception(RuntimeError(f"Worker failed: {e or type(e).__name__}"))
+            return
+
+        for (r, result) in zip(requests, results):
+            result["timings"]["queue"] = start - r.submitted
+            result["timings"]["total"] = end - r.submitted
+            result["batch_size"] = len(requests)
+            self._metrics.record(f"service/{r.kind}", r.submitted, end - r.submitted)
+            if "error" in result:
+                self._metrics.count("service/errors")
+            r.future.set_result(result)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the service:
+     * POST /detect: detect faces in the posted image file
+     * POST /process: process the posted image file (brightness, contrast, filter, rotation, format, detect query
+       parameters), the processed image is returned base64 encoded
+     * GET /metrics: service metrics
+     * GET /health: liveness check, 503 once the worker processes could not be restarted
+    """
+
+    server_version = "DejavuService/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.server.service.metrics())
+        elif path == "/health":
+            if self.server.service.healthy():
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(503, {"status": "unavailable"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        kind = url.path.strip("/")
+        if kind not in (DETECT_REQUEST, PROCESS_REQUEST):
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+            return
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._send_json(411, {"error": "Content-Length required"})
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        # The body can not be skipped without a valid length, so the connection is closed
+        if length < 0:
+            self._send_json(400, {"error": "Invalid Content-Length"})
+            self.close_connection = True
+            return
+        if length > MAX_BODY_SIZE:
+            self._send_json(413, {"error": f"Images are limited to {MAX_BODY_SIZE} bytes"})
+            self.close_connection = True
+            return
+        data = self.rfile.read(length)
+
+        try:
+            options = parse_options(kind, {k: v[-1] for (k, v) in parse_qs(url.query).items()})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            result = self.server.service.submit(kind, data, options).result(REQUEST_TIMEOUT)
+        except queue.Full:
+            self._send_json(503, {"error": "Service busy"})
+        except ResultTimeout:
+            self._send_json(504, {"error": "Timed out"})
+        except RuntimeError as e:
+            self._send_json(503, {"error": str(e)})
+        else:
+            self._send_json(400 if "error" in result else 200, result)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(ServiceRequestHandler, self).log_message(format, *args)
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    """HTTP server of a DetectionService on a TCP address"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super(ServiceHTTPServer, self).__init__(address, ServiceRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+class UnixServiceHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """HTTP server of a DetectionService on a Unix socket"""
+
+    daemon_threads = True
+
+    def __init__(self, path, service, verbose=False):
+        if os.path.exists(path):
+            os.remove(path)
+        super(UnixServiceHTTPServer, self).__init__(path, ServiceRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    """HTTPConnection over a Unix socket"""
+
+    def __init__(self, path, timeout):
+        super(_UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class ServiceClient:
+    """Client of the service, for other local processes"""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, timeout=REQUEST_TIMEOUT):
+        """
+        Constructor
+        :param host: Service host
+        :param port: Service port
+        :param unix_socket: Unix socket path, replaces the host and port
+        :param timeout: Request timeout (seconds)
+        """
+        self._address = (host, port)
+        self._unix_socket = unix_socket
+        self._timeout = timeout
+
+    def request(self, method, path, body=None, params=None):
+        """
+        Send a request
+        :param method: HTTP method
+        :param path: Request path
+        :param body: Request body (bytes)
+        :param params: Query parameters
+        :return: A 2-tuple of (HTTP status, JSON response)
+        """
+        if self._unix_socket:
+            connection = _UnixHTTPConnection(self._unix_socket, self._timeout)
+        else:
+            connection = HTTPConnection(*self._address, timeout=self._timeout)
+        try:
+            connection.request(method, f"{path}?{urlencode(params)}" if params else path, body)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def detect(self, image, eyes=True, max_face_size=None):
+        """
+        Detect faces
+        :param image: Encoded image (file contents), or an image array
+        :param eyes: Also detect eyes
+        :param max_face_size: Largest expected face, for tiled detection of large images
+        :return: The result dictionary
+        """
+        params = {"eyes": int(eyes)}
+        if max_face_size is not None:
+            params["max_face_size"] = max_face_size
+        return self._post(DETECT_REQUEST, image, params)
+
+    def process(self, image, settings=None, detect=False, image_format="png"):
+        """
+        Process an image
+        :param image: Encoded image (file contents), or an image array
+        :param settings: Mapping of processing settings (brightness, contrast, filter, rotation)
+        :param detect: Also detect faces
+        :param image_format: Encoding of the returned image ("jpg" or "png")
+        :return: The result dictionary, with the processed image decoded as "image"
+        """
+        params = dict(settings or {}, detect=int(detect), format=image_format)
+        result = self._post(PROCESS_REQUEST, image, params)
+        result["image"] = cv2.imdecode(np.frombuffer(base64.b64decode(result["image"]), np.uint8), cv2.IMREAD_COLOR)
+        return result
+
+    def metrics(self):
+        """
+        :return: The service metrics
+        """
+        return self.request("GET", "/metrics")[1]
+
+    def _post(self, kind, image, params):
+        if isinstance(image, np.ndarray):
+            image = cv2.imencode(".png", image)[1].tobytes()
+        (status, result) = self.request("POST", f"/{kind}", image, params)
+        if status != 200:
+            raise IOError(f"Service error {status}: {result.get('error')}")
+        return result
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, verbose=False):
+    """
+    Create the HTTP server of a service
+    :param service: DetectionService
+    :param host: Address to listen on
+    :param port: Port to listen on (0 for any free port)
+    :param unix_socket: Unix socket path to listen on instead
+    :param verbose: Log every request
+    :return: The server, run it with serve_forever
+    """
+    if unix_socket:
+        return UnixServiceHTTPServer(unix_socket, service, verbose)
+    return ServiceHTTPServer((host, port), service, verbose)
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments
+    :param argv: Argument list (without the program name)
+    :return: Parsed arguments, with the detection profile as args.detection_profile
+    """
+    parser = argparse.ArgumentParser(description="Local face detection and image processing service")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--unix", default=None, help="Listen on this Unix socket instead")
+    parser.add_argument("-j", "--workers", type=int, default=SERVICE_WORKERS, help="Number of worker processes")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="Largest batch handed to a worker")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW * 1000,
+                        help="Time a batch waits for more requests (ms)")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="Requests queued before rejecting")
+    parser.add_argument("--profile", default=detector.DEFAULT_PROFILE, help="Detection profile")
+    parser.add_argument("--profiles", default=detector.PROFILES_PATH, help="Detection profiles file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+    args.detection_profile = batch.detection_profile(parser, args)
+    return args
+
+
+def main(argv=None):
+    """
+    Service entry:
+     * Starts the warm worker pool
+     * Serves requests until interrupted
+    :return: Process exit code
+    """
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    service = DetectionService(args.workers, args.max_batch, args.batch_window / 1000, args.max_queue,
+                               args.detection_profile)
+    server = create_server(service, args.host, args.port, args.unix, args.verbose)
+    print(f"Serving on {args.unix or '%s:%d' % server.server_address[:2]} with {args.workers} worker(s)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
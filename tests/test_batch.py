@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import sqlite3
+import pytest
+import batch
+
+
+def test_collect_images():
+    image_paths = batch.collect_images(["images"])
+    assert len(image_paths) == 8
+    assert image_paths == sorted(image_paths)
+    assert batch.collect_images(["images/tfr_*.jpg"]) == [p for p in image_paths if "tfr_" in p]
+
+
+@pytest.mark.parametrize("tile_size", [None, 64])
+def test_run_batch(tmp_path, tile_size):
+    image_paths = ["images/tfr_6_no_faces.jpg", "images/tfr_8_turned_around.jpg", "images/missing.jpg"]
+    settings = {"brightness": 10, "contrast": -5, "filter": 2, "rotation": 90}
+
+    results = list(batch.run_batch(image_paths, settings, str(tmp_path), detect=False, workers=2, chunksize=1,
+                                   tile_size=tile_size))
+    assert [r["input"] for r in results] == image_paths
+    assert "error" in results[2]
+
+    for result in results[:2]:
+        assert os.path.isfile(result["output"])
+        (name, _) = os.path.splitext(os.path.basename(result["input"]))
+        with open(os.path.join(str(tmp_path), name + ".json")) as f:
+            assert json.load(f)["settings"] == settings
+
+
+def test_run_batch_same_names(tmp_path):
+    inputs = tmp_path / "inputs"
+    for name in ("first", "second"):
+        os.makedirs(str(inputs / name))
+        shutil.copy("images/tfr_6_no_faces.jpg", str(inputs / name / "a.jpg"))
+    image_paths = batch.collect_images([str(inputs / "first"), str(inputs / "second")])
+    settings = {"brightness": 0, "contrast": 0, "filter": 0, "rotation": 0}
+
+    assert batch.output_names(image_paths) == [os.path.join("first", "a.jpg"), os.path.join("second", "a.jpg")]
+    results = list(batch.run_batch(image_paths, settings, str(tmp_path / "out"), detect=False, workers=1))
+    for (result, name) in zip(results, ("first", "second")):
+        assert result["output"] == str(tmp_path / "out" / name / "a.jpg")
+        with open(str(tmp_path / "out" / name / "a.json")) as f:
+            assert json.load(f)["input"] == result["input"]
+
+
+def test_run_batch_detect(tmp_path):
+    image_paths = ["images/test_facial_recognition.jpg", "images/tfr_6_no_faces.jpg"]
+    settings = {"brightness": 0, "contrast": 0, "filter": 0, "rotation": 0}
+
+    results = list(batch.run_batch(image_paths, settings, str(tmp_path), workers=1))
+    assert [r["faces"] for r in results] == [2, 0]
+    assert len(results[0]["face_boxes"]) == len(results[0]["eye_boxes"]) == 2
+
+
+def test_run_batch_tiled_detection(tmp_path):
+    args = batch.parse_args(["images/tfr_3_many_faces.jpg", "-o", str(tmp_path), "--no-eyes", "--max-face-size", "80"])
+    assert args.max_face_size == 80
+    for option in ("--max-face-size", "-j", "--chunksize", "--tile-size"):
+        with pytest.raises(SystemExit):
+            batch.parse_args(["images", "-o", str(tmp_path), option, "0"])
+
+    # Faces are at most 80 pixels, so the image is searched in several tiles
+    (result,) = batch.run_batch(["images/tfr_3_many_faces.jpg"], args.settings, str(tmp_path), detect_eyes=False,
+                                workers=1, max_face_size=args.max_face_size)
+    assert result["faces"] == 24
+
+
+def test_main_cache_summary(tmp_path, capsys):
+    argv = ["images/test_facial_recognition.jpg", "-o", str(tmp_path / "out"), "--no-eyes", "-j", "1",
+            "--cache", str(tmp_path / "detections.sqlite")]
+    assert batch.main(argv) == 0
+    assert "Detection cache: 0 hits, 1 misses" in capsys.readouterr().out
+    assert batch.main(argv) == 0
+    assert "Detection cache: 1 hits, 0 misses" in capsys.readouterr().out
+
+
+def test_run_batch_cache_recency(tmp_path):
+    image_paths = ["images/test_facial_recognition.jpg", "images/tfr_6_no_faces.jpg"]
+    settings = {"brightness": 0, "contrast": 0, "filter": 0, "rotation": 0}
+    cache_path = str(tmp_path / "detections.sqlite")
+
+    def used():
+        db = sqlite3.connect(cache_path)
+        try:
+            return dict(db.execute("SELECT key, used FROM detections").fetchall())
+        finally:
+            db.close()
+
+    list(batch.run_batch(image_paths, settings, str(tmp_path / "out"), detect_eyes=False, workers=1,
+                         cache_path=cache_path))
+    before = used()
+    assert len(before) == 2
+
+    # Far fewer hits than are written back at once, their uses are still written once the workers are done
+    results = list(batch.run_batch(image_paths, settings, str(tmp_path / "out"), detect_eyes=False, workers=1,
+                                   cache_path=cache_path))
+    assert all(r["cache_hit"] for r in results)
+    after = used()
+    assert all(after[key] > before[key] for key in before)
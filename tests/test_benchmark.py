@@ -0,0 +1,37 @@
+import json
+import benchmark
+from core import image_processor
+
+
+def test_processor_cases():
+    # Every concrete processor is benchmarked
+    classes = {type(p) for (_, p) in benchmark.processor_cases()}
+    subclasses = image_processor.ImageProcessor.__subclasses__() + image_processor.PointProcessor.__subclasses__()
+    concrete = {cls for cls in subclasses if cls is not image_processor.PointProcessor}
+    assert concrete <= classes
+
+
+def test_run_benchmarks(tmp_path):
+    images = benchmark.load_images(None, ["VGA"])
+    assert [name for (name, _) in images] == ["synthetic_VGA"]
+    assert images[0][1].shape == (480, 640, 3)
+
+    report = benchmark.run_benchmarks(images, ("processors", "chain"), warmup=0, repeat=2)
+    results = report["results"]
+    assert "chain/rotation+chain/synthetic_VGA" in results
+    assert all(r["runs"] == 2 and 0 < r["min"] <= r["median"] for r in results.values())
+
+    # Reports are plain JSON
+    path = tmp_path / "report.json"
+    path.write_text(json.dumps(report))
+    assert json.loads(path.read_text())["results"] == results
+
+
+def test_compare():
+    def report(**medians):
+        return {"results": {key: {"median": median} for (key, median) in medians.items()}}
+
+    baseline = report(a=1.0, b=1.0, c=1.0, d=1.0)
+    current = report(a=1.05, b=1.5, c=0.5, e=1.0)
+    statuses = {key: status for (key, _, _, _, status) in benchmark.compare(current, baseline, 0.1)}
+    assert statuses == {"a": "ok", "b": "regression", "c": "improvement", "d": "missing", "e": "new"}
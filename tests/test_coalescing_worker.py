@@ -0,0 +1,50 @@
+import threading
+from core import coalescing_worker
+
+
+def test_latest_wins():
+    started = threading.Event()
+    release = threading.Event()
+    processed = []
+
+    def handler(kind, request):
+        started.set()
+        release.wait(5)
+        processed.append((kind, request))
+        return request * 2
+
+    results = []
+    worker = coalescing_worker.CoalescingWorker(handler, on_result=lambda k, r, res: results.append(res))
+
+    # The first request blocks the worker, so all but the newest of the following requests are coalesced
+    worker.submit("preview", 0)
+    assert started.wait(5)
+    for i in range(1, 10):
+        worker.submit("preview", i)
+    worker.submit("full", 100)
+
+    release.set()
+    assert worker.wait_idle(5)
+    worker.stop(5)
+
+    assert processed == [("preview", 0), ("preview", 9), ("full", 100)]
+    assert results == [0, 18, 200]
+    assert (worker.submitted, worker.processed, worker.coalesced) == (11, 3, 8)
+
+
+def test_handler_error():
+    errors = []
+
+    def handler(kind, request):
+        raise ValueError(request)
+
+    worker = coalescing_worker.CoalescingWorker(handler, on_error=lambda k, r, e: errors.append(str(e)))
+    worker.submit("preview", "bad")
+    assert worker.wait_idle(5)
+
+    # The worker keeps running after a failed request
+    worker.submit("preview", "worse")
+    assert worker.wait_idle(5)
+    worker.stop(5)
+
+    assert errors == ["bad", "worse"]
@@ -0,0 +1,105 @@
+import sqlite3
+import cv2
+import numpy as np
+from core import detection_cache
+from core import detector
+
+
+def _result(n):
+    faces = np.arange(n * 4, dtype=np.int32).reshape(n, 4)
+    return detector.DetectionResult(faces, [np.array([[1, 2, 3, 4]], dtype=np.int32)] * n, np.linspace(1, 2, n))
+
+
+def test_get_put():
+    cache = detection_cache.DetectionCache(":memory:")
+    image = np.zeros((10, 10), np.uint8)
+    key = cache.key(image, {"a": 1})
+
+    assert cache.get(key) is None
+    cache.put(key, _result(2))
+    result = cache.get(key)
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert np.array_equal(result.faces, _result(2).faces)
+    assert np.array_equal(result.eyes[1], [[1, 2, 3, 4]])
+    assert np.allclose(result.scores, _result(2).scores)
+
+
+def test_key():
+    image = np.zeros((10, 10), np.uint8)
+    key = detection_cache.DetectionCache.key(image, {"a": 1, "b": 2})
+
+    # Parameter order does not matter, their values, the pixels and the image layout do
+    assert key == detection_cache.DetectionCache.key(image.copy(), {"b": 2, "a": 1})
+    assert key != detection_cache.DetectionCache.key(image, {"a": 1, "b": 3})
+    changed = image.copy()
+    changed[5, 5] = 1
+    assert key != detection_cache.DetectionCache.key(changed, {"a": 1, "b": 2})
+    assert key != detection_cache.DetectionCache.key(image.reshape(5, 20), {"a": 1, "b": 2})
+
+
+def test_eviction():
+    cache = detection_cache.DetectionCache(":memory:", max_entries=2)
+    keys = [cache.key(np.full((4, 4), i, np.uint8), {}) for i in range(3)]
+    cache.put(keys[0], _result(1))
+    cache.put(keys[1], _result(1))
+    cache.get(keys[0])      # keys[1] becomes the least recently used
+    cache.put(keys[2], _result(1))
+
+    assert len(cache) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "cache" / "detections.sqlite")
+    key = detection_cache.DetectionCache.key(np.zeros((4, 4), np.uint8), {})
+    cache = detection_cache.DetectionCache(path)
+    cache.put(key, _result(3))
+    cache.close()
+
+    cache = detection_cache.DetectionCache(path)
+    assert len(cache.get(key)) == 3
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_batched_uses(tmp_path):
+    path = str(tmp_path / "detections.sqlite")
+    cache = detection_cache.DetectionCache(path)
+    key = cache.key(np.zeros((4, 4), np.uint8), {})
+    cache.put(key, _result(1))
+
+    def used():
+        db = sqlite3.connect(path)
+        try:
+            return db.execute("SELECT used FROM detections WHERE key = ?", (key,)).fetchone()[0]
+        finally:
+            db.close()
+
+    # Hits are only written back once there are enough of them, or when the cache is closed
+    put_time = used()
+    for _ in range(detection_cache.USED_FLUSH_HITS - 1):
+        assert cache.get(key) is not None
+    assert used() == put_time
+    cache.close()
+    assert used() > put_time
+
+
+def test_detector_cache():
+    image_g = cv2.cvtColor(cv2.imread("images/tfr_3_many_faces.jpg"), cv2.COLOR_BGR2GRAY)
+    cache = detection_cache.DetectionCache(":memory:")
+    expected = detector.Detector().detect(image_g)
+
+    cached_detector = detector.Detector(cache=cache)
+    for _ in range(2):
+        result = cached_detector.detect(image_g)
+        assert cached_detector.faces() == len(expected)
+        assert np.array_equal(result.faces, expected.faces)
+        assert all(np.array_equal(a, b) for (a, b) in zip(result.eyes, expected.eyes))
+        assert np.allclose(result.scores, expected.scores)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Detecting without eyes is a different detection
+    assert all(len(e) == 0 for e in cached_detector.detect(image_g, detect_eyes=False).eyes)
+    assert cache.misses == 2
@@ -1,6 +1,10 @@
+import threading
 import cv2
+import numpy as np
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from core import detector
+from utils import processing_utils
 
 
 @pytest.mark.parametrize("image_file_path, expected_outcome", [
@@ -19,5 +23,180 @@ def test_detect(image_file_path, expected_outcome):
 
     grayscale_img = cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY)
     facial_recog = detector.Detector()
-    _ = facial_recog.detect(grayscale_img, color_img)
+    result = facial_recog.detect(grayscale_img)
     assert facial_recog.faces() == expected_outcome
+    assert len(result) == expected_outcome
+    assert result.faces.shape == (expected_outcome, 4)
+    assert len(result.eyes) == len(result.scores) == expected_outcome
+
+
+def test_draw_detections():
+    color_img = cv2.imread("images/test_facial_recognition.jpg")
+    grayscale_img = cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY)
+    result = detector.Detector().detect(grayscale_img)
+
+    # Drawing the vectorized overlay matches drawing each rectangle separately
+    expected = color_img.copy()
+    for (boxes, color) in ((result.faces, detector.FACE_COLOR), (result.all_eyes(), detector.EYE_COLOR)):
+        for (x, y, w, h) in boxes:
+            cv2.rectangle(expected, (x, y), (x + w, y + h), color, 2)
+
+    assert (result.draw(color_img.copy()) == expected).all()
+
+    half = result.scaled(0.5)
+    assert (half.faces == np.rint(result.faces * 0.5)).all()
+    assert len(half.all_eyes()) == len(result.all_eyes())
+
+
+def test_cascade_registry():
+    registry = processing_utils.CascadeRegistry()
+    face_cascade = processing_utils.Cascades.CascadeList.FACE_CASCADE
+
+    # Cascades are only parsed on first use, and are reused within a thread
+    assert registry.get(face_cascade) is registry.get(face_cascade)
+
+    # Every thread gets its own classifier
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other = executor.submit(registry.get, face_cascade).result()
+    assert other is not registry.get(face_cascade)
+    assert not other.empty()
+
+
+def test_eye_detection_modes():
+    grayscale_img = cv2.imread("images/tfr_3_many_faces.jpg", cv2.IMREAD_GRAYSCALE)
+
+    # Eye detection across a thread pool gives the same eyes as sequential detection
+    parallel = detector.Detector(eye_workers=4).detect(grayscale_img)
+    sequential = detector.Detector(eye_workers=1).detect(grayscale_img)
+    assert all((p == s).all() for (p, s) in zip(parallel.eyes, sequential.eyes))
+
+    # Eyes are only searched inside the upper part of their face
+    for (face, eyes) in zip(parallel.faces, parallel.eyes):
+        assert (eyes[:, :2] >= face[:2]).all()
+        assert (eyes[:, 1] + eyes[:, 3] <= face[1] + face[3] * detector.EYE_REGION + 1).all()
+
+    faces_only = detector.Detector(detect_eyes=False).detect(grayscale_img)
+    assert (faces_only.faces == parallel.faces).all()
+    assert len(faces_only.all_eyes()) == 0
+
+
+def match_faces(expected, faces, min_iou=0.5):
+    """Number of expected faces overlapping a detected face by at least min_iou"""
+    x0 = np.maximum(expected[:, None, 0], faces[None, :, 0])
+    y0 = np.maximum(expected[:, None, 1], faces[None, :, 1])
+    x1 = np.minimum(expected[:, None, 0] + expected[:, None, 2], faces[None, :, 0] + faces[None, :, 2])
+    y1 = np.minimum(expected[:, None, 1] + expected[:, None, 3], faces[None, :, 1] + faces[None, :, 3])
+    intersection = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    areas = (expected[:, 2] * expected[:, 3])[:, None] + (faces[:, 2] * faces[:, 3])[None, :]
+    iou = intersection / (areas - intersection)
+    return int(np.count_nonzero(iou.max(axis=1) >= min_iou)) if len(faces) else 0
+
+
+def test_close():
+    grayscale_img = cv2.imread("images/tfr_3_many_faces.jpg", cv2.IMREAD_GRAYSCALE)
+
+    def pool_threads():
+        return [t for t in threading.enumerate() if t.name.startswith(("EyeDetection", "TileDetection"))]
+
+    before = len(pool_threads())
+    with detector.Detector(eye_workers=2, tile_workers=2) as d:
+        d.detect(grayscale_img, max_face_size=80)
+        assert len(pool_threads()) > before
+    assert len(pool_threads()) == before
+
+    # Closed detectors still detect, creating their pools again
+    assert len(d.detect(grayscale_img)) == 24
+    d.close()
+
+    # A single worker detects sequentially, without starting a pool
+    with detector.Detector(eye_workers=1, tile_workers=1) as d:
+        assert len(d.detect(grayscale_img, max_face_size=80)) == 24
+        assert len(pool_threads()) == before
+
+
+@pytest.mark.parametrize("image_file_path", [
+    "images/test_facial_recognition.jpg",
+    "images/tfr_3_many_faces.jpg",
+    "images/tfr_4_facial_expressions.jpg",
+    "images/tfr_6_no_faces.jpg",
+    "images/tfr_7_no_faces_2.jpg",
+    "images/tfr_8_turned_around.jpg"
+])
+def test_tiled_detection_parity(image_file_path, monkeypatch):
+    grayscale_img = cv2.cvtColor(cv2.imread(image_file_path), cv2.COLOR_BGR2GRAY)
+    d = detector.Detector(detect_eyes=False)
+    (faces, _) = d.detect_faces(grayscale_img)
+
+    # Tiles as small as the largest face allows, on a 2x2 composite of the image, so it spans several tiles
+    monkeypatch.setattr(detector, "TILE_MIN_SIZE", 0)
+    max_face_size = int(faces[:, 2].max()) if len(faces) else 64
+    tile_size = detector.TILE_FACE_RATIO * max_face_size
+    composite = np.tile(grayscale_img, (2, 2))
+
+    # Padded so a face is centered on the right and bottom edges of the first tile, straddling the tile seams
+    if len(faces):
+        (x, y, w, h) = min(faces.tolist(), key=lambda f: max(f[0] + f[2] // 2, f[1] + f[3] // 2))
+        (left, top) = (max(0, tile_size - (x + w // 2)), max(0, tile_size - (y + h // 2)))
+        composite = cv2.copyMakeBorder(composite, top, 0, left, 0, cv2.BORDER_REPLICATE)
+        assert x + left < tile_size < x + left + w and y + top < tile_size < y + top + h
+    assert min(composite.shape) > tile_size
+
+    (expected, _) = d.detect_faces(composite)
+    result = d.detect(composite, max_face_size=max_face_size)
+
+    assert len(result) == len(expected)
+    assert match_faces(expected, result.faces) == len(expected)
+
+
+def test_tiled_detection_mosaic():
+    # A 2x2 mosaic of a group photo, four times the faces across several default sized tiles
+    grayscale_img = cv2.cvtColor(cv2.imread("images/tfr_3_many_faces.jpg"), cv2.COLOR_BGR2GRAY)
+    mosaic = np.tile(grayscale_img, (2, 2))
+    (h, w) = grayscale_img.shape
+
+    d = detector.Detector(detect_eyes=False)
+    (faces, _) = d.detect_faces(grayscale_img)
+    expected = np.concatenate([faces + np.array([x, y, 0, 0]) for y in (0, h) for x in (0, w)])
+
+    result = d.detect(mosaic, max_face_size=int(faces[:, 2].max()))
+    assert len(result) == len(expected) == 4 * len(faces)
+    assert match_faces(expected, result.faces) == len(expected)
+
+
+def test_non_max_suppression():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [20, 20, 10, 10], [2, 2, 4, 4], [22, 22, 10, 10]])
+    scores = np.array([1.0, 2.0, 3.0, 0.5, 1.0])
+    # Duplicates of a kept (higher scoring) box are dropped, including boxes inside it
+    assert detector.non_max_suppression(boxes, scores).tolist() == [2, 1]
+    assert detector.non_max_suppression(boxes[:0], scores[:0]).tolist() == []
+
+
+def test_profiles(tmp_path):
+    path = str(tmp_path / "profiles.json")
+
+    # The built in default profile is used without a profiles file
+    assert detector.load_profile(path=path) == detector.DetectionProfile()
+    with pytest.raises(KeyError):
+        detector.load_profile("fast", path)
+
+    # Profiles are merged into the file, measurements written along are ignored when loading
+    detector.save_profiles({"fast": dict(detector.DetectionProfile(downscale=0.5).to_dict(), time=1.0)}, path)
+    detector.save_profiles({"accurate": detector.DetectionProfile(face_scale_factor=1.1).to_dict()}, path)
+    profiles = detector.load_profiles(path)
+    assert profiles["fast"] == detector.DetectionProfile(downscale=0.5)
+    assert profiles["accurate"].face_scale_factor == 1.1
+
+    with pytest.raises(ValueError):
+        detector.DetectionProfile(downscale=2)
+
+
+def test_downscaled_detection():
+    image_g = cv2.cvtColor(cv2.imread("images/tfr_3_many_faces.jpg"), cv2.COLOR_BGR2GRAY)
+    full = detector.Detector(detect_eyes=False).detect(image_g)
+    scaled = detector.Detector(detect_eyes=False, profile=detector.DetectionProfile(downscale=0.75)).detect(image_g)
+
+    # Boxes are in image coordinates, sized like the faces found on the whole image
+    assert len(scaled) == len(full)
+    assert abs(np.median(scaled.faces[:, 2]) - np.median(full.faces[:, 2])) <= 0.2 * np.median(full.faces[:, 2])
+    assert scaled.faces[:, 0].max() + scaled.faces[:, 2].max() <= image_g.shape[1] + 2
+
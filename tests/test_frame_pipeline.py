@@ -0,0 +1,66 @@
+import time
+from core import frame_pipeline
+
+
+def test_drop_queue():
+    queue = frame_pipeline.DropQueue(2)
+    for i in range(5):
+        queue.put(i)
+
+    # Only the freshest items are kept
+    assert queue.dropped == 3
+    assert [queue.get(0), queue.get(0), queue.get(0)] == [3, 4, None]
+
+    queue.close()
+    assert queue.get() is None
+
+
+def test_pipeline_processes_every_frame():
+    source = frame_pipeline.SyntheticFrameSource(size=(64, 48), count=20, fps=200)
+    results = []
+    pipeline = frame_pipeline.FramePipeline(source, lambda frame: frame.shape, queue_size=20)
+    pipeline.start()
+
+    while pipeline.running() or len(results) < pipeline.frames_processed:
+        result = pipeline.get(0.1)
+        if result is not None:
+            results.append(result)
+    pipeline.stop(5)
+
+    assert pipeline.frames_captured == pipeline.frames_processed == 20
+    assert results == [(48, 64, 3)] * 20
+
+
+def test_pipeline_drops_stale_frames():
+    def slow_process(frame):
+        time.sleep(0.02)
+        return frame
+
+    source = frame_pipeline.SyntheticFrameSource(size=(64, 48), count=100)
+    pipeline = frame_pipeline.FramePipeline(source, slow_process)
+    pipeline.start()
+    while pipeline.running():
+        time.sleep(0.01)
+    pipeline.stop(5)
+
+    # Capture never waits for processing, frames which could not be processed in time are dropped
+    assert pipeline.frames_captured == 100
+    assert pipeline.frames_processed < 100
+    assert pipeline.frames_dropped() > 0
+
+
+def test_pipeline_keeps_source_open():
+    source = frame_pipeline.SyntheticFrameSource(size=(64, 48))
+
+    # The same source can be restarted when the pipeline leaves releasing it to its owner
+    for _ in range(2):
+        pipeline = frame_pipeline.FramePipeline(source, lambda frame: frame.shape, release_source=False)
+        pipeline.start()
+        assert pipeline.get(5) == (48, 64, 3)
+        pipeline.stop(5)
+        assert source.isOpened()
+
+    pipeline = frame_pipeline.FramePipeline(source, lambda frame: frame.shape)
+    pipeline.start()
+    pipeline.stop(5)
+    assert not source.isOpened()
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+from utils import image_statistics
+from utils import processing_utils
+
+
+def test_statistics():
+    color_img = processing_utils.resize_to_fit(cv2.imread("images/tfr_3_many_faces.jpg"))
+    statistics = image_statistics.ImageStatistics(color_img)
+
+    (means, stds) = cv2.meanStdDev(color_img)
+    assert statistics.histograms.shape == (3, image_statistics.HISTOGRAM_BINS)
+    assert np.all(statistics.histograms.sum(axis=1) == statistics.pixels)
+    assert np.allclose(statistics.means, means.ravel())
+    assert np.allclose(statistics.stds, stds.ravel())
+    assert statistics.names == ("Blue", "Green", "Red")
+    assert len(statistics.summary().splitlines()) == 3
+    assert statistics.draw().shape == image_statistics.HISTOGRAM_SIZE[::-1] + (3,)
+
+
+def test_clipping():
+    image = np.full((10, 10), 128, np.uint8)
+    image[:2] = 0
+    image[2:7] = 255
+    statistics = image_statistics.ImageStatistics(image)
+
+    assert statistics.names == ("Gray",)
+    assert np.allclose(statistics.clipped_low, [20])
+    assert np.allclose(statistics.clipped_high, [50])
+
+
+def test_statistics_cache():
+    cache = image_statistics.StatisticsCache(max_entries=2)
+    source = np.zeros((4, 4, 3), np.uint8)
+    processed = source + 10
+
+    original = cache.get(source)
+    assert cache.get(source) is original
+    # Processed images are cached by their source and values, whatever array they are rendered into
+    result = cache.get(processed, source, {"Brightness": 10})
+    assert cache.get(processed.copy(), source, {"Brightness": 10}) is result
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # An equal copy of the source is another input
+    assert cache.get(source.copy()) is not original
+    assert len(cache) == 2
+    cache.get(source)
+    assert cache.misses == 4
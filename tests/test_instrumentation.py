@@ -0,0 +1,69 @@
+import json
+import cv2
+from core import detector
+from core import image_processor
+from utils import instrumentation
+from utils import processing_utils
+
+
+def test_latency_histogram():
+    histogram = instrumentation.LatencyHistogram()
+    for ms in (1, 1, 2, 4, 100):
+        histogram.record(ms / 1000)
+
+    assert histogram.count == 5
+    assert abs(histogram.mean() - 0.0216) < 1e-9
+    assert (histogram.min, histogram.max) == (0.001, 0.1)
+    # Percentiles are bucket upper bounds, at most a factor of 2 off
+    assert 0.002 <= histogram.percentile(50) <= 0.004
+    assert histogram.percentile(100) == 0.1
+
+
+def test_spans(tmp_path):
+    recorder = instrumentation.Instrumentation()
+
+    # Disabled spans record nothing
+    with recorder.span("test/disabled"):
+        pass
+    recorder.count("test/counter")
+    assert recorder.stats() == {"spans": {}, "counters": {}}
+
+    recorder.enable()
+    for _ in range(3):
+        with recorder.span("test/enabled"):
+            pass
+    recorder.count("test/counter", 2)
+
+    stats = recorder.stats()
+    assert stats["spans"]["test/enabled"]["count"] == 3
+    assert stats["counters"] == {"test/counter": 2}
+    assert "test/enabled" in recorder.summary()
+
+    recorder.dump_json(str(tmp_path / "stats.json"))
+    recorder.dump_chrome_trace(str(tmp_path / "trace.json"))
+    with open(str(tmp_path / "stats.json")) as f:
+        assert json.load(f) == json.loads(json.dumps(stats))
+    with open(str(tmp_path / "trace.json")) as f:
+        events = json.load(f)["traceEvents"]
+    assert [(e["name"], e["cat"], e["ph"]) for e in events] == [("test/enabled", "test", "X")] * 3
+
+    recorder.reset()
+    assert recorder.histogram("test/enabled") is None
+
+
+def test_instrumented_hooks():
+    image = cv2.imread("images/test_facial_recognition.jpg")
+    recorder = instrumentation.INSTRUMENTATION
+    recorder.enable()
+    try:
+        behavior = processing_utils.ProcessingBehavior((-50, 50), "test", 0)
+        image_processor.process_chain(
+            [image_processor.ContrastProcessor(behavior), image_processor.FilterProcessor(behavior)], image, image)
+        detector.Detector().detect(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+
+        spans = recorder.stats()["spans"]
+        for name in ("processor/PointOperations", "processor/FilterProcessor", "detector/faces", "detector/eyes"):
+            assert spans[name]["count"] >= 1
+    finally:
+        recorder.disable()
+        recorder.reset()
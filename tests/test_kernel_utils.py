@@ -0,0 +1,89 @@
+import threading
+import cv2
+import numpy as np
+import pytest
+from utils import kernel_utils
+from utils import processing_utils
+
+
+def max_difference(image_a, image_b):
+    return np.abs(image_a.astype(np.int32) - image_b.astype(np.int32)).max()
+
+
+@pytest.mark.parametrize("kernel_index, separable", [
+    (0, True),      # Identity
+    (1, False),     # Sharpening (rank 2, cheaper to apply densely)
+    (2, True),      # Box blur
+    (3, True),      # Binomial blur
+    (4, False),     # Gaussian (already a column kernel)
+    (5, True),      # Edge detection (rank 1)
+    (6, False),
+    (7, False)
+])
+def test_builtin_kernels(kernel_index, separable):
+    color_img = cv2.imread("images/tfr_3_many_faces.jpg")
+    (_, kernel) = processing_utils.Kernels().kernels_list[kernel_index]
+
+    assert (kernel_utils.factor_kernel(kernel) is not None) == separable
+    assert max_difference(kernel_utils.apply_kernel(color_img, kernel), cv2.filter2D(color_img, -1, kernel)) <= 1
+
+
+def test_factorization():
+    gaussian = cv2.getGaussianKernel(31, 0)
+    kernel = gaussian @ gaussian.T
+    terms = kernel_utils.factor_kernel(kernel)
+    assert len(terms) == 1
+    assert np.allclose(np.outer(*terms[0]), kernel)
+
+    # Factorizations are cached per kernel
+    assert kernel_utils.factor_kernel(kernel.copy()) is terms
+
+
+def test_low_rank_kernel():
+    color_img = cv2.imread("images/test_facial_recognition.jpg")
+    (a, b) = (cv2.getGaussianKernel(21, 2), cv2.getGaussianKernel(21, 6))
+    kernel = a @ a.T - 0.5 * (b @ b.T)
+
+    assert len(kernel_utils.factor_kernel(kernel)) == 2
+    assert max_difference(kernel_utils.apply_kernel(color_img, kernel), cv2.filter2D(color_img, -1, kernel)) <= 1
+
+
+@pytest.mark.parametrize("size", [5, 21, 64, 101])
+def test_fft_filter(size):
+    color_img = cv2.imread("images/tfr_3_many_faces.jpg")
+    kernel = np.random.RandomState(size).rand(size, size + 1) - 0.3
+    kernel /= kernel.sum()
+
+    assert max_difference(kernel_utils.fft_filter(color_img, kernel), cv2.filter2D(color_img, -1, kernel)) <= 1
+    assert max_difference(kernel_utils.apply_kernel(color_img, kernel), cv2.filter2D(color_img, -1, kernel)) <= 1
+
+
+def test_parse_kernel():
+    kernel = kernel_utils.parse_kernel("1, 2, 3\n4 5 6\n\n7 8 9.5\n")
+    assert kernel.shape == (3, 3)
+    assert kernel[2, 2] == 9.5
+
+    with pytest.raises(ValueError):
+        kernel_utils.parse_kernel("1 2\n3")
+    with pytest.raises(ValueError):
+        kernel_utils.parse_kernel("\n".join(["1"] * (kernel_utils.MAX_KERNEL_SIZE + 1)))
+    for value in ("nan", "inf", "-inf"):
+        with pytest.raises(ValueError):
+            kernel_utils.parse_kernel(f"1 2\n3 {value}")
+
+
+def test_calibrate_in_background(monkeypatch):
+    threads = []
+
+    def calibrate():
+        threads.append(threading.current_thread())
+        return 25
+
+    monkeypatch.setattr(kernel_utils, "_fft_crossover", None)
+    monkeypatch.setattr(kernel_utils, "calibrate_crossover", calibrate)
+    thread = kernel_utils.calibrate_in_background()
+    thread.join(5)
+
+    # Measured once, on the background thread
+    assert kernel_utils.fft_crossover() == 25
+    assert threads == [thread]
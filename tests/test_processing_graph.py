@@ -0,0 +1,77 @@
+import cv2
+import pytest
+from core import image_processor
+from core import processing_graph
+from utils import processing_utils
+
+
+class CountingProcessor(image_processor.ContrastProcessor):
+    """Contrast processor which counts how often it processed an image"""
+    def __init__(self, behavior):
+        super(CountingProcessor, self).__init__(behavior)
+        self.calls = 0
+
+    def process_image(self, image_u, image_p):
+        self.calls += 1
+        return super(CountingProcessor, self).process_image(image_u, image_p)
+
+
+@pytest.fixture
+def graph():
+    graph = processing_graph.ProcessingGraph()
+    behavior = processing_utils.ProcessingBehavior((-50, 50), "test", 0)
+    upstream = processing_graph.ProcessingGraph.SOURCE
+    for name in ("a", "b", "c"):
+        graph.add_stage(name, CountingProcessor(behavior), upstream=upstream)
+        upstream = name
+
+    graph.set_source(cv2.imread("images/tfr_3_many_faces.jpg"))
+    return graph
+
+
+def calls(graph):
+    return [graph.processor(name).calls for name in ("a", "b", "c")]
+
+
+def test_incremental_render(graph):
+    first = graph.render("c")
+    assert calls(graph) == [1, 1, 1]
+
+    # Only the changed stage and the stages downstream of it are recomputed
+    graph.set_value("b", 20)
+    changed = graph.render("c")
+    assert calls(graph) == [1, 2, 2]
+
+    # Going back to previous parameters is served from the cache
+    graph.set_value("b", 0)
+    assert graph.render("c") is first
+    graph.set_value("b", 20)
+    assert graph.render("c") is changed
+    assert calls(graph) == [1, 2, 2]
+
+    # A new source invalidates everything
+    graph.set_source(cv2.imread("images/tfr_6_no_faces.jpg"))
+    graph.render("c")
+    assert calls(graph) == [2, 3, 3]
+
+
+def test_memory_budget(graph):
+    image = graph.render("c")
+    graph.cache().set_memory_budget(2 * image.nbytes)
+    assert len(graph.cache()) == 2
+    assert graph.cache().nbytes() <= 2 * image.nbytes
+
+    # The least recently used stage ("a") was evicted
+    graph.render("c")
+    graph.render("b")
+    assert calls(graph) == [1, 1, 1]
+    graph.render("a")
+    assert calls(graph) == [2, 1, 1]
+
+
+def test_invalid_stages(graph):
+    behavior = processing_utils.ProcessingBehavior((-50, 50), "test", 0)
+    with pytest.raises(ValueError):
+        graph.add_stage("a", CountingProcessor(behavior))
+    with pytest.raises(ValueError):
+        graph.add_stage("d", CountingProcessor(behavior), upstream="missing")
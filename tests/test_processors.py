@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 import pytest
 from core import image_processor
 from utils import processing_utils
@@ -38,3 +39,65 @@ def test_detect(image_file_path):
         image_out = processor.process_image(image_in, image_out)
 
         assert image_in.shape == image_out.shape
+
+
+@pytest.mark.parametrize("value", [-50, -17, 0, 9, 50])
+def test_point_operations(value):
+    color_img = cv2.imread("images/tfr_3_many_faces.jpg")
+    zeros = np.zeros(color_img.shape, dtype=color_img.dtype)
+    test_behavior = processing_utils.ProcessingBehavior((-50, 50), "test", 0)
+
+    brightness = image_processor.BrightnessProcessor(test_behavior)
+    contrast = image_processor.ContrastProcessor(test_behavior)
+    brightness.set_unique_value(value)
+    contrast.set_unique_value(-value // 2)
+
+    # The lookup tables match the weighted sums they replace
+    brightened = cv2.addWeighted(color_img, 1.0, zeros, 0, value / 1.4)
+    assert (brightness.process_image(color_img, None) == brightened).all()
+    contrasted = cv2.addWeighted(brightened, 1.0 + (-value // 2) / 127, zeros, 0, 1.0)
+    assert (contrast.process_image(color_img, brightened) == contrasted).all()
+
+    # A fused chain matches applying every processor separately
+    kernel_filter = image_processor.FilterProcessor(test_behavior)
+    kernel_filter.set_unique_value(1)
+    processors_list = [contrast, brightness, contrast, kernel_filter, contrast]
+
+    expected = color_img
+    for processor in processors_list:
+        expected = processor.process_image(color_img, expected)
+
+    assert (image_processor.process_chain(processors_list, color_img, color_img) == expected).all()
+
+
+def test_resize_to_fit():
+    color_img = cv2.imread("images/tfr_7_no_faces_2.jpg")
+    proxy = processing_utils.resize_to_fit(color_img, (500, 500))
+    assert proxy.shape == (250, 500, 3)
+
+    # Images which already fit are not resized
+    assert processing_utils.resize_to_fit(proxy, (500, 500)) is proxy
+
+
+def test_rotation():
+    image = cv2.imread("images/tfr_3_many_faces.jpg")
+    rotation = image_processor.RotationProcessor(processing_utils.ProcessingBehavior((-180, 180), "Rotation", 0))
+
+    # No rotation keeps the original
+    assert rotation.process_image(image, image) is image
+
+    rotation.set_unique_value(30)
+    (h, w) = image.shape[:2]
+    (matrix, size) = image_processor.rotation_matrix(30, w, h)
+    assert image_processor.rotation_matrix(30, w, h)[0] is matrix
+    assert not matrix.flags.writeable
+
+    preview = rotation.process_image(image, image)
+    assert preview.shape[1::-1] == size
+    assert np.array_equal(preview, cv2.warpAffine(image, matrix, size))
+
+    # The final interpolation only changes the resampling, not the geometry
+    rotation.set_interpolation(image_processor.FINAL_INTERPOLATION)
+    final = rotation.process_image(image, image)
+    assert final.shape == preview.shape
+    assert np.array_equal(final, cv2.warpAffine(image, matrix, size, flags=cv2.INTER_CUBIC))
@@ -0,0 +1,140 @@
+import os
+import signal
+import threading
+from http.client import HTTPConnection
+import numpy as np
+import pytest
+import batch
+import server
+from core import image_processor
+
+
+@pytest.fixture(scope="module")
+def service():
+    service = server.DetectionService(workers=1, batch_window=0.05)
+    yield service
+    service.close()
+
+
+def _serve(service, **kwargs):
+    http_server = server.create_server(service, port=0, **kwargs)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
+
+
+@pytest.fixture(scope="module")
+def client(service):
+    http_server = _serve(service)
+    yield server.ServiceClient(*http_server.server_address[:2])
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def _image_file(path="images/tfr_3_many_faces.jpg"):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_detect(client):
+    result = client.detect(_image_file())
+    assert result["faces"] == 24
+    assert len(result["face_boxes"]) == len(result["eye_boxes"]) == len(result["scores"]) == 24
+    assert set(result["timings"]) >= {"decode", "detect", "queue", "total"}
+
+    result = client.detect(_image_file(), eyes=False)
+    assert all(len(e) == 0 for e in result["eye_boxes"])
+
+
+def test_process(client):
+    result = client.process(_image_file(), {"brightness": 10, "rotation": 90}, detect=True)
+    assert result["image"].shape == (650, 436, 3)
+    assert result["faces"] == 24
+
+    # Arrays are sent as PNG, so the result matches processing locally exactly
+    image = np.random.default_rng(0).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+    settings = {"brightness": -20, "contrast": 15, "filter": 1, "rotation": 0}
+    (rotation, processors) = batch.build_processors(dict(settings, kernel=None))
+    expected = image_processor.process_chain(processors, rotation.run(image, image), image)
+    assert np.array_equal(client.process(image, settings)["image"], expected)
+
+
+def test_errors(client):
+    assert client.request("POST", "/detect", b"not an image")[0] == 400
+    assert client.request("POST", "/process", _image_file(), {"brightness": 99})[0] == 400
+    assert client.request("POST", "/process", _image_file(), {"format": "gif"})[0] == 400
+    assert client.request("POST", "/unknown", b"")[0] == 404
+    with pytest.raises(IOError):
+        client.detect(b"not an image")
+
+
+@pytest.mark.parametrize("length", ["abc", "-1"])
+def test_invalid_content_length(service, length):
+    http_server = _serve(service)
+    connection = HTTPConnection(*http_server.server_address[:2], timeout=10)
+    try:
+        connection.putrequest("POST", "/detect")
+        connection.putheader("Content-Length", length)
+        connection.endheaders(b"data")
+        assert connection.getresponse().status == 400
+    finally:
+        connection.close()
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def test_batching(client):
+    before = client.metrics()["counters"]
+    results = []
+    data = _image_file("images/test_facial_recognition.jpg")
+
+    def detect():
+        results.append(client.detect(data, eyes=False))
+
+    threads = [threading.Thread(target=detect) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Concurrent requests arriving within the batch window share batches
+    assert [r["faces"] for r in results] == [2] * 6
+    after = client.metrics()
+    assert after["counters"]["service/detect_requests"] - before.get("service/detect_requests", 0) == 6
+    assert after["counters"]["service/batches"] - before.get("service/batches", 0) < 6
+    assert max(r["batch_size"] for r in results) > 1
+    assert after["queue_depth"] == 0 and after["in_flight_batches"] == 0
+    assert after["latency"]["service/detect"]["count"] >= 6
+
+
+def test_unix_socket(service, tmp_path):
+    path = str(tmp_path / "service.sock")
+    http_server = server.create_server(service, unix_socket=path)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    try:
+        assert server.ServiceClient(unix_socket=path).detect(_image_file())["faces"] == 24
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def test_worker_killed():
+    service = server.DetectionService(workers=1, batch_window=0)
+    http_server = _serve(service)
+    client = server.ServiceClient(*http_server.server_address[:2], timeout=30)
+    try:
+        assert client.detect(_image_file())["faces"] == 24
+        (pid,) = client.metrics()["worker_pids"]
+        os.kill(pid, signal.SIGKILL)
+
+        # The dead worker's pool is replaced, rather than requests timing out
+        statuses = [client.request("POST", "/detect", _image_file())[0] for _ in range(2)]
+        assert statuses[-1] == 200 and set(statuses) <= {200, 503}
+        metrics = client.metrics()
+        assert metrics["worker_pids"] != [pid]
+        assert metrics["counters"]["service/pool_restarts"] == 1
+        assert metrics["in_flight_batches"] == 0
+        assert client.request("GET", "/health")[0] == 200
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+        service.close()
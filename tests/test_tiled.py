@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+from core import image_processor
+from core import tiled
+from utils import processing_utils
+
+
+def create_chain(filter_index):
+    behavior = processing_utils.ProcessingBehavior((-50, 50), "test", 0)
+    chain = [image_processor.BrightnessProcessor(behavior), image_processor.ContrastProcessor(behavior),
+             image_processor.FilterProcessor(behavior), image_processor.FilterProcessor(behavior)]
+    for (p, v) in zip(chain, (10, 20, 1, filter_index)):
+        p.set_unique_value(v)
+    return chain
+
+
+@pytest.mark.parametrize("filter_index", [2, 4, 6])
+def test_process_tiled(filter_index):
+    image = cv2.imread("images/tfr_3_many_faces.jpg")
+    chain = create_chain(filter_index)
+    assert tiled.chain_halo(chain) == 1 + chain[3].halo()
+
+    expected = image_processor.process_chain(chain, image, image)
+    # Small, non square tiles which do not divide the image evenly
+    result = tiled.process_tiled(chain, image, tile_size=(97, 61), workers=4)
+    assert np.abs(result.astype(int) - expected).max() <= 1
+
+
+def test_process_tiled_large_kernel():
+    image = cv2.imread("images/tfr_8_turned_around.jpg")
+    chain = create_chain(0)
+    rng = np.random.RandomState(0)
+    chain[3].set_unique_value(chain[3].add_kernel("Random", rng.rand(41, 41) / 841))
+    assert tiled.chain_halo(chain) == 21
+
+    expected = image_processor.process_chain(chain, image, image)
+    result = tiled.process_tiled(chain, image, tile_size=128)
+    assert np.abs(result.astype(int) - expected).max() <= 1
+
+
+def test_process_tiled_memmap(tmp_path):
+    source = tiled.import_image("images/tfr_6_no_faces.jpg", str(tmp_path / "source.npy"))
+    assert isinstance(source, np.memmap)
+    chain = create_chain(3)
+
+    output = tiled.create_memmap(str(tmp_path / "output.npy"), source.shape, source.dtype)
+    tiled.process_tiled(chain, source, output, tile_size=64)
+    del output
+
+    expected = image_processor.process_chain(chain, np.array(source), np.array(source))
+    assert np.abs(tiled.open_memmap(str(tmp_path / "output.npy")).astype(int) - expected).max() <= 1
+
+
+def test_rotation_not_tileable():
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    rotation = image_processor.RotationProcessor(processing_utils.ProcessingBehavior((0, 360), "Rotation", 0))
+    with pytest.raises(ValueError):
+        tiled.process_tiled([rotation], image)
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+from core import detector
+from core import tracker
+
+
+def shifted(image, dx, dy):
+    return cv2.warpAffine(image, np.float32([[1, 0, dx], [0, 1, dy]]), (image.shape[1], image.shape[0]),
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def test_track_between_detections():
+    grayscale_img = cv2.imread("images/test_facial_recognition.jpg", cv2.IMREAD_GRAYSCALE)
+    face_tracker = tracker.DetectionTracker(detector.Detector(), detect_interval=5)
+
+    first = face_tracker.update(grayscale_img)
+    assert len(first) == 2
+
+    # Faces are followed as the frame moves, full detection only runs every detect_interval frames
+    for i in range(1, 10):
+        result = face_tracker.update(shifted(grayscale_img, 3 * i, 2 * i))
+        assert len(result) == 2
+        if i < 5:
+            assert np.abs(result.faces[:, :2] - first.faces[:, :2] - (3 * i, 2 * i)).max() <= 2
+            assert (result.eyes[0][:, :2] - first.eyes[0][:, :2] == result.faces[0, :2] - first.faces[0, :2]).all()
+
+    assert face_tracker.frames == 10
+    assert face_tracker.full_detections == 2
+    assert face_tracker.detection_rate() == 0.2
+
+
+def test_tracking_loss():
+    grayscale_img = cv2.imread("images/test_facial_recognition.jpg", cv2.IMREAD_GRAYSCALE)
+    face_tracker = tracker.DetectionTracker(detector.Detector(), detect_interval=100)
+    face_tracker.update(grayscale_img)
+
+    # The faces disappear, tracking is lost and full detection runs again
+    result = face_tracker.update(np.zeros_like(grayscale_img))
+    assert len(result) == 0
+    assert face_tracker.full_detections == 2
@@ -0,0 +1,54 @@
+import json
+import pytest
+import tune_detector
+from core import detector
+
+
+def _result(time, error):
+    return {"time": time, "error": error}
+
+
+def test_profile_grid():
+    profiles = tune_detector.profile_grid({"face_scale_factor": [1.2, 1.3], "downscale": [1.0, 0.5]})
+    assert len(profiles) == 4 * len(tune_detector.DEFAULT_GRID["face_min_neighbors"])
+    assert detector.DetectionProfile(face_scale_factor=1.3, downscale=0.5) in profiles
+
+
+def test_pareto_frontier():
+    results = [_result(1.0, 3), _result(2.0, 1), _result(2.5, 2), _result(3.0, 0), _result(0.5, 3), _result(4.0, 0)]
+    frontier = tune_detector.pareto_frontier(results)
+    assert [(r["time"], r["error"]) for r in frontier] == [(0.5, 3), (2.0, 1), (3.0, 0)]
+
+    chosen = tune_detector.choose_profiles(frontier, {"accurate": 0, "balanced": 1, "fast": 5})
+    assert (chosen["accurate"]["time"], chosen["balanced"]["time"], chosen["fast"]["time"]) == (3.0, 2.0, 0.5)
+
+
+def test_run_sweep():
+    images = tune_detector.load_labels()
+    assert len(images) == len(tune_detector.DEFAULT_LABELS)
+
+    # The default profile detects every labelled face count
+    profiles = [detector.DetectionProfile(), detector.DetectionProfile(face_min_neighbors=1)]
+    (default, loose) = tune_detector.run_sweep(images[:2], profiles)
+    assert default["error"] == 0 and default["time"] > 0
+    assert loose["error"] >= default["error"]
+    assert default["face_scale_factor"] == detector.FACE_SCALE_FACTOR
+
+
+def test_labels_file(tmp_path):
+    (tmp_path / "labels.json").write_text(json.dumps({"missing.jpg": 1}))
+    with pytest.raises(IOError):
+        tune_detector.load_labels(str(tmp_path / "labels.json"))
+
+
+def test_main(tmp_path):
+    profiles_path = str(tmp_path / "profiles.json")
+    report_path = str(tmp_path / "report.json")
+    assert tune_detector.main(["--face-scale-factor", "1.3", "--face-min-neighbors", "5", "--downscale", "1.0", "0.5",
+                               "--profiles", profiles_path, "-o", report_path, "--write", "accurate", "fast"]) == 0
+
+    report = json.loads(open(report_path).read())
+    assert len(report["results"]) == 2
+    profiles = detector.load_profiles(profiles_path)
+    assert set(profiles) == {"accurate", "fast"}
+    assert profiles["accurate"].face_scale_factor == 1.3
@@ -1,7 +1,15 @@
+import os
+import shutil
+import cv2
 import pytest
+import numpy as np
 from coreUI import main_window as dejavu_window_main
+from coreUI import ui_loader
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtWidgets import QPushButton
+from PyQt5.QtWidgets import QLabel
+from PyQt5.QtWidgets import QWidget
+from utils import processing_utils
 
 
 @pytest.yield_fixture(scope='session')
@@ -52,3 +60,69 @@ def test_main_window(qtbot):
     main_window.importButton.clicked.connect(lambda: print("--> import button clicked"))
     qtbot.click(main_window.importButton)
     assert clicked[0]
+
+
+def test_display_surface(qapp):
+    label = QLabel()
+    image = np.zeros((1000, 800, 3), dtype=np.uint8)
+    image[..., 2] = 255     # Red (BGR)
+
+    processing_utils.display_img(image, label)
+    surface = label.display_surface
+    buffer = surface.buffer()
+    assert buffer.shape == (500, 400, 3)
+    assert label.pixmap().toImage().pixelColor(10, 10).getRgb()[:3] == (255, 0, 0)
+
+    # Same sized frames reuse the display buffer
+    image[..., 0] = 255     # Blue
+    image[..., 2] = 0
+    processing_utils.display_img(image, label)
+    assert surface.buffer() is buffer
+    assert label.pixmap().toImage().pixelColor(10, 10).getRgb()[:3] == (0, 0, 255)
+
+    # Other sizes and formats reallocate it
+    processing_utils.display_img(np.full((100, 100), 128, dtype=np.uint8), label)
+    assert surface.buffer().shape == (500, 500)
+    assert label.pixmap().toImage().pixelColor(10, 10).getRgb()[:3] == (128, 128, 128)
+
+
+def test_ui_loader(qapp, tmp_path):
+    ui_path = str(tmp_path / "slider_widget.ui")
+    shutil.copy(os.path.join(os.path.dirname(__file__), "..", "coreUI", "slider_widget.ui"), ui_path)
+    cache_dir = str(tmp_path / "compiled")
+
+    # Child widgets become attributes of the widget, like with loadUi
+    widget = ui_loader.load_ui(ui_path, QWidget(), cache_dir)
+    assert widget.behaviorSlider.parent() is not None
+    assert widget.behaviorLabel.text() != ""
+
+    # Up to date forms are not compiled again, changed forms are
+    module_path = ui_loader.compiled_path(ui_path, cache_dir)
+    mtime = os.path.getmtime(module_path)
+    assert ui_loader.compile_ui(ui_path, cache_dir) == module_path
+    assert os.path.getmtime(module_path) == mtime
+    with open(ui_path, "a") as f:
+        f.write("\n")
+    os.utime(module_path, (0, 0))
+    ui_loader.compile_ui(ui_path, cache_dir)
+    assert os.path.getmtime(module_path) != 0
+
+
+def test_read_preview(tmp_path):
+    path = str(tmp_path / "large.jpg")
+    image = np.zeros((1600, 2400, 3), np.uint8)
+    image[400:1200, 600:1800] = (40, 120, 200)
+    cv2.imwrite(path, image)
+
+    # Largest reduction which still covers the display bounds
+    (preview, factor) = processing_utils.read_preview(path, bounds=(500, 500))
+    assert factor == 4
+    assert preview.shape == (400, 600, 3)
+    assert np.abs(preview[200, 300].astype(int) - (40, 120, 200)).max() <= 4
+
+    # Small images are decoded fully
+    (preview, factor) = processing_utils.read_preview(path, bounds=(3000, 3000))
+    assert factor == 1
+    assert preview.shape == image.shape
+
+    assert processing_utils.read_preview(str(tmp_path / "missing.jpg")) == (None, 0)
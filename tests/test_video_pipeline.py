@@ -0,0 +1,89 @@
+import random
+import time
+import cv2
+import numpy as np
+import pytest
+import video
+from core import frame_pipeline
+from core import video_pipeline
+
+
+class ListSink:
+    """Frame sink collecting the written frames"""
+
+    def __init__(self, pipeline=None):
+        self.frames = []
+        self.pipeline = pipeline
+        self.max_in_flight = 0
+
+    def write(self, frame):
+        self.frames.append(frame)
+        if self.pipeline is not None:
+            in_flight = self.pipeline.frames_decoded - self.pipeline.frames_written
+            self.max_in_flight = max(self.max_in_flight, in_flight)
+
+
+def frame_index(frame):
+    return int(frame[0, 0, 0]) + 256 * int(frame[0, 0, 1])
+
+
+def indexed_frames(count):
+    frames = []
+    for i in range(count):
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        frame[0, 0, :2] = (i % 256, i // 256)
+        frames.append(frame)
+    return frames
+
+
+def test_frame_order():
+    count = 300
+    source = frame_pipeline.SyntheticFrameSource(indexed_frames(count), count=count)
+
+    def create_processor():
+        def process(frame):
+            # Workers finish out of order
+            time.sleep(random.random() * 0.002)
+            return frame
+        return process
+
+    sink = ListSink()
+    pipeline = video_pipeline.VideoPipeline(source, create_processor, sink, workers=4, queue_size=2)
+    sink.pipeline = pipeline
+
+    assert pipeline.run() == count
+    assert [frame_index(f) for f in sink.frames] == list(range(count))
+    # Frames in flight stay bounded however long the video is
+    assert sink.max_in_flight <= 2 * (2 + 4)
+    assert pipeline.fps() > 0
+
+
+def test_processing_error():
+    source = frame_pipeline.SyntheticFrameSource(indexed_frames(1))
+
+    def failing(frame):
+        raise ValueError("Processing failed")
+
+    pipeline = video_pipeline.VideoPipeline(source, lambda: failing, ListSink(), workers=3)
+    with pytest.raises(ValueError):
+        pipeline.run()
+
+
+def test_process_video(tmp_path):
+    image = cv2.resize(cv2.imread("images/test_facial_recognition.jpg"), (360, 364))
+    input_path = str(tmp_path / "input.avi")
+    writer = cv2.VideoWriter(input_path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (360, 364))
+    for i in range(20):
+        writer.write(np.roll(image, i, axis=1))
+    writer.release()
+
+    output_path = str(tmp_path / "output.avi")
+    settings = {"brightness": 0, "contrast": 10, "filter": 2, "rotation": 90}
+    (pipeline, faces) = video.process_video(input_path, output_path, settings, detect=True, workers=2,
+                                            fourcc="MJPG")
+    assert pipeline.frames_written == 20
+
+    capture = cv2.VideoCapture(output_path)
+    (ok, frame) = capture.read()
+    assert ok and frame.shape == (360, 364, 3)
+    assert capture.get(cv2.CAP_PROP_FRAME_COUNT) == 20
@@ -0,0 +1,221 @@
+# Python version 3.7
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import cv2
+from core import detector
+
+
+# Labelled images (expected number of faces) tuned on when no labels file is given
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "images")
+DEFAULT_LABELS = {
+    os.path.join(IMAGES_DIR, "test_facial_recognition.jpg"): 2,
+    os.path.join(IMAGES_DIR, "tfr_3_many_faces.jpg"): 24,
+    os.path.join(IMAGES_DIR, "tfr_4_facial_expressions.jpg"): 18,
+    os.path.join(IMAGES_DIR, "tfr_6_no_faces.jpg"): 0,
+    os.path.join(IMAGES_DIR, "tfr_7_no_faces_2.jpg"): 0,
+    os.path.join(IMAGES_DIR, "tfr_8_turned_around.jpg"): 0
+}
+
+# Values swept per parameter. The eye parameters only change the error with eye labels, so they are not swept by
+# default
+DEFAULT_GRID = {
+    "face_scale_factor": (1.1, 1.2, 1.3, 1.4),
+    "face_min_neighbors": (3, 5, 7),
+    "face_min_size": (0,),
+    "eye_scale_factor": (detector.EYE_SCALE_FACTOR,),
+    "eye_min_neighbors": (detector.EYE_MIN_NEIGHBORS,),
+    "downscale": (1.0, 0.75, 0.5)
+}
+
+# Profiles chosen from the Pareto frontier: the fastest setting whose error is at most this much (mean count error
+# per image) above the most accurate setting's error
+PROFILE_MARGINS = {"accurate": 0.0, "balanced": 0.25, "fast": 1.0}
+
+
+def load_labels(path=None):
+    """
+    Load labelled images
+    :param path: JSON file mapping image paths (relative to the file) to their expected number of faces, or to
+                 {"faces": n, "eyes": m} to also count eyes. None for the test images
+    :return: List of (image path, grayscale image, expected faces, expected eyes or None)
+    """
+    if path is None:
+        (labels, base) = (DEFAULT_LABELS, IMAGES_DIR)
+    else:
+        with open(path) as f:
+            labels = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+
+    images = []
+    for (image_path, label) in labels.items():
+        image_path = os.path.join(base, image_path)
+        image = cv2.imread(image_path)
+        if image is None:
+            raise IOError(f"Could not read {image_path}")
+        label = label if isinstance(label, dict) else {"faces": label}
+        images.append((image_path, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), label["faces"], label.get("eyes")))
+    return images
+
+
+def profile_grid(grid=None):
+    """
+    Every combination of the swept parameter values
+    :param grid: Mapping of profile parameters to their values, missing parameters use DEFAULT_GRID
+    :return: List of DetectionProfiles
+    """
+    grid = dict(DEFAULT_GRID, **(grid or {}))
+    names = list(grid)
+    return [detector.DetectionProfile(**dict(zip(names, values))) for values in itertools.product(*grid.values())]
+
+
+def evaluate(profile, images, repeat=1):
+    """
+    Measure a profile over the labelled images
+    :param profile: DetectionProfile
+    :param images: Labelled images (see load_labels)
+    :param repeat: Timed runs over the images, the fastest counts
+    :return: Dictionary of the profile parameters, "time" (seconds over all images) and "error" (mean absolute
+             count error per image, faces plus eyes where eyes are labelled)
+    """
+    # Eyes are detected sequentially, so timings do not depend on the thread pool
+    best = None
+    with detector.Detector(eye_workers=1, profile=profile) as d:
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            results = [d.detect(image_g) for (_, image_g, _, _) in images]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+    errors = []
+    for (result, (_, _, faces, eyes)) in zip(results, images):
+        error = abs(len(result) - faces)
+        if eyes is not None:
+            error += abs(sum(len(e) for e in result.eyes) - eyes)
+        errors.append(error)
+
+    return dict(profile.to_dict(), time=best, error=sum(errors) / len(errors), errors=errors)
+
+
+def run_sweep(images, profiles, repeat=1, progress=None):
+    """
+    Measure every profile
+    :param images: Labelled images (see load_labels)
+    :param profiles: List of DetectionProfiles
+    :param repeat: Timed runs per profile
+    :param progress: Optional callable (measurement) called after every profile
+    :return: List of measurements (see evaluate)
+    """
+    # Untimed run, so loading the cascades is not counted against the first profile
+    with detector.Detector(eye_workers=1) as d:
+        d.detect(images[0][1])
+
+    results = []
+    for profile in profiles:
+        results.append(evaluate(profile, images, repeat))
+        if progress is not None:
+            progress(results[-1])
+    return results
+
+
+def pareto_frontier(results):
+    """
+    Measurements no other measurement beats in both time and error
+    :param results: List of measurements with a "time" and an "error"
+    :return: The Pareto optimal measurements, fastest first
+    """
+    frontier = []
+    for r in sorted(results, key=lambda r: (r["time"], r["error"])):
+        # Sorted by time, so a measurement is optimal when it is more accurate than every faster one
+        if not frontier or r["error"] < frontier[-1]["error"]:
+            frontier.append(r)
+    return frontier
+
+
+def choose_profiles(frontier, margins=None):
+    """
+    Choose named profiles from the Pareto frontier
+    :param frontier: Pareto optimal measurements, fastest first
+    :param margins: Mapping of profile names to their error margin above the most accurate measurement
+                    (defaults to PROFILE_MARGINS)
+    :return: Mapping of profile names to their measurements
+    """
+    margins = PROFILE_MARGINS if margins is None else margins
+    best_error = min(r["error"] for r in frontier)
+    return {name: next(r for r in frontier if r["error"] <= best_error + margin)
+            for (name, margin) in margins.items()}
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments
+    :param argv: Argument list (without the program name)
+    :return: Parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Sweep the detection parameters over labelled images, and write "
+                                                 "the fast, balanced and accurate profiles of the Pareto frontier")
+    parser.add_argument("--labels", default=None,
+                        help="JSON file of labelled images (defaults to the labelled test images)")
+    for (name, values) in DEFAULT_GRID.items():
+        value_type = float if isinstance(values[0], float) else int
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=value_type, nargs="+",
+                            default=list(values), help=f"Swept values (default: {' '.join(map(str, values))})")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per setting")
+    parser.add_argument("-o", "--output", default=None, help="Write the JSON report of every setting to this file")
+    parser.add_argument("--profiles", default=detector.PROFILES_PATH, help="Profiles file the Detector loads")
+    parser.add_argument("--write", nargs="*", choices=list(PROFILE_MARGINS), default=list(PROFILE_MARGINS),
+                        help="Profiles to write into the profiles file")
+    return parser.parse_args(argv)
+
+
+def _describe(r):
+    return (f"{r['time'] * 1000:9.1f} ms  error {r['error']:5.2f}  faces {r['face_scale_factor']}/"
+            f"{r['face_min_neighbors']} min {r['face_min_size']}  eyes {r['eye_scale_factor']}/"
+            f"{r['eye_min_neighbors']}  downscale {r['downscale']}")
+
+
+def main(argv=None):
+    """
+    Tuner entry:
+     * Measures every setting of the sweep and prints the Pareto frontier
+     * Writes the JSON report
+     * Writes the chosen profiles into the profiles file
+    :return: Process exit code
+    """
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    try:
+        images = load_labels(args.labels)
+    except IOError as e:
+        print(e)
+        return 1
+
+    profiles = profile_grid({name: getattr(args, name) for name in DEFAULT_GRID})
+    print(f"Sweeping {len(profiles)} settings over {len(images)} images")
+    results = run_sweep(images, profiles, args.repeat, progress=lambda r: print(_describe(r)))
+
+    frontier = pareto_frontier(results)
+    chosen = choose_profiles(frontier)
+    print("\nPareto frontier:")
+    for r in frontier:
+        names = [name for (name, c) in chosen.items() if c is r]
+        print(f"{_describe(r)}  {' '.join(names)}".rstrip())
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"images": [path for (path, _, _, _) in images], "results": results, "frontier": frontier,
+                       "profiles": chosen}, f, indent=2)
+
+    if args.write:
+        detector.save_profiles({name: chosen[name] for name in args.write}, args.profiles)
+        print(f"\nWrote the {', '.join(args.write)} profile(s) to {args.profiles}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
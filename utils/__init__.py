@@ -1,3 +1,7 @@
 from .processing_utils import *
+from .kernel_utils import *
+from .instrumentation import *
+from .image_statistics import *
 
-__all__ = ['ProcessingBehavior', "Cascades", "Kernels"]
+__all__ = ['ProcessingBehavior', "Cascades", "CascadeRegistry", "Kernels", "DisplaySurface", "factor_kernel",
+           "apply_kernel", "Instrumentation", "ImageStatistics", "StatisticsCache"]
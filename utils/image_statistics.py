@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+# Histogram bins, one per 8 bit intensity
+HISTOGRAM_BINS = 256
+
+# Size of drawn histograms (width, height)
+HISTOGRAM_SIZE = (256, 100)
+
+# Channel names and drawing colors (BGR), by number of channels
+CHANNEL_NAMES = {1: ("Gray",), 3: ("Blue", "Green", "Red"), 4: ("Blue", "Green", "Red", "Alpha")}
+CHANNEL_COLORS = {1: ((220, 220, 220),), 3: ((255, 96, 0), (0, 200, 0), (0, 0, 255)),
+                  4: ((255, 96, 0), (0, 200, 0), (0, 0, 255), (160, 160, 160))}
+
+# Number of cached statistics
+DEFAULT_CACHE_ENTRIES = 8
+
+
+class ImageStatistics:
+    """
+    Per channel histograms, mean, standard deviation and clipping of an 8 bit image. The histograms are computed
+    with one cv2.calcHist pass per channel, everything else is derived from them without touching the pixels again
+    """
+
+    def __init__(self, image):
+        """
+        Constructor, computes the statistics
+        :param image: 8 bit image (grayscale, BGR or BGRA)
+        """
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        self.pixels = image.shape[0] * image.shape[1]
+        self.names = CHANNEL_NAMES.get(channels, tuple(str(c) for c in range(channels)))
+        self.histograms = np.stack([cv2.calcHist([image], [c], None, [HISTOGRAM_BINS], [0, HISTOGRAM_BINS]).ravel()
+                                    for c in range(channels)])
+
+        levels = np.arange(HISTOGRAM_BINS, dtype=np.float64)
+        self.means = self.histograms @ levels / self.pixels
+        variances = self.histograms @ (levels * levels) / self.pixels - self.means * self.means
+        self.stds = np.sqrt(np.maximum(variances, 0))
+        # Share of pixels at the ends of the range (percent), which brightness/contrast changes can not bring back
+        self.clipped_low = self.histograms[:, 0] * 100 / self.pixels
+        self.clipped_high = self.histograms[:, -1] * 100 / self.pixels
+
+    def summary(self):
+        """
+        Human readable statistics, one line per channel
+        :return: The summary text
+        """
+        return "\n".join(f"{name:<5} mean {mean:6.1f}  std {std:5.1f}  clipped {low:5.2f}% / {high:5.2f}%"
+                         for (name, mean, std, low, high)
+                         in zip(self.names, self.means, self.stds, self.clipped_low, self.clipped_high))
+
+    def draw(self, size=HISTOGRAM_SIZE):
+        """
+        Draw the histograms, every channel in its color over a shared (linear) count axis
+        :param size: (width, height) of the drawing
+        :return: BGR image of the histograms
+        """
+        (w, h) = size
+        canvas = np.zeros((h, w, 3), np.uint8)
+        colors = CHANNEL_COLORS.get(len(self.histograms), CHANNEL_COLORS[1] * len(self.histograms))
+
+        peak = max(self.histograms.max(), 1)
+        x = np.linspace(0, w - 1, HISTOGRAM_BINS)
+        for (histogram, color) in zip(self.histograms, colors):
+            y = (h - 1) - histogram * (h - 1) / peak
+            points = np.round(np.stack([x, y], axis=1)).astype(np.int32)
+            cv2.polylines(canvas, [points], False, color, 1, cv2.LINE_AA)
+        return canvas
+
+
+class StatisticsCache:
+    """
+    Small (least recently used) cache of ImageStatistics, keyed by the identity of the image they were computed from
+    and by the processing values. Images are replaced rather than changed in place, so unchanged inputs are never
+    computed twice. Entries keep their image alive, so an identity is never reused while it is cached
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        """
+        Constructor
+        :param max_entries: Maximum number of cached statistics
+        """
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, image, source=None, values=None):
+        """
+        Get the statistics of an image, computing them when they are not cached
+        :param image: The image
+        :param source: Image the image was processed from, statistics are then cached by the source and the values
+                       (rather than by the image itself)
+        :param values: Mapping of the processing values the image was processed with
+        :return: The ImageStatistics
+        """
+        anchor = image if source is None else source
+        key = (id(anchor), tuple(sorted((values or {}).items())))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is anchor:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Computed outside of the lock, at worst the statistics are computed twice
+        statistics = ImageStatistics(image)
+        with self._lock:
+            self._entries[key] = (anchor, statistics)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return statistics
+
+    def clear(self):
+        """
+        Drop every cached statistics
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
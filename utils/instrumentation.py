@@ -0,0 +1,308 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+# Latency histogram buckets are powers of two of this base latency (seconds): bucket i holds latencies up to
+# BUCKET_BASE * 2 ** i, which covers 1us up to over half an hour in NUM_BUCKETS buckets
+BUCKET_BASE = 1e-6
+NUM_BUCKETS = 32
+
+# Maximum number of trace events kept, older events are dropped first
+TRACE_CAPACITY = 100000
+
+# Environment variable enabling instrumentation at startup
+ENABLE_VARIABLE = "DEJAVU_INSTRUMENTATION"
+
+
+class LatencyHistogram:
+    """Histogram of latencies in logarithmic (power of two) buckets, with count, total, min and max"""
+
+    def __init__(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds):
+        """
+        Record a latency
+        :param seconds: Latency (seconds)
+        :return:
+        """
+        bucket = math.frexp(seconds / BUCKET_BASE)[1] if seconds > BUCKET_BASE else 0
+        self.buckets[min(bucket, NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def mean(self):
+        """
+        Mean latency
+        :return: Mean latency (seconds), 0 when nothing was recorded
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """
+        Approximate latency percentile: the upper bound of the bucket holding it (clamped to the recorded range)
+        :param p: Percentile (0 - 100)
+        :return: Latency (seconds), 0 when nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+
+        rank = p / 100 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(max(BUCKET_BASE * 2 ** i, self.min), self.max)
+
+        return self.max
+
+    def to_dict(self):
+        """
+        Summary of the histogram
+        :return: Dictionary of the count, total, min, max, mean, p50, p95, p99 (seconds) and the bucket counts
+        """
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {f"{BUCKET_BASE * 2 ** i:.0e}": n for (i, n) in enumerate(self.buckets) if n}
+        }
+
+
+class _NullSpan:
+    """Span used while instrumentation is disabled, does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Span:
+    """Timed span, records its latency when it ends"""
+
+    __slots__ = ("_instrumentation", "_name", "_start")
+
+    def __init__(self, instrumentation, name):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._instrumentation.record(self._name, self._start, time.perf_counter() - self._start)
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation:
+    """
+    Opt-in latency instrumentation: named spans record latency histograms and counts, and optionally trace events
+    While disabled, a span is a shared no-op context, so instrumented code only pays for an attribute check
+    """
+
+    def __init__(self, enabled=False, trace=True):
+        """
+        Constructor
+        :param enabled: Record spans
+        :param trace: Also keep a trace event of every span (for Chrome traces)
+        """
+        self.enabled = enabled
+        self._trace = trace
+        self._histograms = {}                       # Mapping of span names to their LatencyHistograms
+        self._counters = {}                         # Mapping of counter names to their counts
+        self._events = deque(maxlen=TRACE_CAPACITY)  # Trace events (name, start, duration, thread id)
+        self._lock = threading.Lock()
+
+    def enable(self, trace=True):
+        """
+        Start recording
+        :param trace: Also keep trace events
+        :return:
+        """
+        self._trace = trace
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop recording, the recorded data is kept
+        :return:
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drop everything recorded so far
+        :return:
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._events.clear()
+
+    def span(self, name):
+        """
+        Time a block of code: with instrumentation.span("name"): ...
+        :param name: Span name, spans are grouped as category/name (ie: "detector/faces")
+        :return: A context manager
+        """
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def record(self, name, start, duration):
+        """
+        Record the latency of a span
+        :param name: Span name
+        :param start: Span start (time.perf_counter)
+        :param duration: Span duration (seconds)
+        :return:
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.record(duration)
+            if self._trace:
+                self._events.append((name, start, duration, threading.get_ident()))
+
+    def count(self, name, n=1):
+        """
+        Increment a counter (ie: dropped frames)
+        :param name: Counter name
+        :param n: Increment
+        :return:
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + n
+
+    def histogram(self, name):
+        """
+        Get the latency histogram of a span
+        :param name: Span name
+        :return: The LatencyHistogram, or None when the span was never recorded
+        """
+        return self._histograms.get(name)
+
+    def stats(self):
+        """
+        Snapshot of everything recorded
+        :return: Dictionary of span summaries and counters
+        """
+        with self._lock:
+            return {
+                "spans": {name: h.to_dict() for (name, h) in sorted(self._histograms.items())},
+                "counters": dict(sorted(self._counters.items()))
+            }
+
+    def summary(self):
+        """
+        Human readable summary, one line per span and counter
+        :return: Summary text
+        """
+        stats = self.stats()
+        lines = [f"{'span':<36}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}  (ms)"]
+        for (name, s) in stats["spans"].items():
+            lines.append(f"{name:<36}{s['count']:>8}" + "".join(
+                f"{s[k] * 1000:>10.2f}" for k in ("mean", "p50", "p95", "max")))
+        for (name, n) in stats["counters"].items():
+            lines.append(f"{name:<36}{n:>8}")
+        return "\n".join(lines)
+
+    def dump_json(self, path):
+        """
+        Write the recorded statistics to a JSON file
+        :param path: Output file path
+        :return:
+        """
+        with open(path, "w") as f:
+            json.dump(self.stats(), f, indent=2)
+
+    def dump_chrome_trace(self, path):
+        """
+        Write the trace events to a Chrome trace file (chrome://tracing, Perfetto)
+        :param path: Output file path
+        :return:
+        """
+        with self._lock:
+            events = list(self._events)
+
+        pid = os.getpid()
+        trace = [{
+            "name": name,
+            "cat": name.split("/")[0],
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid
+        } for (name, start, duration, tid) in events]
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+class RateMeter:
+    """Event rate (ie: frames per second) over a sliding time window"""
+
+    def __init__(self, window=1.0):
+        """
+        Constructor
+        :param window: Length of the averaging window (seconds)
+        """
+        self._window = window
+        self._times = deque()
+
+    def tick(self):
+        """
+        Record an event
+        :return: The current rate (events per second)
+        """
+        now = time.perf_counter()
+        self._times.append(now)
+        while now - self._times[0] > self._window:
+            self._times.popleft()
+        return self.rate()
+
+    def rate(self):
+        """
+        Current rate
+        :return: Events per second over the window, 0 with less than two events
+        """
+        if len(self._times) < 2:
+            return 0.0
+        elapsed = self._times[-1] - self._times[0]
+        return (len(self._times) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+# Shared instrumentation of this process
+INSTRUMENTATION = Instrumentation(enabled=os.environ.get(ENABLE_VARIABLE, "") not in ("", "0"))
+
+
+def span(name):
+    """
+    Time a block of code on the shared instrumentation
+    :param name: Span name
+    :return: A context manager
+    """
+    return INSTRUMENTATION.span(name)
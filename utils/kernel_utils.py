@@ -0,0 +1,237 @@
+import threading
+import time
+import cv2
+import numpy as np
+from functools import lru_cache
+
+
+# Singular values below this fraction of the largest singular value are treated as zero
+RANK_TOLERANCE = 1e-6
+
+# Largest supported kernel size (rows or cols)
+MAX_KERNEL_SIZE = 101
+
+# Kernel sizes (and test image size) timed to find the crossover between spatial and FFT based filtering
+CROSSOVER_KERNEL_SIZES = (9, 15, 25, 41, 65, 101)
+CROSSOVER_IMAGE_SIZE = (512, 512)
+
+# Measured kernel size from which FFT based filtering is faster, None until measured
+_fft_crossover = None
+_fft_crossover_lock = threading.Lock()
+
+
+def factor_kernel(kernel):
+    """
+    Factor a kernel into a sum of separable (rank-1) terms with an SVD, when filtering with the terms is cheaper
+    than filtering with the dense kernel. Factorizations are cached per kernel
+    :param kernel: 2D filtering kernel
+    :return: A tuple of (kernel_y, kernel_x) 1D kernel pairs (column and row) which sum up to the kernel, or None
+             when the kernel is cheaper to apply densely
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.ndim != 2:
+        return None
+
+    return _factor_kernel(kernel.shape, kernel.tobytes())
+
+
+@lru_cache(maxsize=256)
+def _factor_kernel(shape, data):
+    """
+    Cached kernel factorization
+    :param shape: Kernel (rows, cols)
+    :param data: Kernel bytes (float64)
+    :return: See factor_kernel
+    """
+    kernel = np.frombuffer(data, dtype=np.float64).reshape(shape)
+    (u, s, vt) = np.linalg.svd(kernel)
+    if s[0] == 0:
+        return None
+
+    rank = int(np.count_nonzero(s > s[0] * RANK_TOLERANCE))
+
+    # Dense filtering costs rows * cols per pixel, every separable term costs rows + cols (and an accumulation)
+    (rows, cols) = shape
+    separable_cost = rows + cols if rank == 1 else rank * (rows + cols + 2)
+    if separable_cost >= rows * cols:
+        return None
+
+    terms = []
+    for i in range(rank):
+        # The row kernel keeps unit length, the column kernel carries the singular value
+        (kernel_y, kernel_x) = (u[:, i] * s[i], vt[i])
+        if kernel_x.sum() < 0:
+            (kernel_y, kernel_x) = (-kernel_y, -kernel_x)
+        terms.append((kernel_y, kernel_x))
+
+    return tuple(terms)
+
+
+def load_kernel(path):
+    """
+    Load a kernel from a text file, one kernel row per line with whitespace or comma separated values
+    :param path: Path to the kernel file
+    :return: The kernel as a float64 array
+    """
+    with open(path) as f:
+        return parse_kernel(f.read())
+
+
+def parse_kernel(text):
+    """
+    Parse a kernel, one kernel row per line with whitespace or comma separated values
+    :param text: Kernel text
+    :return: The kernel as a float64 array
+    """
+    rows = [line.replace(",", " ").split() for line in text.splitlines()]
+    rows = [row for row in rows if row]
+
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError("Every kernel row needs the same number of values")
+    if len(rows) > MAX_KERNEL_SIZE or len(rows[0]) > MAX_KERNEL_SIZE:
+        raise ValueError(f"Kernels can be at most {MAX_KERNEL_SIZE}x{MAX_KERNEL_SIZE}")
+
+    kernel = np.array(rows, dtype=np.float64)
+    if not np.isfinite(kernel).all():
+        raise ValueError("Kernel values must be finite numbers")
+    return kernel
+
+
+def fft_crossover():
+    """
+    Kernel size from which FFT based filtering is faster than spatial filtering, measured once per process (waiting
+    for a measurement already running, see calibrate_in_background)
+    :return: Kernel size (rows * cols >= size ** 2 uses the FFT), or None when the FFT was never faster
+    """
+    global _fft_crossover
+    if _fft_crossover is None:
+        with _fft_crossover_lock:
+            if _fft_crossover is None:
+                _fft_crossover = calibrate_crossover()
+    return _fft_crossover or None
+
+
+def calibrate_in_background():
+    """
+    Measure the FFT crossover on a background thread (ie: once an application started up), so the first filtering
+    with a large kernel does not pay for the measurement on the calling (GUI) thread
+    :return: The calibration thread
+    """
+    thread = threading.Thread(target=fft_crossover, name="FFTCalibration", daemon=True)
+    thread.start()
+    return thread
+
+
+def calibrate_crossover(sizes=CROSSOVER_KERNEL_SIZES, image_size=CROSSOVER_IMAGE_SIZE):
+    """
+    Time spatial and FFT based filtering of a random image with growing (non-separable) kernels
+    :param sizes: Kernel sizes to time, in increasing order
+    :param image_size: (width, height) of the timed image
+    :return: The smallest kernel size for which the FFT was faster, or 0 if it never was
+    """
+    rng = np.random.RandomState(0)
+    image = rng.randint(0, 256, (image_size[1], image_size[0], 3)).astype(np.uint8)
+
+    for size in sizes:
+        kernel = rng.rand(size, size)
+        timings = []
+        for f in (lambda: cv2.filter2D(image, -1, kernel), lambda: fft_filter(image, kernel)):
+            f()
+            start = time.perf_counter()
+            f()
+            timings.append(time.perf_counter() - start)
+
+        if timings[1] < timings[0]:
+            return size
+
+    return 0
+
+
+def fft_filter(image, kernel):
+    """
+    Filter an image with a kernel through the frequency domain, giving the same result as cv2.filter2D (correlation,
+    reflected borders, centered anchor). Kernel spectra are cached per kernel and transform size
+    :param image: Image to filter
+    :param kernel: 2D filtering kernel
+    :return: The filtered image, with the same depth as the input image
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    (kh, kw) = kernel.shape
+    (h, w) = image.shape[:2]
+    (ax, ay) = (kw // 2, kh // 2)
+
+    # Reflect the borders so the circular correlation never wraps around into the image
+    dft_size = (cv2.getOptimalDFTSize(h + kh - 1), cv2.getOptimalDFTSize(w + kw - 1))
+    spectrum = _kernel_spectrum(kernel.shape, kernel.tobytes(), dft_size)
+
+    channels = []
+    for channel in cv2.split(image):
+        padded = np.zeros(dft_size, dtype=np.float32)
+        padded[:h + kh - 1, :w + kw - 1] = cv2.copyMakeBorder(
+            channel, ay, kh - 1 - ay, ax, kw - 1 - ax, cv2.BORDER_REFLECT_101)
+        product = cv2.mulSpectrums(cv2.dft(padded), spectrum, 0, conjB=True)
+        channels.append(cv2.idft(product, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)[:h, :w])
+
+    result = _to_depth(cv2.merge(channels) if len(channels) > 1 else channels[0], image.dtype)
+    return result.reshape(image.shape)
+
+
+@lru_cache(maxsize=32)
+def _kernel_spectrum(shape, data, dft_size):
+    """
+    Cached spectrum of a kernel, zero padded to the transform size
+    :param shape: Kernel (rows, cols)
+    :param data: Kernel bytes (float64)
+    :param dft_size: Transform (rows, cols)
+    :return: The kernel spectrum (packed CCS format, like cv2.dft)
+    """
+    padded = np.zeros(dft_size, dtype=np.float32)
+    padded[:shape[0], :shape[1]] = np.frombuffer(data, dtype=np.float64).reshape(shape)
+    return cv2.dft(padded)
+
+
+def apply_kernel(image, kernel):
+    """
+    Filter an image with a kernel (correlation, like cv2.filter2D), picking the cheapest backend:
+     * separable and low-rank kernels go through cv2.sepFilter2D, costing O(k) rather than O(k^2) per pixel
+     * large dense kernels go through the FFT, from the measured crossover size on
+     * everything else through cv2.filter2D
+    :param image: Image to filter
+    :param kernel: 2D filtering kernel
+    :return: The filtered image, with the same depth as the input image
+    """
+    terms = factor_kernel(kernel)
+    if terms is None:
+        kernel = np.asarray(kernel, dtype=np.float64)
+        if kernel.size >= CROSSOVER_KERNEL_SIZES[0] ** 2:
+            crossover = fft_crossover()
+            if crossover is not None and kernel.size >= crossover ** 2:
+                return fft_filter(image, kernel)
+
+        return cv2.filter2D(image, -1, kernel)
+
+    if len(terms) == 1:
+        (kernel_y, kernel_x) = terms[0]
+        return cv2.sepFilter2D(image, -1, kernel_x, kernel_y)
+
+    # Low rank kernels: every term is accumulated at float precision, and rounded/saturated once at the end
+    result = None
+    for (kernel_y, kernel_x) in terms:
+        filtered = cv2.sepFilter2D(image, cv2.CV_32F, kernel_x, kernel_y)
+        result = filtered if result is None else cv2.add(result, filtered)
+
+    return _to_depth(result, image.dtype)
+
+
+def _to_depth(image, dtype):
+    """
+    Round and saturate a float image to a given depth
+    :param image: Float image
+    :param dtype: Target dtype
+    :return: The converted image
+    """
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(image), info.min, info.max).astype(dtype)
+
+    return image.astype(dtype)
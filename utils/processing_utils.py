@@ -1,9 +1,23 @@
+import hashlib
+import os
+import threading
 import cv2
 import numpy as np
 from enum import Enum
+from utils import instrumentation
 
-from PyQt5 import QtCore
-from PyQt5.QtGui import QImage, QPixmap
+
+# Directory of the bundled cascade files, resolved relative to the package rather than the working directory
+CASCADES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cascades")
+
+# Maximum (width, height) an image is displayed at
+DISPLAY_SIZE = (500, 500)
+
+# Reduction factors of reduced size image decoding, with their imread flags (largest reduction first)
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# Color of overlay text (BGR)
+OVERLAY_COLOR = (255, 255, 255)
 
 
 class ProcessingBehavior:
@@ -17,18 +31,116 @@ class ProcessingBehavior:
 
 
 class Cascades:
-    """Cascade helper which contains an easy way to import and store cascades"""
+    """Cascade helper which contains an easy way to access the shared cascade classifiers"""
 
     class CascadeList(Enum):
         """Cascade list enum class"""
         EYE_CASCADE = 0
         FACE_CASCADE = 1
 
-    def __init__(self):
-        self.cascades_list = {
-            self.CascadeList.EYE_CASCADE: cv2.CascadeClassifier("cascades/haarcascade_eye.xml"),
-            self.CascadeList.FACE_CASCADE: cv2.CascadeClassifier("cascades/haarcascade_frontalface.xml")
-        }
+    # Cascade file of each cascade, inside CASCADES_DIR
+    CASCADE_FILES = {
+        CascadeList.EYE_CASCADE: "haarcascade_eye.xml",
+        CascadeList.FACE_CASCADE: "haarcascade_frontalface.xml"
+    }
+
+    def __init__(self, registry=None):
+        # Classifiers are owned by the registry, nothing is loaded until a classifier is requested
+        self._registry = registry if registry is not None else CASCADE_REGISTRY
+
+    def classifier(self, cascade):
+        """
+        Get the classifier of a cascade for the calling thread
+        :param cascade: Cascades.CascadeList entry
+        :return: A cv2.CascadeClassifier
+        """
+        return self._registry.get(cascade)
+
+    def digest(self, cascade):
+        """
+        Content hash of a cascade
+        :param cascade: Cascades.CascadeList entry
+        :return: Hex digest of the cascade XML
+        """
+        return self._registry.digest(cascade)
+
+
+class CascadeRegistry:
+    """
+    Process wide registry of cascade classifiers
+    Each cascade file is read once per process, on first use. Classifiers are parsed from the in-memory
+    cascade and handed out per thread, since a cv2.CascadeClassifier must not be shared between threads
+    """
+
+    def __init__(self, directory=None):
+        self._directory = directory if directory is not None else CASCADES_DIR
+        self._lock = threading.Lock()
+        self._sources = {}                  # Mapping of cascades to their XML contents
+        self._digests = {}                  # Mapping of cascades to the hashes of their XML contents
+        self._local = threading.local()     # Per thread mapping of cascades to their classifiers
+
+    def path(self, cascade):
+        """
+        Path of a cascade file
+        :param cascade: Cascades.CascadeList entry
+        :return: Absolute path to the cascade XML file
+        """
+        return os.path.join(self._directory, Cascades.CASCADE_FILES[cascade])
+
+    def source(self, cascade):
+        """
+        XML contents of a cascade, read from disk the first time it is requested
+        :param cascade: Cascades.CascadeList entry
+        :return: The cascade XML string
+        """
+        with self._lock:
+            if cascade not in self._sources:
+                with open(self.path(cascade)) as f:
+                    self._sources[cascade] = f.read()
+            return self._sources[cascade]
+
+    def digest(self, cascade):
+        """
+        Content hash of a cascade, so results of a changed cascade file can be told apart
+        :param cascade: Cascades.CascadeList entry
+        :return: Hex digest of the cascade XML
+        """
+        digest = self._digests.get(cascade)
+        if digest is None:
+            digest = self._digests[cascade] = hashlib.sha1(self.source(cascade).encode()).hexdigest()
+        return digest
+
+    def preload(self):
+        """
+        Read every cascade file, so that forked worker processes inherit them instead of reading them again
+        :return:
+        """
+        for cascade in Cascades.CascadeList:
+            self.source(cascade)
+
+    def get(self, cascade):
+        """
+        Get the classifier of a cascade for the calling thread, parsing it on first use
+        :param cascade: Cascades.CascadeList entry
+        :return: A cv2.CascadeClassifier
+        """
+        classifiers = getattr(self._local, "classifiers", None)
+        if classifiers is None:
+            classifiers = self._local.classifiers = {}
+
+        classifier = classifiers.get(cascade)
+        if classifier is None:
+            storage = cv2.FileStorage(self.source(cascade), cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+            classifier = cv2.CascadeClassifier()
+            if not classifier.read(storage.getFirstTopLevelNode()):
+                raise IOError(f"Could not load cascade {self.path(cascade)}")
+            classifiers[cascade] = classifier
+
+        return classifier
+
+
+# Shared cascade registry of this process
+CASCADE_REGISTRY = CascadeRegistry()
 
 
 class Kernels:
@@ -85,33 +197,159 @@ class Kernels:
         ]
 
 
-def display_img(image, image_label, scale_contents=False):
+def fit_size(shape, bounds=DISPLAY_SIZE):
+    """
+    Size of an image scaled to fit inside given bounds, keeping its aspect ratio
+    :param shape: Image shape (rows, cols, ...)
+    :param bounds: (width, height) to fit the image into
+    :return: The (width, height) of the scaled image
     """
-    Display an image on a given image label
+    (h, w) = shape[:2]
+    scale = min(bounds[0] / w, bounds[1] / h)
+    return max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+
+
+def read_preview(path, bounds=DISPLAY_SIZE):
+    """
+    Decode a reduced size version of an image file, at least as large as the given bounds. JPEG files are scaled
+    while decoding (the decoder skips most of the work), which makes this much faster than a full decode
+    :param path: Image file path
+    :param bounds: (width, height) the preview should cover
+    :return: A 2-tuple of (preview image, reduction factor), or (None, 0) when the file can not be read
+    """
+    # The smallest decode is cheap, and tells the (approximate) image size without decoding it fully
+    image = cv2.imread(path, REDUCED_READ_FLAGS[0][1])
+    if image is None:
+        return None, 0
+
+    (h, w) = image.shape[:2]
+    largest = REDUCED_READ_FLAGS[0][0]
+    for (factor, flag) in REDUCED_READ_FLAGS:
+        # Largest reduction whose preview still needs downscaling (rather than upscaling) to fit the bounds
+        if w * largest // factor >= bounds[0] or h * largest // factor >= bounds[1]:
+            return (image, factor) if factor == largest else (cv2.imread(path, flag), factor)
+
+    return cv2.imread(path, cv2.IMREAD_COLOR), 1
+
+
+def resize_to_fit(image, bounds=DISPLAY_SIZE):
+    """
+    Downscale an image to fit inside given bounds (a proxy of the image), images that already fit are kept
+    :param image: The image to downscale
+    :param bounds: (width, height) to fit the image into
+    :return: The downscaled image, or the image itself when it already fits
+    """
+    (h, w) = image.shape[:2]
+    if w <= bounds[0] and h <= bounds[1]:
+        return image
+
+    return cv2.resize(image, fit_size(image.shape, bounds), interpolation=cv2.INTER_AREA)
+
+
+class DisplaySurface:
+    """
+    Display target of a QLabel. Images are scaled into a preallocated display buffer, which is converted from BGR to
+    RGB in place and wrapped (not copied) by a QImage, and the label's pixmap is updated in place. Displaying an image
+    thus costs one resize and one color conversion at display size, without allocating anything per frame
+    """
+
+    def __init__(self, image_label, bounds=DISPLAY_SIZE):
+        """
+        Constructor
+        :param image_label: The QLabel to display images on
+        :param bounds: (width, height) to fit displayed images into
+        """
+        self._label = image_label
+        self._bounds = bounds
+        self._buffer = None     # Display sized image buffer, referenced by the QImage
+        self._q_image = None    # QImage wrapping the buffer
+        self._pixmap = None     # Pixmap shown by the label
+
+    def buffer(self):
+        """
+        Get the display buffer
+        :return: The buffer holding the displayed (RGB) image, or None before anything was displayed
+        """
+        return self._buffer
+
+    def show(self, image, scale_contents=False, detections=None, overlay=None):
+        """
+        Display an image on the label
+        :param image: The image to display (from openCV)
+        :param scale_contents: Scale the contents to the label
+        :param detections: Optional DetectionResult (in image coordinates) to draw over the displayed image
+        :param overlay: Optional lines of text to draw in the top left corner
+        :return:
+        """
+        # Qt is only imported when displaying, so headless processing (batch runs) never loads it
+        from PyQt5 import QtCore
+        from PyQt5.QtGui import QPixmap
+
+        (w, h) = fit_size(image.shape, self._bounds)
+        self._allocate(image, w, h)
+
+        # Scale into the display buffer, so the overlay is only drawn at display resolution
+        cv2.resize(image, (w, h), dst=self._buffer, interpolation=cv2.INTER_AREA)
+        if detections is not None:
+            detections.scaled(w / image.shape[1], h / image.shape[0]).draw(self._buffer)
+        for (i, line) in enumerate(overlay or ()):
+            cv2.putText(self._buffer, line, (8, 20 + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.5, OVERLAY_COLOR, 1,
+                        cv2.LINE_AA)
+
+        # Since openCV loads an image as BGR, we need to convert from BGR -> RBG (in place, the QImage sees it)
+        if self._buffer.ndim == 3:
+            code = cv2.COLOR_BGRA2RGBA if self._buffer.shape[2] == 4 else cv2.COLOR_BGR2RGB
+            cv2.cvtColor(self._buffer, code, dst=self._buffer)
+
+        if self._pixmap is None:
+            self._pixmap = QPixmap.fromImage(self._q_image)
+            # Resize the label to the scaled images width and height
+            self._label.resize(w, h)
+            self._label.setAlignment(QtCore.Qt.AlignHCenter | QtCore.Qt.AlignVCenter)
+        else:
+            self._pixmap.convertFromImage(self._q_image)
+
+        # Set the pixmap again so the label repaints it
+        self._label.setPixmap(self._pixmap)
+        self._label.setScaledContents(scale_contents)
+
+    def _allocate(self, image, w, h):
+        """
+        (Re)allocate the display buffer and its QImage, when the displayed size or format changed
+        :param image: The image to display
+        :param w: Display width
+        :param h: Display height
+        :return:
+        """
+        from PyQt5.QtGui import QImage
+
+        shape = (h, w) + image.shape[2:]
+        if self._buffer is not None and self._buffer.shape == shape:
+            return
+
+        # Ensure the proper image format before storing as a QImage
+        q_format = QImage.Format_Grayscale8
+        if len(shape) == 3:  # rows[0], cols[1], channels[2]
+            q_format = QImage.Format_RGBA8888 if shape[2] == 4 else QImage.Format_RGB888
+
+        self._buffer = np.empty(shape, dtype=np.uint8)
+        self._q_image = QImage(self._buffer.data, w, h, self._buffer.strides[0], q_format)
+        self._pixmap = None
+
+
+def display_img(image, image_label, scale_contents=False, detections=None, overlay=None):
+    """
+    Display an image on a given image label, through the label's DisplaySurface (created on first use)
     :param image: The image to display (from openCV)
     :param image_label: The QLabel to display the image on
     :param scale_contents: Scale the contents to the label
+    :param detections: Optional DetectionResult (in image coordinates) to draw over the displayed image
+    :param overlay: Optional lines of text to draw in the top left corner (ie: frame rate and latencies)
     :return:
     """
-    # Ensure the proper image format before storing as a QImage
-    q_format = QImage.Format_Indexed8
+    surface = getattr(image_label, "display_surface", None)
+    if surface is None:
+        surface = image_label.display_surface = DisplaySurface(image_label)
 
-    if len(image.shape) == 3:  # rows[0], cols[1], channels[2]
-        if image.shape[2] == 4:
-            q_format = QImage.Format_RGBA8888
-        else:
-            q_format = QImage.Format_RGB888
-
-    (h, w) = image.shape[:2]
-    q_image = QImage(image, w, h, image.strides[0], q_format)
-    q_image = q_image.scaled(500, 500, QtCore.Qt.KeepAspectRatio)
-
-    # Since openCV loads an image as BGR, we need to convert from BGR -> RBG
-    img = q_image.rgbSwapped()
-
-    # Resize the label to the scaled images width and height
-    image_label.resize(img.rect().width(), img.rect().height())
-    image_label.setAlignment(QtCore.Qt.AlignHCenter | QtCore.Qt.AlignVCenter)
-    # Set the image -> pixmap -> label
-    image_label.setPixmap(QPixmap.fromImage(img))
-    image_label.setScaledContents(scale_contents)
+    with instrumentation.span("display"):
+        surface.show(image, scale_contents, detections, overlay)
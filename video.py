@@ -0,0 +1,153 @@
+# Python version 3.7
+
+import argparse
+import sys
+
+import cv2
+import batch
+from core import detector
+from core import image_processor as processor
+from core import video_pipeline
+
+
+# Frame rate of the output when the input does not report one
+DEFAULT_FPS = 30.0
+
+
+class FrameProcessor:
+    """Per worker frame processing: the processor chain of the main window, with the detected faces drawn on"""
+
+    def __init__(self, settings, detect=True, detect_eyes=True, profile=None, max_face_size=None):
+        """
+        Constructor
+        :param settings: Mapping of processing settings (brightness, contrast, filter, rotation)
+        :param detect: Run face detection on every frame
+        :param detect_eyes: Also detect eyes in every face
+        :param profile: DetectionProfile, the default profile when not given
+        :param max_face_size: Largest expected face (pixels), large frames are then searched in tiles
+        """
+        self._max_face_size = max_face_size
+        # Frames are already processed in parallel, so eyes (and tiles) are detected sequentially
+        self._detector = detector.Detector(detect_eyes, eye_workers=1, tile_workers=1,
+                                           profile=profile) if detect else None
+        (self._rotation_processor, self._processors) = batch.build_processors(settings)
+        self.faces = 0  # Faces detected over all processed frames
+
+    def close(self):
+        """
+        Release the detector
+        :return:
+        """
+        if self._detector is not None:
+            self._detector.close()
+
+    def __call__(self, frame):
+        """
+        Process a frame
+        :param frame: BGR frame
+        :return: The processed frame
+        """
+        rotated = self._rotation_processor.run(frame, frame)
+        processed = processor.process_chain(self._processors, rotated, rotated)
+
+        # Faces are detected on the rotated frame, before any filtering, so the boxes line up with the output
+        if self._detector is not None:
+            detections = self._detector.detect(cv2.cvtColor(rotated, cv2.COLOR_BGR2GRAY),
+                                               max_face_size=self._max_face_size)
+            self.faces += len(detections)
+            detections.draw(processed)
+
+        return processed
+
+
+def process_video(input_path, output_path, settings, detect=True, detect_eyes=True, workers=None,
+                  queue_size=video_pipeline.VIDEO_QUEUE_SIZE, fourcc="mp4v", profile=None, max_face_size=None):
+    """
+    Process a video file frame by frame, with decode, processing and encode running concurrently
+    :param input_path: Input video path
+    :param output_path: Output video path
+    :param settings: Mapping of processing settings (brightness, contrast, filter, rotation)
+    :param detect: Run face detection on every frame
+    :param detect_eyes: Also detect eyes in every face
+    :param workers: Number of processing threads (defaults to the number of cores)
+    :param queue_size: Size of the queues between the stages
+    :param fourcc: Four character code of the output codec
+    :param profile: DetectionProfile, the default profile when not given
+    :param max_face_size: Largest expected face (pixels), large frames are then searched in tiles
+    :return: A 2-tuple of (VideoPipeline after its run, number of faces detected over all frames)
+    """
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open {input_path}")
+
+    sink = video_pipeline.VideoFileSink(output_path, capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS, fourcc)
+    frame_processors = []
+
+    def create_processor():
+        frame_processor = FrameProcessor(settings, detect, detect_eyes, profile, max_face_size)
+        frame_processors.append(frame_processor)
+        return frame_processor
+
+    pipeline = video_pipeline.VideoPipeline(capture, create_processor, sink,
+                                            workers or video_pipeline.VIDEO_WORKERS, queue_size)
+    try:
+        pipeline.run()
+    finally:
+        capture.release()
+        sink.release()
+        for frame_processor in frame_processors:
+            frame_processor.close()
+
+    return pipeline, sum(p.faces for p in frame_processors)
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments
+    :param argv: Argument list (without the program name)
+    :return: Parsed arguments, with the validated processing settings as args.settings and the detection profile
+             as args.detection_profile
+    """
+    parser = argparse.ArgumentParser(description="Offline face detection and image processing of video files")
+    parser.add_argument("input", help="Input video file")
+    parser.add_argument("-o", "--output", required=True, help="Output video file")
+    batch.add_processing_arguments(parser)
+    parser.add_argument("-j", "--workers", type=batch.positive_int, default=None,
+                        help="Number of processing threads")
+    parser.add_argument("--queue-size", type=batch.positive_int, default=video_pipeline.VIDEO_QUEUE_SIZE,
+                        help="Frames queued between the decode, processing and encode stages")
+    parser.add_argument("--fourcc", default="mp4v", help="Output codec (four character code)")
+    args = parser.parse_args(argv)
+    args.settings = batch.processing_settings(parser, args)
+    args.detection_profile = batch.detection_profile(parser, args)
+
+    if len(args.fourcc) != 4:
+        parser.error("--fourcc must be four characters")
+
+    return args
+
+
+def main(argv=None):
+    """
+    Video entry:
+     * Processes every frame of the input video into the output video
+     * Prints the throughput
+    :return: Process exit code
+    """
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    try:
+        (pipeline, faces) = process_video(args.input, args.output, args.settings, not args.no_detect,
+                                          not args.no_eyes, args.workers, args.queue_size, args.fourcc,
+                                          args.detection_profile, args.max_face_size)
+    except IOError as e:
+        print(e)
+        return 1
+
+    print(f"Processed {pipeline.frames_written} frames in {pipeline.elapsed:.2f}s ({pipeline.fps():.1f} fps), "
+          f"{faces} faces detected")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())